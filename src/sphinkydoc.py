@@ -1,12 +1,14 @@
 """SphinkyDoc script"""
-from sphinkydocext.directives.sphinkydoc import templating_environment
-from sphinkydocext.generate import conf_py
+import inspect
+import json
 import logging
 import optparse
 import os
 import shutil
+import socket
 import subprocess
 import sys
+import time
 
 DESCRIPTION = """Sphinx automated documentation generator and builder script.
 Main purpose is to generate documentation for small projects, which usually does
@@ -39,6 +41,10 @@ parser.add_option("-s", "--script",
                   help="path to the which to generate documentation",
                   dest="scripts", action="append", default=[], 
                   metavar='SCRIPT_PATH')
+parser.add_option("", "--script-timeout",
+                  help="time limit in seconds of running a script for --help",
+                  dest="script_timeout", type="float", default=None, 
+                  metavar="SECONDS")
 parser.add_option("", "--no-validation",
                   dest="validate", action="store_false", default=True)
 parser.add_option("", "--caps-dir",
@@ -49,6 +55,76 @@ parser.add_option("-l", "--caps-literal",
                   metavar="CAPS_FILE",
                   dest="caps_literals", action="append", 
                   default=None)
+parser.add_option("-i", "--incremental",
+                  help="keep the html and temp directories between runs, and "
+                       "regenerate only changed files",
+                  dest="incremental", action="store_true", default=False)
+parser.add_option("", "--cache-dir",
+                  help="directory of persistent caches, which are kept "
+                       "between runs",
+                  dest="cache_dir", default=None, metavar="DIR")
+parser.add_option("", "--doctree-dir",
+                  help="directory of saved Sphinx environment and doctrees, "
+                       "which are kept between runs, and discarded when "
+                       "Sphinx, sphinkydoc or the configuration changes, "
+                       "defaults to .sphinkydoc-cache in the output "
+                       "directory",
+                  dest="doctree_dir", default=None, metavar="DIR")
+parser.add_option("", "--template-cache-dir",
+                  help="directory of persistent bytecode cache of compiled "
+                       "templates",
+                  dest="template_cache_dir", default=None, metavar="DIR")
+parser.add_option("", "--introspection",
+                  help="how modules are introspected: 'import' imports them, "
+                       "'static' parses the sources without importing, "
+                       "defaults to 'import'",
+                  dest="introspection", type="choice", 
+                  choices=["import", "static"], default="import")
+parser.add_option("-j", "--jobs",
+                  help="number of processes generating the documentation, "
+                       "defaults to 1",
+                  dest="jobs", type="int", default=1, metavar="N")
+parser.add_option("", "--shard-threshold",
+                  help="maximum number of members documented on one module "
+                       "page, larger modules get a page for each class and "
+                       "pages of at most N other members",
+                  dest="shard_threshold", type="int", default=None, 
+                  metavar="N")
+parser.add_option("", "--in-process",
+                  help="run Sphinx inside this process, instead of running "
+                       "the sphinx-build.py script",
+                  dest="in_process", action="store_true", default=False)
+parser.add_option("", "--builder",
+                  help="Sphinx builder to use, defaults to 'html'",
+                  dest="builder", default="html", metavar="NAME")
+parser.add_option("-D", "--define",
+                  help="override a setting in Sphinx configuration file",
+                  dest="defines", action="append", default=[], 
+                  metavar="SETTING=VALUE")
+parser.add_option("-E", "--fresh-env",
+                  help="don't use a saved Sphinx environment, always read "
+                       "all files",
+                  dest="fresh_env", action="store_true", default=False)
+parser.add_option("-W", "--warning-is-error",
+                  help="turn Sphinx warnings into errors",
+                  dest="warning_is_error", action="store_true", default=False)
+parser.add_option("-w", "--watch",
+                  help="keep running, and rebuild whenever modules, scripts, "
+                       "caps files, docs or templates change, implies "
+                       "--incremental and --in-process",
+                  dest="watch", action="store_true", default=False)
+parser.add_option("", "--serve",
+                  help="serve the html directory from local HTTP server, "
+                       "open pages are reloaded after rebuilds",
+                  dest="serve", action="store_true", default=False)
+parser.add_option("", "--port",
+                  help="port of the --serve server, defaults to 8000",
+                  dest="port", type="int", default=8000)
+parser.add_option("", "--profile",
+                  help="write timings of the documentation generation stages, "
+                       "and the slowest modules and scripts to FILE, as CSV "
+                       "if it ends with .csv, otherwise as JSON",
+                  dest="profile", metavar="FILE")
     
 # Pylint-disable settings ----------------
 # Todo messages:
@@ -60,33 +136,259 @@ log = logging.getLogger("sphinkydoc")
 CONFIG_FILENAME = 'conf.py'
 SPHINX_DIR = '_temp'
 HTML_DIR = 'html'
+DOCTREE_DIR = '.sphinkydoc-cache'
+DOCTREE_STAMP_FILENAME = 'sphinkydoc-stamp.json'
+
+def parse_defines(defines):
+    """Parses Sphinx configuration overrides.
+    
+    :param defines: List of ``"setting=value"`` strings.
+    :returns: Dictionary of settings and values.
+    :raises ValueError: If some define is not of form ``setting=value``.
+    
+    """
+    overrides = {}
+    for define in defines:
+        if "=" not in define:
+            raise ValueError("-D option argument must be in the form "
+                             "setting=value, not '%s'" % define)
+        key, value = define.split("=", 1)
+        overrides[key] = value
+    return overrides
+
+
+def doctree_stamp(conf_file):
+    """Stamp of the saved Sphinx environment and doctrees.
+    
+    :param conf_file: Path to the generated Sphinx configuration file.
+    :returns: Dictionary of the sphinkydoc and Sphinx versions, and the hash
+        of the configuration file.
+    
+    """
+    from sphinkydocext import __version__
+    from sphinkydocext.manifest import file_hash
+    try:
+        import sphinx
+        sphinx_version = sphinx.__version__
+    except ImportError:
+        sphinx_version = None
+    
+    return {'sphinkydoc' : __version__, 'sphinx' : sphinx_version,
+            'conf_py' : file_hash(conf_file)}
+
+
+def prepare_doctree_dir(doctree_dir, conf_file):
+    """Prepares the persistent doctree directory of Sphinx.
+    
+    Saved environment and doctrees are removed if the stamp of them, see
+    :func:`doctree_stamp`, differs from the stamp saved with them.
+    
+    :param doctree_dir: Doctree directory, created if it does not exist.
+    :param conf_file: Path to the generated Sphinx configuration file.
+    :returns: :const:`True` if the saved environment and doctrees are kept.
+    
+    """
+    stamp = doctree_stamp(conf_file)
+    stamp_file = os.path.join(doctree_dir, DOCTREE_STAMP_FILENAME)
+    
+    try:
+        f = open(stamp_file, 'r')
+        try:
+            previous = json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        previous = None
+    
+    if previous == stamp:
+        return True
+    
+    if os.path.isdir(doctree_dir):
+        log.info("Sphinx, sphinkydoc or configuration changed, removing "
+                 "saved doctrees in '%s'.", doctree_dir)
+        shutil.rmtree(doctree_dir)
+    os.makedirs(doctree_dir)
+    
+    f = open(stamp_file, 'w')
+    try:
+        json.dump(stamp, f)
+    finally:
+        f.close()
+    return False
+
 
 def run_sphinx_build(sphinx_conf_dir, html_dir, dry_run=False,
-                     sphinx_build='sphinx-build.py'):
+                     sphinx_build='sphinx-build.py', builder='html', 
+                     defines=None, fresh_env=False, warning_is_error=False, 
+                     jobs=1, in_process=False, doctree_dir=None):
     """Runs the sphinx-build.py in given directory.
     
     :param sphinx_conf_dir: Configuration directory of sphinx.
+    :param html_dir: Output directory of the build.
     :param dry_run: Dry run, don't do the actual build.
     :param sphinx_build: Sphinx build script location, defaults to 
         'sphinx-build.py', which assumes that it is in path.
+    :param builder: Sphinx builder name.
+    :param defines: List of ``"setting=value"`` configuration overrides.
+    :param fresh_env: Don't use saved environment, read all files.
+    :param warning_is_error: Turn warnings into errors.
+    :param jobs: Number of parallel processes of Sphinx, if supported.
+    :param in_process: Run Sphinx inside this process, using 
+        :func:`run_sphinx_app`.
+    :param doctree_dir: Directory of saved environment and doctrees, defaults
+        to ``.doctrees`` in the output directory.
+    :returns: Exit status of the build, zero on success.
     
     """
+    defines = defines or []
     old_dir = os.getcwd()
     os.chdir(sphinx_conf_dir)
+    try:
+        log.info("Sphinx build, inside directory %s" % os.getcwd())
+        
+        if in_process:
+            log.info("Running Sphinx in process, builder %s" % builder)
+            if dry_run:
+                return 0
+            return run_sphinx_app(".", html_dir, builder=builder,
+                                  confoverrides=parse_defines(defines),
+                                  fresh_env=fresh_env, 
+                                  warning_is_error=warning_is_error, 
+                                  jobs=jobs, doctree_dir=doctree_dir)
+        
+        cmd1 = ["python", sphinx_build, "-b", builder]
+        if doctree_dir:
+            cmd1.extend(["-d", doctree_dir])
+        for define in defines:
+            cmd1.extend(["-D", define])
+        if fresh_env:
+            cmd1.append("-E")
+        if warning_is_error:
+            cmd1.append("-W")
+        if jobs > 1:
+            cmd1.extend(["-j", str(jobs)])
+        cmd1.extend([".", html_dir])
+        log.info("Running sphinx-build: %s" % subprocess.list2cmdline(cmd1))
+        
+        if dry_run:
+            return 0
+        return subprocess.call(cmd1)
+    finally:
+        os.chdir(old_dir)
+
+
+def run_sphinx_app(source_dir, output_dir, builder='html', confoverrides=None,
+                   fresh_env=False, warning_is_error=False, jobs=1, 
+                   doctree_dir=None):
+    """Runs Sphinx inside this process, like sphinx-build.py does.
     
-    # TODO: FEATURE: Option passing to sphinx-build.py
+    Modules already imported, e.g. by the configuration validation, are not
+    imported again.
     
-    cmd1 = ["python", sphinx_build, ".", html_dir]
-    log.info("Sphinx build, inside directory %s" % os.getcwd())
-    log.info("Running sphinx-build: %s" % subprocess.list2cmdline(cmd1))
+    :param source_dir: Source and configuration directory of Sphinx.
+    :param output_dir: Output directory of the build.
+    :param builder: Sphinx builder name.
+    :param confoverrides: Dictionary of configuration overrides.
+    :param fresh_env: Don't use saved environment, read all files.
+    :param warning_is_error: Turn warnings into errors.
+    :param jobs: Number of parallel processes, if Sphinx supports it.
+    :param doctree_dir: Directory of saved environment and doctrees, defaults
+        to ``.doctrees`` in the output directory.
+    :returns: Exit status of the build, zero on success.
     
-    if not dry_run:
-        subprocess.call(cmd1)
+    """
+    from sphinx.application import Sphinx
     
-    os.chdir(old_dir)
+    source_dir = os.path.abspath(source_dir)
+    output_dir = os.path.abspath(output_dir)
+    doctree_dir = os.path.abspath(doctree_dir or 
+                                  os.path.join(output_dir, '.doctrees'))
+    
+    kwargs = {}
+    if jobs > 1:
+        if 'parallel' in inspect.getargspec(Sphinx.__init__)[0]:
+            kwargs['parallel'] = jobs
+        else:
+            log.info("Sphinx does not support parallel builds.")
+    
+    # Ignore the Exception catch, failed build is reported by exit status
+    # pylint: disable-msg=W0703
+    try:
+        app = Sphinx(source_dir, source_dir, output_dir, doctree_dir, builder,
+                     confoverrides or {}, sys.stdout, sys.stderr, fresh_env,
+                     warning_is_error, **kwargs)
+        app.build()
+    except Exception, e:
+        log.exception("Sphinx build failed: %s" % e)
+        return 1
+    # pylint: enable-msg=W0703
+    return app.statuscode
+
+
+def watch_and_build(watcher, modules, template_dirs, build, rebuilt=None):
+    """Rebuilds whenever the watched files change, until interrupted.
+    
+    :param watcher: Watcher, see :func:`sphinkydocext.watch.create_watcher`.
+    :param modules: Root module names, which are imported again on rebuild.
+    :param template_dirs: Template directories, templating environments are
+        recreated if files in these change.
+    :param build: Function doing the build, returns exit status.
+    :param rebuilt: Function called after each rebuild, or :const:`None`.
+    :returns: Exit status of the last build.
+    
+    """
+    from sphinkydocext.templating import invalidate_templating_environments
+    from sphinkydocext.watch import purge_modules
+    
+    status = 0
+    log.warning("Watching for changes, press Ctrl+C to stop.")
+    try:
+        while True:
+            changed = watcher.wait()
+            log.warning("Rebuilding, changed: %s", ", ".join(changed))
+            
+            purge_modules(modules)
+            for tdir in template_dirs:
+                tdir = os.path.join(os.path.abspath(tdir), "")
+                if [p for p in changed if p.startswith(tdir)]:
+                    invalidate_templating_environments()
+                    break
+            
+            start = time.time()
+            status = build()
+            log.warning("Rebuild %s in %.2f seconds.", 
+                        status and "failed" or "succeeded", 
+                        time.time() - start)
+            if rebuilt is not None:
+                rebuilt()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return status
 
 if __name__ == '__main__':
     (options, modules) = parser.parse_args()
+    
+    # Imported only for the build, e.g. --help needs none of these
+    from sphinkydocext.templating import templating_environment, \
+        TEMPLATES_DIR
+    from sphinkydocext.generate import conf_py, CAPS_FILENAME
+    from sphinkydocext.manifest import MANIFEST_FILENAME
+    
+    # Watching keeps the process warm, and rebuilds incrementally
+    if options.watch:
+        options.incremental = True
+        options.in_process = True
+    
+    profile_file = options.profile and os.path.realpath(options.profile)
+    if profile_file:
+        options.defines.append("sphinkydoc_profile=%s" % profile_file)
+    
+    try:
+        parse_defines(options.defines)
+    except ValueError, e:
+        parser.error(str(e))
         
     sphinx_project = '%s.__project__' % modules[0]
     sphinx_copyright = '%s.__copyright__' % modules[0]
@@ -108,19 +410,46 @@ if __name__ == '__main__':
     # Temp directory inside the docs
     temp_dir = os.path.join(output_dir, SPHINX_DIR)
     html_dir = os.path.join(output_dir, HTML_DIR)
+    doctree_dir = os.path.abspath(options.doctree_dir or 
+                                  os.path.join(output_dir, DOCTREE_DIR))
     caps_dir = options.caps_dir
     caps_literals = options.caps_literals
     docs_dir = output_dir
     scripts = options.scripts
     
+    # The report is rewritten on each build, it is neither a doc nor a change
+    if profile_file and profile_file.startswith(
+            os.path.join(os.path.realpath(docs_dir), '')):
+        log.warning("Profile report '%s' is inside the output directory "
+                    "'%s', it is not copied to the docs nor watched.", 
+                    profile_file, docs_dir)
+    
+    # Directories of the build in the docs directory, neither copied to the
+    # Sphinx source directory nor watched
+    skip_dirs = [HTML_DIR, SPHINX_DIR, os.path.basename(doctree_dir)]
+    for cache_dir in (options.cache_dir, options.template_cache_dir):
+        if cache_dir:
+            skip_dirs.append(os.path.basename(os.path.realpath(cache_dir)))
+    
+    # Incremental build requires manifest of the previous build, otherwise the
+    # files in temp directory cannot be trusted and we start from scratch.
+    incremental = options.incremental and \
+        os.path.exists(os.path.join(temp_dir, MANIFEST_FILENAME))
+    
+    if options.incremental and not incremental:
+        log.info("No previous incremental build in '%s', building all.", 
+                 temp_dir)
+    
     # Remove old temp directory
-    if os.path.isdir(temp_dir):
-        shutil.rmtree(temp_dir)
-        
-    if os.path.isdir(html_dir):
-        shutil.rmtree(html_dir)
-        
-    os.mkdir(temp_dir)
+    if not incremental:
+        if os.path.isdir(temp_dir):
+            shutil.rmtree(temp_dir)
+            
+        if os.path.isdir(html_dir):
+            shutil.rmtree(html_dir)
+    
+    if not os.path.isdir(temp_dir):
+        os.mkdir(temp_dir)
         
     # Template the temp directory
     tcontext = {
@@ -131,12 +460,23 @@ if __name__ == '__main__':
         'caps_literals' : caps_literals,
         'caps_dir' : os.path.realpath(caps_dir),
         'docs_dir' : os.path.realpath(docs_dir),
+        'docs_skip_dirs' : skip_dirs,
         'scripts' : [os.path.realpath(s) for s in scripts],
         'modules' : modules,
+        'incremental' : options.incremental,
+        'cache_dir' : options.cache_dir and os.path.realpath(options.cache_dir),
+        'introspection' : options.introspection,
+        'template_cache_dir' : options.template_cache_dir and 
+                               os.path.realpath(options.template_cache_dir),
+        'jobs' : options.jobs,
+        'script_timeout' : options.script_timeout,
+        'shard_threshold' : options.shard_threshold,
     }
     
-    # Generate conf_py
-    conf_py(templating_environment(), tcontext, output_dir=temp_dir)
+    # Generate conf_py, on incremental build it is rewritten only if changed
+    tenv = templating_environment(
+        bytecode_cache_dir=tcontext['template_cache_dir'])
+    conf_py(tenv, tcontext, output_dir=temp_dir, overwrite=incremental)
     
     # Validates the conf.py
     if options.validate:
@@ -152,5 +492,58 @@ if __name__ == '__main__':
             sys.exit(0)
         # pylint: enable-msg=W0703
     
-    run_sphinx_build(temp_dir, html_dir, sphinx_build=options.sphinx_build)
+    # Sphinx environment and doctrees survive the removal of html directory,
+    # so that Sphinx reads again only the changed documents
+    if not options.dry_run and \
+        prepare_doctree_dir(doctree_dir, 
+                            os.path.join(temp_dir, CONFIG_FILENAME)):
+        log.info("Using saved doctrees in '%s'.", doctree_dir)
+    
+    build = lambda: run_sphinx_build(temp_dir, html_dir, 
+                                     sphinx_build=options.sphinx_build,
+                                     builder=options.builder, 
+                                     defines=options.defines,
+                                     fresh_env=options.fresh_env,
+                                     warning_is_error=options.warning_is_error,
+                                     jobs=options.jobs,
+                                     in_process=options.in_process,
+                                     doctree_dir=doctree_dir)
+    status = build()
+    
+    server = None
+    if options.serve:
+        from sphinkydocext.serve import PreviewServer
+        try:
+            server = PreviewServer(html_dir, options.port)
+        except socket.error, e:
+            log.error("Unable to serve at port %d: %s", options.port, e)
+            sys.exit(1)
+        server.start()
+        log.warning("Serving %s at %s", html_dir, server.url)
+    
+    if options.watch:
+        from sphinkydocext.watch import create_watcher, module_roots
+        template_dirs = [TEMPLATES_DIR] + (tenv.template_dirs or [])
+        roots = module_roots(modules)
+        roots.extend((os.path.realpath(s), False) for s in scripts)
+        roots.append((os.path.realpath(caps_dir), False, CAPS_FILENAME))
+        roots.append((os.path.realpath(docs_dir), True))
+        roots.extend((tdir, True) for tdir in template_dirs)
+        
+        watcher = create_watcher(roots, skip_dirs, 
+                                 skip_files=profile_file and [profile_file])
+        status = watch_and_build(watcher, modules, template_dirs, build, 
+                                 rebuilt=server and server.notify_reload)
+    elif server is not None:
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+    
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+    
+    sys.exit(status)
     
\ No newline at end of file
@@ -34,6 +34,25 @@ Docs generation
     Overwrite the existing generated module API files? Defaults to
     :const:`False`.
     
+.. confval:: sphinkydoc_introspection
+
+    How the modules are introspected for their members, ``"import"`` imports
+    the modules and ``"static"`` parses their sources without importing,
+    defaults to ``"import"``. See :data:`~sphinkydocext.generate.INTROSPECTIONS`.
+    
+.. confval:: sphinkydoc_jobs
+
+    Number of processes generating the module documents, defaults to ``1``.
+    See :func:`~sphinkydocext.generate.parallel_module_doc`.
+    
+.. confval:: sphinkydoc_shard_threshold
+
+    Maximum number of classes, functions, data definitions and exceptions
+    documented on one module page, defaults to :const:`None`, which puts all
+    of them on the module page. Larger modules get a page for each class, and
+    pages of at most this many members for the other members, linked from the
+    module page. See :func:`~sphinkydocext.generate.module_shards`.
+    
 .. confval:: sphinkydoc_scripts
 
     List of paths to scripts which documentation is generated using
@@ -42,6 +61,19 @@ Docs generation
 .. confval:: sphinkydoc_scripts_overwrite
 
     Overwrite the existing generated scripts files? Defaults to :const:`False`.
+
+.. confval:: sphinkydoc_scripts_timeout
+
+    Time limit in seconds of running a script for optparser or ``--help``,
+    defaults to :data:`~sphinkydocext.scripts.HELP_TIMEOUT`. Scripts are run
+    concurrently, at most :confval:`sphinkydoc_jobs` at a time.
+
+.. confval:: sphinkydoc_scripts_memory_limit
+
+    Address space limit in megabytes of a worker process running Python
+    scripts for optparser, defaults to
+    :data:`~sphinkydocext.scripts.WORKER_MEMORY_LIMIT`. :const:`None` means no
+    limit. See :class:`~sphinkydocext.scripts.OptparserWorker`.
     
 .. confval:: sphinkydoc_index
 
@@ -53,6 +85,39 @@ Docs generation
     Indicating whether `README.html` should be generated to caps directory using
     :func:`~sphinkydocext.generate.readme_html_doc`, defaults to :const:`False`.
 
+.. confval:: sphinkydoc_incremental
+
+    Incremental generation, defaults to :const:`False`. Generated files are
+    recorded to :class:`~sphinkydocext.manifest.Manifest` in the source
+    directory, unchanged files are left untouched and files no longer generated
+    are removed. Files generated by previous builds are always regenerated,
+    regardless of the overwrite settings.
+    
+    Module documents are generated only for the modules whose source, 
+    submodules, exported members or templates have changed since the previous
+    build, see :mod:`sphinkydocext.depends`.
+    
+    The :confval:`sphinkydoc_docs_dir` is synchronized using 
+    :func:`~sphinkydocext.utils.sync_tree`, only files changed since the 
+    previous build are copied, and files removed from the docs directory are 
+    removed from the source directory.
+
+.. confval:: sphinkydoc_staging
+
+    How the additional docs are copied to the source directory,
+    one of :data:`~sphinkydocext.utils.STAGINGS`, defaults to ``"copy"``. 
+    ``"hardlink"`` and ``"symlink"`` link the files instead of copying, and 
+    ``"kernel"`` clones the files (FICLONE reflink) where the filesystem 
+    supports it, else copies them, see 
+    :func:`~sphinkydocext.utils.stage_file`. Unsupported strategies fall back
+    to copying, e.g. hard links across filesystems.
+
+.. confval:: sphinkydoc_docs_hash
+
+    Compare content hashes of the additional docs whose modification time has
+    changed, e.g. after version control checkout, before copying them in 
+    incremental generation. Defaults to :const:`False`.
+
 Special directories
 '''''''''''''''''''
         
@@ -72,7 +137,13 @@ Special directories
 
     Directory of *additional docs* directory, files from this directory are
     copied to Sphinx configuration directory before building, defaults to
-    :const:`None` and is not used.     
+    :const:`None` and is not used.
+
+.. confval:: sphinkydoc_docs_skip_dirs
+
+    Names of the directories in :confval:`sphinkydoc_docs_dir` that are not
+    copied, defaults to :data:`DOCS_SKIP_DIRS`. :ref:`sphinkydoc.py` sets this
+    to its output, temp, doctree and cache directories.     
     
     .. warning:: Do not try to set this as same directory as your Sphinx
         configuration directory.
@@ -81,6 +152,34 @@ Special directories
 
     Directory of :term:`caps-files`, defaults to :const:`None` and is not used.
 
+.. confval:: sphinkydoc_cache_dir
+
+    Directory of persistent caches, defaults to :const:`None` and caching is
+    not used. Module members are cached by
+    :class:`~sphinkydocext.cache.ModuleCache`, so unchanged modules are not
+    imported nor introspected again. Script parsers and ``--help`` outputs are
+    cached by :class:`~sphinkydocext.cache.ScriptCache`, so unchanged scripts
+    are not run again.
+
+.. confval:: sphinkydoc_template_cache_dir
+
+    Directory of persistent bytecode cache of compiled templates, defaults to
+    :const:`None` and templates are compiled on each build. See
+    :func:`~sphinkydocext.templating.templating_environment`.
+
+.. confval:: sphinkydoc_profile
+
+    File where the timing report of the build is written, as CSV if the 
+    filename ends with ``.csv`` and otherwise as JSON, defaults to 
+    :const:`None` and no report is written. The report has the timing spans
+    of each stage, module and script, and lists the slowest modules and 
+    scripts, see :class:`~sphinkydocext.timing.Timings`. The report is not
+    copied from :confval:`sphinkydoc_docs_dir`.
+    
+    The spans are timed on every build, and each finished stage is emitted as
+    Sphinx event ``sphinkydoc-span`` with the :class:`~sphinkydocext.timing.Span`
+    as argument.
+
 .. note:: Relative paths are converted to absolute during `builder-init`, and
     thus should be safe to use.
 
@@ -139,13 +238,9 @@ log = logging.getLogger("sphinkydoc")
 
 log.setLevel(logging.WARNING)
 
-from sphinkydocext import directives, utils, templating, generate
-from sphinkydocext.generate import caps_doc
-from sphinkydocext.templating import templating_environment
-from sphinkydocext.utils import copy_tree, multi_matcher, path_to_posix, \
-    truncate_path, directory_slash_suffix
 import re
 import sys
+import types
 
 
 __version__ = "0.5.6"
@@ -153,8 +248,10 @@ __release__ = "0.5.6 alpha"
 __copyright__ = "Jari Pennanen, 2010"
 __project__ = "Sphinkydoc, generates documentation for whole packages"
 
-__all__ = ['directives', 'utils', 'setup', 'templating', 'generate', 
-           'COPYING', 'ALL', 'ALL_ROOT', 'ALL_SUBINDEX', 'log']
+__all__ = ['directives', 'utils', 'setup', 'templating', 'generate',
+           'manifest', 'cache', 'static', 'scripts', 'worker', 'watch',
+           'serve', 'timing', 'depends', 'COPYING', 'ALL', 'ALL_ROOT',
+           'ALL_SUBINDEX', 'log']
 
 # Pylint-disable settings ----------------
 # Todo, Strings, Unused, Map:
@@ -175,17 +272,83 @@ ALL_SUBINDEX = re.compile('.*/index$') # Amazingly ".*" is required.
 THEMES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'themes'))
 """Additional themes provided by sphinkydoc"""
 
+DOCS_SKIP_DIRS = ['html', '_temp', '.sphinkydoc-cache']
+"""Default directories of the docs directory that are not copied, the build
+output, temp and doctree directories of :ref:`sphinkydoc.py`, see
+:confval:`sphinkydoc_docs_skip_dirs`."""
+
 def builder_inited(app):
     """Sphinx builder-inited callback handler.
     
+    Starts timing of the build, see :mod:`sphinkydocext.timing`.
+    
     :param app: Sphinx app.
     
     """
+    from sphinkydocext import timing
+    
+    timings = timing.activate()
+    timings.listeners.append(lambda span: app.emit('sphinkydoc-span', span))
+    
+    span = timing.start('builder-inited')
+    try:
+        _builder_inited(app)
+    finally:
+        timing.stop(span)
+    
+    # Rest of the reading is done by Sphinx
+    timing.start('sphinx-read')
+
+
+def env_updated(app, env):
+    """Sphinx env-updated callback handler, Sphinx starts writing."""
+    from sphinkydocext import timing
+    
+    _stop_current('sphinx-read')
+    timing.start('sphinx-write')
+
+
+def build_finished(app, exception):
+    """Sphinx build-finished callback handler, writes the timing report to
+    :confval:`sphinkydoc_profile`."""
+    from sphinkydocext import timing
+    
+    _stop_current('sphinx-read')
+    _stop_current('sphinx-write')
+    
+    timings = timing.active()
+    if timings is not None and app.config.sphinkydoc_profile:
+        timings.write(os.path.abspath(app.config.sphinkydoc_profile))
+    timing.deactivate()
+
+
+def _stop_current(name):
+    """Stops the current span, if it has the given name."""
+    from sphinkydocext import timing
+    
+    span = timing.current()
+    if span is not None and span.name == name:
+        timing.stop(span)
+
+
+def _builder_inited(app):
+    """Generates the documents, see :func:`builder_inited`."""
+    from sphinkydocext import generate, timing
+    from sphinkydocext.cache import ModuleCache, ScriptCache
+    from sphinkydocext.depends import DependencyGraph
+    from sphinkydocext.generate import caps_doc
+    from sphinkydocext.manifest import Manifest
+    from sphinkydocext.templating import templating_environment
+    from sphinkydocext.utils import copy_tree, sync_tree, multi_matcher, \
+        categorize, path_to_posix, truncate_path, directory_slash_suffix
+    
     conf = app.config
     
     truncate_path_rst = lambda p: truncate_path(p, directory=app.srcdir, 
                                                 extension='rst')
-    tenv = templating_environment()
+    tenv = templating_environment(
+        bytecode_cache_dir=conf.sphinkydoc_template_cache_dir and 
+                           os.path.abspath(conf.sphinkydoc_template_cache_dir))
     caps_files = []
     docs_files = []
     
@@ -213,6 +376,23 @@ def builder_inited(app):
     if caps_dir:
         caps_dir = os.path.abspath(caps_dir)
     
+    module_cache = None
+    script_cache = None
+    if conf.sphinkydoc_cache_dir:
+        cache_dir = os.path.abspath(conf.sphinkydoc_cache_dir)
+        module_cache = ModuleCache(os.path.join(cache_dir, 'modules.cache'))
+        script_cache = ScriptCache(os.path.join(cache_dir, 'scripts.cache'))
+    
+    script_memory_limit = None
+    if conf.sphinkydoc_scripts_memory_limit:
+        script_memory_limit = conf.sphinkydoc_scripts_memory_limit * 1024 * 1024
+    
+    manifest = None
+    depends = None
+    if conf.sphinkydoc_incremental:
+        manifest = Manifest(app.srcdir)
+        depends = DependencyGraph(app.srcdir)
+    
     categorized = {}
     # Order of the items in category matchers, one could put this in the list of
     # matchers as tuples but then redefining the order becomes cumbersome.
@@ -230,16 +410,37 @@ def builder_inited(app):
         'topic': multi_matcher(conf.sphinkydoc_topic),
     }
     
-    # Additional docs copier
+    # Additional docs copier, the profile report of previous build is no doc
+    skip_files = []
+    if conf.sphinkydoc_profile:
+        skip_files.append(os.path.abspath(conf.sphinkydoc_profile))
+    
+    span = timing.start('docs')
     if docs_dir and os.path.abspath(app.srcdir) != docs_dir:
-        _files = copy_tree(docs_dir, app.srcdir, skip_dirs=['html', '_temp'])
+        if manifest is not None:
+            _files = sync_tree(docs_dir, app.srcdir, 
+                               skip_dirs=conf.sphinkydoc_docs_skip_dirs, 
+                               use_hash=conf.sphinkydoc_docs_hash,
+                               staging=conf.sphinkydoc_staging,
+                               skip_files=skip_files)
+            # Synchronized files are not generated, sync removes them
+            for _file in _files:
+                manifest.forget(_file)
+        else:
+            _files = copy_tree(docs_dir, app.srcdir, 
+                               skip_dirs=conf.sphinkydoc_docs_skip_dirs,
+                               staging=conf.sphinkydoc_staging,
+                               skip_files=skip_files)
         docs_files = filter(lambda p: not p.endswith('.rst'), 
                             map(truncate_path_rst, _files))    
+    timing.stop(span)
+    
     # Caps files generation
+    span = timing.start('caps')
     if caps_dir:
         _files = caps_doc(tenv, caps_dir, ext="rst", 
                           caps_literals=conf.sphinkydoc_caps_literals, 
-                          output_dir=app.srcdir)
+                          output_dir=app.srcdir, manifest=manifest)
         caps_files = filter(lambda p: not p.endswith('.rst'), 
                             map(truncate_path_rst, _files))
         
@@ -247,6 +448,7 @@ def builder_inited(app):
     if conf.sphinkydoc_readme_html and caps_dir:
         generate.readme_html_doc(tenv, "docs/html/index.html", 
                                  output_dir=caps_dir)
+    timing.stop(span)
         
     # Notice that following generates nothing, if the lists are empty:
     _module_files, _script_files = \
@@ -255,7 +457,19 @@ def builder_inited(app):
                          module_overwrite=conf.sphinkydoc_modules_overwrite,
                          script_output_dir=script_dir,
                          script_overwrite=conf.sphinkydoc_scripts_overwrite,
-                         source_dir=os.path.abspath(app.srcdir))
+                         source_dir=os.path.abspath(app.srcdir),
+                         manifest=manifest, cache=module_cache,
+                         introspection=conf.sphinkydoc_introspection,
+                         jobs=conf.sphinkydoc_jobs,
+                         shard_threshold=conf.sphinkydoc_shard_threshold,
+                         depends=depends,
+                         script_timeout=conf.sphinkydoc_scripts_timeout,
+                         script_cache=script_cache,
+                         script_memory_limit=script_memory_limit)
+    
+    if module_cache is not None:
+        module_cache.save()
+        script_cache.save()
         
     module_files = map(truncate_path_rst, _module_files)
     script_files = map(truncate_path_rst, _script_files)
@@ -265,23 +479,20 @@ def builder_inited(app):
     docs_files = map(path_to_posix, docs_files)
     caps_files = map(path_to_posix, caps_files)
     
-    for s in set(script_files + module_files).intersection(set(docs_files)):
-        docs_files.remove(s)
-    
-    def categorize(_files, category_matchers):
-        # Categorizes the items to dictionary (always to first matching category) 
-        for n in _files:
-            for cat in category_order:
-                if category_matchers[cat](n):
-                    categorized.setdefault("%s_files" % cat, []).append(n)
-                    break
-                
-    categorize(caps_files, category_matchers_caps)
-    categorize(docs_files, category_matchers)
+    span = timing.start('index')
+    generated_files = set(script_files + module_files)
+    docs_files = [f for f in docs_files if f not in generated_files]
+    
+    # Categorizes the items to dictionary (always to first matching category) 
+    for _files, _matchers in ((caps_files, category_matchers_caps), 
+                              (docs_files, category_matchers)):
+        for cat, items in categorize(_files, _matchers, 
+                                     category_order).iteritems():
+            categorized.setdefault("%s_files" % cat, []).extend(items)
             
     # Included docs should have different extension
     for inc in categorized.get('included_files', []):
-        generate.included_doc(tenv, inc, app.srcdir)
+        generate.included_doc(tenv, inc, app.srcdir, manifest=manifest)
     
     # Index generation
     if conf.sphinkydoc_index:
@@ -295,20 +506,37 @@ def builder_inited(app):
         }
         tcontext.update(categorized)
         
-        generate.index_doc(tenv, tcontext, output_dir=app.srcdir)
+        generate.index_doc(tenv, tcontext, output_dir=app.srcdir, 
+                           manifest=manifest)
+    timing.stop(span)
+    
+    # Remove the files generated by previous build, but not by this one
+    if manifest is not None:
+        manifest.prune()
+        manifest.save()
+        depends.save()
+        log.info("Generated files: %(created)d created, %(updated)d updated, "
+                 "%(unchanged)d unchanged." % manifest.summary())
 
 
 def setup(app):
     """Setups the Sphinx extension.
     
     :param app: Sphinx app.
+    :returns: Extension metadata. The extension is safe for parallel reading
+        and writing, the documents are generated in ``builder-inited`` before
+        Sphinx starts the reading processes, and the directives keep no state
+        in the environment.
     
     """
     from sphinkydocext.directives.usage import usage_directive
+    from sphinkydocext.scripts import HELP_TIMEOUT, WORKER_MEMORY_LIMIT
     from sphinkydocext.directives.sphinkydoc import SphinkydocModules, \
         SphinkydocScripts, sphinkydoc_toc
         
-    app.config.html_theme_path.append(THEMES_DIR)
+    # Default list is shared by all Sphinx applications of the process
+    if THEMES_DIR not in app.config.html_theme_path:
+        app.config.html_theme_path.append(THEMES_DIR)
     app.add_config_value('sphinkydoc_caps_literals', [COPYING], '')
     
     app.add_config_value('sphinkydoc_caps_included', ['README'], '')
@@ -322,15 +550,28 @@ def setup(app):
     
     app.add_config_value('sphinkydoc_modules', [], '')
     app.add_config_value('sphinkydoc_modules_overwrite', False, '')
+    app.add_config_value('sphinkydoc_introspection', 'import', '')
+    app.add_config_value('sphinkydoc_jobs', 1, '')
+    app.add_config_value('sphinkydoc_shard_threshold', None, '')
     app.add_config_value('sphinkydoc_scripts', [], '')
     app.add_config_value('sphinkydoc_scripts_overwrite', False, '')
+    app.add_config_value('sphinkydoc_scripts_timeout', HELP_TIMEOUT, '')
+    app.add_config_value('sphinkydoc_scripts_memory_limit', 
+                         WORKER_MEMORY_LIMIT / (1024 * 1024), '')
     app.add_config_value('sphinkydoc_index', False, '')
     app.add_config_value('sphinkydoc_readme_html', False, '')
+    app.add_config_value('sphinkydoc_incremental', False, '')
+    app.add_config_value('sphinkydoc_docs_hash', False, '')
+    app.add_config_value('sphinkydoc_staging', 'copy', '')
     app.add_config_value('sphinkydoc_docs_dir', None, '')
+    app.add_config_value('sphinkydoc_docs_skip_dirs', DOCS_SKIP_DIRS, '')
     app.add_config_value('sphinkydoc_modules_dir', "", '')
     app.add_config_value('sphinkydoc_scripts_dir', "", '')
     app.add_config_value('sphinkydoc_caps_dir', None, '')
+    app.add_config_value('sphinkydoc_cache_dir', None, '')
+    app.add_config_value('sphinkydoc_template_cache_dir', None, '')
     app.add_config_value('sphinkydoc_debug', False, '')
+    app.add_config_value('sphinkydoc_profile', None, '')
 
     app.add_description_unit('confval', 'confval', 
                              'pair: %s; configuration value')
@@ -346,4 +587,73 @@ def setup(app):
     if app.config.sphinkydoc_debug:
         log.setLevel(logging.INFO)
     
+    app.add_event('sphinkydoc-span')
     app.connect('builder-inited', builder_inited)
+    app.connect('env-updated', env_updated)
+    app.connect('build-finished', build_finished)
+    
+    return {'version' : __version__,
+            'parallel_read_safe' : True,
+            'parallel_write_safe' : True}
+
+
+# Submodules are imported when used, so that importing the package, e.g. by
+# the sphinkydoc.py script or by worker processes, does not load Sphinx,
+# docutils and Jinja2.
+
+SUBMODULES = ['directives', 'utils', 'templating', 'generate', 'manifest',
+              'cache', 'static', 'scripts', 'worker', 'watch', 'serve',
+              'timing', 'depends']
+"""Submodules imported on first access of the package attribute."""
+
+REEXPORTS = {
+    'caps_doc' : 'generate',
+    'ModuleCache' : 'cache',
+    'ScriptCache' : 'cache',
+    'Manifest' : 'manifest',
+    'HELP_TIMEOUT' : 'scripts',
+    'WORKER_MEMORY_LIMIT' : 'scripts',
+    'templating_environment' : 'templating',
+    'copy_tree' : 'utils',
+    'sync_tree' : 'utils',
+    'multi_matcher' : 'utils',
+    'categorize' : 'utils',
+    'path_to_posix' : 'utils',
+    'truncate_path' : 'utils',
+    'directory_slash_suffix' : 'utils',
+}
+"""Names of the package imported on first access, and the submodules they
+are imported from."""
+
+
+class LazyModule(types.ModuleType):
+    """Package module importing :data:`SUBMODULES` and :data:`REEXPORTS` on
+    first access, as Python 2 has no module level ``__getattr__``."""
+
+    def __getattr__(self, name):
+        if name in SUBMODULES:
+            __import__(self.__name__ + "." + name)
+            return sys.modules[self.__name__ + "." + name]
+
+        if name in REEXPORTS:
+            submodule = getattr(self, REEXPORTS[name])
+            value = getattr(submodule, name)
+            setattr(self, name, value)
+            return value
+
+        raise AttributeError("'module' object has no attribute '%s'" % name)
+
+
+def _install_lazy_module():
+    """Replaces this module in :data:`sys.modules` with :class:`LazyModule`
+    having the same attributes."""
+    module = sys.modules[__name__]
+    lazy = LazyModule(__name__, __doc__)
+    lazy.__dict__.update(module.__dict__)
+
+    # Functions of this module use the globals of the replaced module, it is
+    # kept alive so that Python 2 does not clear them
+    lazy._module = module
+    sys.modules[__name__] = lazy
+
+_install_lazy_module()
@@ -0,0 +1,256 @@
+"""Persistent caches of Sphinkydoc.
+
+Caches are stored to the directory given in :confval:`sphinkydoc_cache_dir`,
+each cache is a single pickled file which is loaded once, and saved only if
+something was changed.
+
+"""
+from sphinkydocext import log
+from sphinkydocext.manifest import file_hash
+from sphinkydocext.scripts import HelpResult, OptionParserInfo
+from sphinkydocext.utils import file_stamp, find_module_file, \
+    package_listing
+from distutils.spawn import find_executable
+import cPickle
+import hashlib
+import os
+import sys
+
+CACHE_VERSION = 4
+"""Version of the cache format, caches of other versions are discarded."""
+
+SCRIPT_ENVIRON = ('PYTHONPATH', 'PYTHONHOME', 'LANG', 'LC_ALL', 'LC_MESSAGES',
+                  'COLUMNS')
+"""Environment variables that affect the parser or ``--help`` output of
+scripts, part of the :class:`ScriptCache` key."""
+
+
+class PersistentCache(object):
+    """Dictionary like cache, pickled to a file."""
+
+    def __init__(self, filename):
+        """Create cache, and load the existing cache file.
+
+        :param filename: Path to the cache file.
+
+        """
+        self.filename = filename
+        self.dirty = False
+        self._data = {}
+        self.load()
+
+    def load(self):
+        """Loads the cache file, if it exists and is of current version."""
+        if not os.path.exists(self.filename):
+            return
+
+        # Ignore the Exception catch, broken cache is simply discarded
+        # pylint: disable-msg=W0703
+        try:
+            f = open(self.filename, 'rb')
+            try:
+                version, data = cPickle.load(f)
+            finally:
+                f.close()
+        except Exception, e:
+            log.warning("Unable to load cache %s: %s", self.filename, e)
+            return
+        # pylint: enable-msg=W0703
+
+        if version == CACHE_VERSION:
+            self._data = data
+
+    def save(self):
+        """Saves the cache file, if it has changed."""
+        if not self.dirty:
+            return
+
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        f = open(self.filename, 'wb')
+        try:
+            cPickle.dump((CACHE_VERSION, self._data), f, 2)
+        finally:
+            f.close()
+        self.dirty = False
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self.dirty = True
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+class ModuleCache(PersistentCache):
+    """Cache of module members, as returned by
+    :func:`~sphinkydocext.utils.get_module_members`.
+
+    Entries are validated by the module source file modification time and
+    size, and when those differ by the content hash of the source. Package
+    entries are also validated by the listing of the package directory, so
+    added and removed submodules are noticed.
+
+    .. note:: Members imported from other modules are classified when the
+        entry is stored, changes in those modules do not invalidate the entry.
+
+    """
+
+    def _validate(self, module_name, entry):
+        """Validates the entry against the module source.
+
+        :returns: :const:`True` if the entry is valid.
+
+        """
+        found = find_module_file(module_name)
+        if found is None:
+            return False
+
+        filename, is_package = found
+        stamp = file_stamp(filename)
+
+        if is_package != entry['is_package']:
+            return False
+
+        if is_package and package_listing(os.path.dirname(filename)) != \
+            entry['listing']:
+            return False
+
+        if stamp == entry['stamp']:
+            return True
+
+        # Touched but not modified, refresh the stamp
+        if file_hash(filename) == entry['hash']:
+            entry['stamp'] = stamp
+            self.dirty = True
+            return True
+
+        return False
+
+    def get_members(self, module_name, introspection="import"):
+        """Cached members of the module.
+
+        :param module_name: Full name of the module.
+        :param introspection: Introspection backend the members were
+            retrieved with.
+        :returns: Tuple of module name and members, or :const:`None` if there
+            is no valid entry.
+
+        """
+        entry = self.get((introspection, module_name))
+        if entry is None or not self._validate(module_name, entry):
+            return None
+        return entry['name'], entry['members']
+
+    def set_members(self, module_name, name, members, introspection="import"):
+        """Stores members of the module.
+
+        :param module_name: Full name of the module.
+        :param name: Name of the module, as returned by
+            :func:`~sphinkydocext.utils.import_by_name`.
+        :param members: Members of the module.
+        :param introspection: Introspection backend the members were
+            retrieved with.
+
+        """
+        found = find_module_file(module_name)
+        if found is None:
+            return
+
+        filename, is_package = found
+        listing = None
+        if is_package:
+            listing = package_listing(os.path.dirname(filename))
+
+        self[(introspection, module_name)] = {
+            'stamp' : file_stamp(filename),
+            'hash' : file_hash(filename),
+            'is_package' : is_package,
+            'listing' : listing,
+            'name' : name,
+            'members' : members,
+        }
+
+
+class ScriptCache(PersistentCache):
+    """Cache of script documentation sources, as returned by
+    :func:`~sphinkydocext.scripts.gather_scripts`.
+    
+    Entries are content-addressed: the key is a hash of the script content,
+    the interpreters the script is run with, and :data:`SCRIPT_ENVIRON`. 
+    Changing any of those causes the script to be run again. Only the latest
+    entry of each script is kept.
+    
+    .. note:: Modules the script imports are not part of the key, changing
+        the parser defined in other module does not invalidate the entry.
+    
+    """
+    
+    def __init__(self, filename):
+        PersistentCache.__init__(self, filename)
+        self._environ_hash = _environ_hash()
+    
+    def script_key(self, script_path):
+        """Content-addressed key of the script.
+        
+        :returns: Hex digest, or :const:`None` if the script cannot be read.
+        
+        """
+        content_digest = file_hash(script_path)
+        if content_digest is None:
+            return None
+        return hashlib.sha1(content_digest + self._environ_hash).hexdigest()
+    
+    def get_script(self, script_path):
+        """Cached documentation source of the script.
+        
+        :param script_path: Path to the script.
+        :returns: :class:`~sphinkydocext.scripts.OptionParserInfo` or
+            :class:`~sphinkydocext.scripts.HelpResult`, or :const:`None` if
+            there is no valid entry.
+        
+        """
+        entry = self.get(os.path.abspath(script_path))
+        if entry is None or entry['key'] != self.script_key(script_path):
+            return None
+        
+        if entry['kind'] == 'optparser':
+            return OptionParserInfo.from_dict(entry['data'])
+        return HelpResult.from_dict(script_path, entry['data'])
+    
+    def set_script(self, script_path, source):
+        """Stores the documentation source of the script.
+        
+        :param script_path: Path to the script.
+        :param source: :class:`~sphinkydocext.scripts.OptionParserInfo` or
+            :class:`~sphinkydocext.scripts.HelpResult`.
+        
+        """
+        key = self.script_key(script_path)
+        if key is None:
+            return
+        
+        kind = 'help'
+        if isinstance(source, OptionParserInfo):
+            kind = 'optparser'
+        
+        self[os.path.abspath(script_path)] = {
+            'key' : key,
+            'kind' : kind,
+            'data' : source.to_dict(),
+        }
+
+
+def _environ_hash():
+    """Hash of the interpreters and environment scripts are run with."""
+    h = hashlib.sha1()
+    h.update(sys.executable or "")
+    h.update("\0" + (find_executable("python") or ""))
+    for name in SCRIPT_ENVIRON:
+        h.update("\0%s=%s" % (name, os.environ.get(name, "")))
+    return h.hexdigest()
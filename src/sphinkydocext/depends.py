@@ -0,0 +1,191 @@
+"""Dependency graph of the generated module documents.
+
+The graph records for each documented module the pages generated for it, and
+what the pages depend on:
+
+* The source file of the module, and for packages the listing of the package
+  directory, as it determines the submodules.
+* The source files of the modules defining the members the module exports,
+  e.g. in ``__all__``, but does not define itself.
+* The templates and settings the pages were rendered with.
+
+Modules whose dependencies have not changed since the previous build are
+neither introspected nor rendered again, their pages are kept as they are.
+So when a single file changes, only the pages of that module, and of the
+modules exporting its members, are regenerated. Package is regenerated also
+when its submodules are added or removed.
+
+Graph is used on incremental builds, see :confval:`sphinkydoc_incremental`,
+as the kept pages must be recorded to the
+:class:`~sphinkydocext.manifest.Manifest`.
+
+"""
+from sphinkydocext import log
+from sphinkydocext.manifest import content_hash
+from sphinkydocext.templating import template_stamp
+from sphinkydocext.utils import file_stamp, find_module_file, \
+    package_listing
+import json
+import os
+
+DEPENDS_FILENAME = '.sphinkydoc-depends'
+"""Default filename of the dependency graph, relative to the graph
+directory."""
+
+
+class DependencyGraph(object):
+    """Dependencies of the generated module documents, see
+    :mod:`sphinkydocext.depends`."""
+
+    def __init__(self, directory, filename=DEPENDS_FILENAME):
+        """Create graph, and load the graph of the previous build if it
+        exists.
+
+        :param directory: Directory of the generated documents, e.g. the
+            Sphinx source directory.
+        :param filename: Filename of the graph, relative to the directory.
+
+        """
+        self.directory = os.path.abspath(directory)
+        self.filename = os.path.join(self.directory, filename)
+        self._previous = {}
+        self._current = {}
+        self._template_stamps = {}
+        self.load()
+
+    def _key(self, filepath):
+        """Key of the page, posix path relative to the directory."""
+        path = os.path.relpath(os.path.abspath(filepath), self.directory)
+        return path.replace("\\", "/")
+
+    def _path(self, key):
+        return os.path.join(self.directory, *key.split("/"))
+
+    def load(self):
+        """Loads the previous graph, if it exists."""
+        if not os.path.exists(self.filename):
+            return
+
+        try:
+            f = open(self.filename, 'r')
+            try:
+                self._previous = json.load(f).get('modules', {})
+            finally:
+                f.close()
+        except (IOError, ValueError), e:
+            log.warning("Unable to load dependency graph %s: %s",
+                        self.filename, e)
+            self._previous = {}
+
+    def save(self):
+        """Saves the modules recorded in this build."""
+        f = open(self.filename, 'w+')
+        try:
+            json.dump({'modules' : self._current}, f, indent=1,
+                      sort_keys=True)
+        finally:
+            f.close()
+
+    def inputs(self, tenv, *settings):
+        """Hash of the templates and settings the pages are rendered with.
+
+        :param tenv: Templating environment.
+        :param settings: JSON serializable settings affecting the pages, e.g.
+            output directory.
+
+        """
+        tkey = tuple(getattr(tenv, 'template_dirs', None) or [])
+        if tkey not in self._template_stamps:
+            self._template_stamps[tkey] = template_stamp(tenv)
+        return content_hash(json.dumps([self._template_stamps[tkey],
+                                        list(settings)]))
+
+    def unchanged(self, module_name, inputs):
+        """Pages of the module generated by the previous build, if none of
+        their dependencies have changed.
+
+        :param module_name: Full name of the module.
+        :param inputs: Hash of the templates and settings, see
+            :meth:`inputs`.
+        :returns: Tuple of module name, list of page paths and list of full
+            names of the submodules, or :const:`None` if the module must be
+            generated again.
+
+        """
+        entry = self._previous.get(module_name)
+        if entry is None or entry['inputs'] != inputs:
+            return None
+
+        for filepath, stamp in entry['sources'].iteritems():
+            if file_stamp(filepath) != stamp:
+                return None
+
+        if entry['listing'] is not None and \
+            package_listing(entry['listing_dir']) != entry['listing']:
+            return None
+
+        pages = [self._path(key) for key in entry['pages']]
+        if not all(os.path.isfile(p) for p in pages):
+            return None
+
+        return entry['name'], pages, entry['submodules']
+
+    def keep(self, module_name):
+        """Keeps the entry of the previous build, as the module was not
+        generated again."""
+        self._current[module_name] = self._previous[module_name]
+
+    def record(self, module_name, name, members, inputs, pages):
+        """Records the pages generated for the module, and their
+        dependencies.
+
+        :param module_name: Full name of the module.
+        :param name: Name of the module, as returned by
+            :func:`~sphinkydocext.utils.import_by_name`.
+        :param members: Members of the module, see
+            :func:`~sphinkydocext.utils.get_module_members`.
+        :param inputs: Hash of the templates and settings, see
+            :meth:`inputs`.
+        :param pages: Paths of the generated pages.
+
+        """
+        found = find_module_file(module_name)
+        if found is None:
+            return
+
+        filename, is_package = found
+        sources = {filename : file_stamp(filename)}
+        for exporter in members.get('exported_from', []):
+            exporter_file = _module_file(exporter, name, is_package)
+            if exporter_file is not None:
+                sources[exporter_file] = file_stamp(exporter_file)
+
+        listing_dir = None
+        if is_package:
+            listing_dir = os.path.dirname(filename)
+
+        self._current[module_name] = {
+            'name' : name,
+            'inputs' : inputs,
+            'sources' : sources,
+            'listing_dir' : listing_dir,
+            'listing' : listing_dir and package_listing(listing_dir),
+            'pages' : [self._key(p) for p in pages],
+            'submodules' : [name + "." + s for s in members['all_modules']],
+        }
+
+
+def _module_file(module_name, importer, importer_is_package):
+    """Source file of the module members are exported from, or
+    :const:`None`."""
+    candidates = [module_name]
+
+    # Implicit relative imports, e.g. "from submodule import x" in package
+    if importer_is_package:
+        candidates.insert(0, importer + "." + module_name)
+
+    for candidate in candidates:
+        found = find_module_file(candidate)
+        if found is not None:
+            return found[0]
+    return None
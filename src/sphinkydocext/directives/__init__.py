@@ -1,3 +1,7 @@
-"""SphinkyDoc directives"""
-from sphinkydocext.directives import usage, sphinkydoc
+"""SphinkyDoc directives
+
+Directive modules import Sphinx and docutils, they are imported when the
+extension is set up, see :func:`sphinkydocext.setup`.
+
+"""
 __all__ = ['usage', 'sphinkydoc']
\ No newline at end of file
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 
-"""Sphinkydoc directive"""
+"""Sphinkydoc directive
+
+The directives only return nodes built from their content, and keep no state
+in the Sphinx environment, so documents using them can be read and written in
+parallel processes.
+
+"""
 from docutils import nodes
 from docutils.parsers.rst import directives
 from sphinkydocext.templating import templating_environment
@@ -8,6 +14,7 @@ from sphinkydocext import log
 from sphinx import addnodes
 from sphinx.ext.autosummary import import_by_name
 from sphinx.util.compat import Directive
+from sphinx.util.nodes import explicit_title_re
 import os
 
 class sphinkydoc_toc(nodes.comment):
@@ -15,18 +22,36 @@ class sphinkydoc_toc(nodes.comment):
     pass
         
         
-def create_toc(names, maxdepth=-1):
+def create_toc(names, maxdepth=-1, parent=None):
     """Create toc node entries for names.
     
+    Node has all the attributes the ``toctree`` directive of Sphinx sets, so
+    that the environment handles it the same way, also when merging the
+    environments of parallel reads.
+    
+    :param names: List of tuples of title and docname.
+    :param maxdepth: Maximum depth of the toc.
+    :param parent: Docname of the document containing the toc.
+    
     """
     tocnode = addnodes.toctree()
+    tocnode['parent'] = parent
     tocnode['includefiles'] = [name for _short_name, name in names]
     tocnode['entries'] = [(short_name, name) for short_name, name in names]
     tocnode['maxdepth'] = maxdepth
     tocnode['glob'] = None
+    tocnode['hidden'] = False
+    tocnode['includehidden'] = False
+    tocnode['numbered'] = 0
+    tocnode['titlesonly'] = False
     return tocnode
 
 
+def _docname(directive):
+    """Docname of the document being read by the directive."""
+    return directive.state.document.settings.env.docname
+
+
 class SphinkydocModules(Directive):
     """Sphinkydoc modules toc-tree directive.
     
@@ -37,6 +62,10 @@ class SphinkydocModules(Directive):
             firstmod
             secondmod
             thirdmod
+            Title of the page <firstmod.SomeClass>
+    
+    Entries are titled with the last part of the name, unless the title is
+    given explicitly like in ``toctree``.
     
     """
 
@@ -47,10 +76,10 @@ class SphinkydocModules(Directive):
         'maxdepth': directives.unchanged,
     }
     
-    def __init__(self, *args, **kwargs):
-        # Apparently some old docutils has classic class Directive
-        Directive.__init__(self, *args, **kwargs)
-        self.tenv = templating_environment()
+    @property
+    def tenv(self):
+        """Templating environment, shared with other directives."""
+        return templating_environment()
     
     def run(self):
         """Run the Sphinkydoc rst directive."""
@@ -66,7 +95,7 @@ class SphinkydocModules(Directive):
         # Create toc for all names in table
         toc = create_toc([(name, full_name) 
                           for name, full_name in module_rows], 
-                          maxdepth=maxdepth)
+                          maxdepth=maxdepth, parent=_docname(self))
         
         return [toc]        
     
@@ -76,6 +105,10 @@ class SphinkydocModules(Directive):
         :returns: reStructuredText tuple that can be used in toc.
         
         """
+        explicit = explicit_title_re.match(module_name)
+        if explicit:
+            return explicit.group(1), explicit.group(2)
+        
 #        try:
 #            _module, name = import_by_name(module_name)
 #        except ImportError, e:
@@ -107,9 +140,10 @@ class SphinkydocScripts(Directive):
         'maxdepth': directives.unchanged,
     }
     
-    def __init__(self, *args, **kwargs):
-        Directive.__init__(self, *args, **kwargs)
-        self.tenv = templating_environment()
+    @property
+    def tenv(self):
+        """Templating environment, shared with other directives."""
+        return templating_environment()
     
     def run(self):
         """Run the Sphinkydoc rst directive."""
@@ -118,14 +152,14 @@ class SphinkydocScripts(Directive):
         maxdepth = -1
         
         if 'maxdepth' in self.options:
-            maxdepth = self.options['maxdepth']
+            maxdepth = int(self.options['maxdepth'])
             
         script_rows = [self.script_row(s) for s in script_paths if s] 
         
         # Create toc for all names in table
         toc = create_toc([(name, full_name) 
                           for name, full_name in script_rows], 
-                          maxdepth=maxdepth)
+                          maxdepth=maxdepth, parent=_docname(self))
         
         return [toc]
     
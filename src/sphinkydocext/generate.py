@@ -5,39 +5,110 @@
 
 """
 
-from sphinkydocext import log
-from sphinkydocext.templating import caps_literal, caps
-from sphinkydocext.utils import multi_matcher, get_submodules, \
-    get_module_members, script_get_optparser, is_python_script, import_by_name
+from sphinkydocext import log, timing
+from sphinkydocext.manifest import write_if_changed, WRITTEN
+from sphinkydocext.scripts import HELP_TIMEOUT, WORKER_MEMORY_LIMIT, \
+    HelpResult, capture_help, gather_scripts
+from sphinkydocext.static import get_static_module_members
+from sphinkydocext.templating import caps_literal, caps, file_template, \
+    templating_environment
+from sphinkydocext.utils import multi_matcher, \
+    get_module_members, import_by_name
 import os
 import re
-import shutil
-import subprocess
+
+CAPS_FILENAME = re.compile(r"^[A-Z]{3,}(\.[A-Za-z]+)?$")
+"""Matches filenames of :term:`caps-files`."""
+
+INTROSPECTIONS = ("import", "static")
+"""Introspection backends of modules.
+
+``"import"``
+    Modules are imported and introspected, see 
+    :func:`~sphinkydocext.utils.get_module_members`.
+    
+``"static"``
+    Module sources are parsed without importing, see
+    :func:`~sphinkydocext.static.get_static_module_members`.
+
+"""
+
+SHARDED_GROUPS = (('datas', "Data definitions"), 
+                  ('functions', "Function definitions"),
+                  ('exceptions', "Exceptions"))
+"""Member groups of sharded module, which are split to pages of at most
+threshold members, and their titles. Classes are always put on pages of
+their own, see :func:`module_shards`."""
 
 # TODO: Consistent returning values for the following doc generations.
 
-def index_doc(tenv, tcontext, output_dir=None, overwrite=False):
+def _write_doc(filename, template, tcontext, overwrite=False, manifest=None):
+    """Renders the template and writes the document, if allowed.
+    
+    Without manifest the document is written if it does not exist or if
+    ``overwrite`` is set, unchanged documents are not rewritten. With manifest
+    the documents generated by previous builds are also rewritten. Documents
+    are written atomically, see 
+    :func:`~sphinkydocext.manifest.write_chunks_if_changed`.
+    
+    :param filename: Path of the document.
+    :param template: Jinja2 template.
+    :param tcontext: Template context.
+    :param manifest: :class:`~sphinkydocext.manifest.Manifest` or 
+        :const:`None`.
+    :returns: Status of the document, one of 
+        :data:`~sphinkydocext.manifest.CREATED`, 
+        :data:`~sphinkydocext.manifest.UPDATED` or 
+        :data:`~sphinkydocext.manifest.UNCHANGED`, or :const:`None` if it was
+        not allowed to be written.
+    
+    """
+    if manifest is not None:
+        if not manifest.writable(filename, overwrite):
+            return None
+    elif not overwrite and os.path.exists(filename):
+        return None
+    
+    rendition = timing.timed('render', None, template.render, tcontext)
+    return _write_rendition(filename, rendition, overwrite, manifest)
+
+
+def _write_rendition(filename, rendition, overwrite=False, manifest=None):
+    """Writes the already rendered document, if allowed.
+    
+    See :func:`_write_doc`.
+    
+    """
+    if manifest is not None:
+        return timing.timed('write', None, manifest.write, filename, 
+                            rendition, overwrite=overwrite)
+    
+    if overwrite or not os.path.exists(filename):
+        return timing.timed('write', None, write_if_changed, filename, 
+                            rendition)
+    
+    return None
+
+
+def index_doc(tenv, tcontext, output_dir=None, overwrite=False, manifest=None):
     """Generate documentation index.
     
     :param tenv: Templating environment, retrieved e.g. by 
         :func:`sphinkydocext.templating.templating_environment`.
     :param output_dir: Output directory of generated document.
+    :param manifest: Manifest of generated files, or :const:`None`.
     :returns: Generated document path.
         
     """
     
     output_dir = output_dir or os.path.abspath(".")
     t = tenv.get_template("sphinkydoc/index.rst")
-    rendition = t.render(tcontext)
     
     master = "index"
     suffix = "rst"
     filename = os.path.join(output_dir, "%s.%s" % (master, suffix))
     
-    if overwrite or not os.path.exists(filename):
-        f = open(filename, "w+")
-        f.write(rendition)
-        f.close()
+    if _write_doc(filename, t, tcontext, overwrite, manifest) in WRITTEN:
         log.info("Index generated %s file." % filename)
     
     return filename
@@ -68,16 +139,14 @@ def readme_html_doc(tenv, docs_url, output_dir=None, overwrite=False):
     
     filename = os.path.join(output_dir, "README.html")
         
-    if overwrite or not os.path.exists(filename):
-        f = open(filename, "w+")
-        f.write(rendition)
-        f.close()
+    if _write_rendition(filename, rendition, overwrite) in WRITTEN:
         log.info("README.html generated %s file." % filename)
         
     return filename
 
 
-def included_doc(tenv, docname, src_dir, ext="rst", overwrite=False):
+def included_doc(tenv, docname, src_dir, ext="rst", overwrite=False, 
+                 manifest=None):
     """Included documents pre-processed.
     
     Sphinx does not allow included documents to be with same prefix as the 
@@ -88,34 +157,46 @@ def included_doc(tenv, docname, src_dir, ext="rst", overwrite=False):
     :param docname: Name of the included doc, without extension.
     :param src_dir: Source directory where to look for.
     :param ext: Extension of source files, defaults to ".rst".
+    :param manifest: Manifest of generated files, or :const:`None`.
     :returns: Generated document path.
     
     """
     src = os.path.join(src_dir, "%s.%s" % (docname, ext))
     dst = os.path.join(src_dir, "%s.%s" % (docname, "inc"))
+    
+    if manifest is not None:
+        # Source is regenerated on each build, so it is always moved
+        if os.path.exists(src) and manifest.writable(dst, overwrite):
+            f = open(src, 'r')
+            manifest.write(dst, f.read(), overwrite=overwrite)
+            f.close()
+            os.remove(src)
+            manifest.forget(src)
+            log.info("Included %s, moved to %s" % (src, dst))
+        return dst
+    
     if overwrite or not os.path.exists(dst):
-        shutil.move(src, dst)
+        f = open(src, 'r')
+        write_if_changed(dst, f.read())
+        f.close()
+        os.remove(src)
         log.info("Included %s, moved to %s" % (src, dst))
     return dst
 
 
-def conf_py(tenv, tcontext, output_dir=None, overwrite=False):
+def conf_py(tenv, tcontext, output_dir=None, overwrite=False, manifest=None):
     """Generates sphinx conf.py, cannot be used within extension.
     
     :param tenv: Jinja2 templating environment.
     :param output_dir: Output directory of generated documents.
+    :param manifest: Manifest of generated files, or :const:`None`.
     :returns: Generated document path.
      
     """
     template = tenv.get_template("sphinkydoc/conf.py.template")
-    
-    rendition = template.render(tcontext)
     filename = os.path.join(output_dir, "conf.py")
     
-    if overwrite or not os.path.exists(filename):
-        f = open(filename, "w+")
-        f.write(rendition)
-        f.close()
+    if _write_doc(filename, template, tcontext, overwrite, manifest) in WRITTEN:
         log.info("Conf generated %s file." % filename)
         
     return filename
@@ -123,7 +204,11 @@ def conf_py(tenv, tcontext, output_dir=None, overwrite=False):
 
 def all_doc(tenv, module_names=None, script_paths=None, module_output_dir="",
             script_output_dir="", module_overwrite=False, 
-            script_overwrite=False, source_dir=""):
+            script_overwrite=False, source_dir="", manifest=None, 
+            cache=None, introspection="import", jobs=1, 
+            script_timeout=HELP_TIMEOUT, script_cache=None, 
+            script_memory_limit=WORKER_MEMORY_LIMIT, shard_threshold=None,
+            depends=None):
     """Generates documentation for modules and scripts.
     
     :param tenv: Templating environment, retrieved e.g. by 
@@ -143,6 +228,36 @@ def all_doc(tenv, module_names=None, script_paths=None, module_output_dir="",
         
     :param source_dir: Source directory, preferably absolute path.
     
+    :param manifest: Manifest of generated files, or :const:`None`.
+    
+    :param cache: :class:`~sphinkydocext.cache.ModuleCache` or :const:`None`.
+    
+    :param introspection: Introspection backend of modules, ``"import"`` or
+        ``"static"``, see :data:`INTROSPECTIONS`.
+    
+    :param jobs: Number of processes generating the module documents, the 
+        generated documents are same and in same order as with one process. 
+        Also the maximum number of scripts run concurrently.
+    
+    :param script_timeout: Time limit of running script for optparser or 
+        ``--help`` in seconds, see 
+        :func:`~sphinkydocext.scripts.gather_scripts`.
+    
+    :param script_cache: :class:`~sphinkydocext.cache.ScriptCache` or 
+        :const:`None`.
+    
+    :param script_memory_limit: Address space limit of running script for 
+        optparser in bytes, or :const:`None`.
+    
+    :param shard_threshold: Maximum number of members documented on a module
+        page, larger modules are split to several pages, see 
+        :func:`module_shards`. :const:`None` puts all members on the module 
+        page.
+    
+    :param depends: :class:`~sphinkydocext.depends.DependencyGraph` or 
+        :const:`None`. With manifest, modules whose dependencies have not 
+        changed are not generated again.
+    
     :returns: Tuple of generated module paths, and generated script paths.
     
     """
@@ -153,73 +268,176 @@ def all_doc(tenv, module_names=None, script_paths=None, module_output_dir="",
     module_files = []
     script_files = []
     
+    span = timing.start('modules')
+    if jobs > 1 and module_names:
+        module_files.extend(\
+            parallel_module_doc(tenv, module_names, jobs, 
+                                output_dir=module_output_dir,
+                                source_dir=source_dir, 
+                                overwrite=module_overwrite, manifest=manifest,
+                                cache=cache, introspection=introspection,
+                                shard_threshold=shard_threshold,
+                                depends=depends))
+        module_names = []
+    
     for m in module_names:
         try:
             module_files.extend(recursive_module_doc(tenv, m, 
                                                      output_dir=module_output_dir,
                                                      source_dir=source_dir, 
-                                                     overwrite=module_overwrite))
+                                                     overwrite=module_overwrite,
+                                                     manifest=manifest,
+                                                     cache=cache,
+                                                     introspection=introspection,
+                                                     shard_threshold=shard_threshold,
+                                                     depends=depends))
         except GenerateDocError, er:
             log.warning("Unable to generating module doc for '%s':  %s", 
                         m, unicode(er))
+    timing.stop(span)
+    
+    # Scripts without optparser are run for --help concurrently
+    span = timing.start('scripts')
+    sources = timing.timed('gather-scripts', None, gather_scripts, 
+                           script_paths, jobs=jobs, timeout=script_timeout,
+                           cache=script_cache, 
+                           memory_limit=script_memory_limit)
         
     for s in script_paths:
+        script_span = timing.start('script', s)
         try:
-            script_files.append(script_doc(tenv, s, output_dir=script_output_dir,
-                                           source_dir=source_dir, 
-                                           overwrite=script_overwrite))
+            if not isinstance(sources[s], HelpResult):
+                script_files.append(\
+                    script_doc_py(tenv, s, sources[s], 
+                                  output_dir=script_output_dir,
+                                  source_dir=source_dir, 
+                                  overwrite=script_overwrite, 
+                                  manifest=manifest))
+            else:
+                script_files.append(\
+                    script_doc_help(tenv, s, output_dir=script_output_dir,
+                                    source_dir=source_dir, 
+                                    overwrite=script_overwrite, 
+                                    manifest=manifest, 
+                                    help_result=sources[s]))
         except GenerateDocError, er:
             log.warning("Unable to generating script doc for '%s':  %s", 
                         s, unicode(er))
+        timing.stop(script_span)
+    timing.stop(span)
     
     return module_files, script_files
 
 
 def recursive_module_doc(tenv, module_name, output_dir="", source_dir="", 
-                         overwrite=False):
+                         overwrite=False, manifest=None, cache=None, 
+                         introspection="import", shard_threshold=None,
+                         depends=None):
     """Recursively generates module documentation also for all submodules,
     and subpackages.
     
     :param tenv: Jinja2 templating environment. :param module_name: Module
     :param source_dir: Source directory.
     :param output_dir: Output directory of generated documents. **Must be
-        relative to the source directory!** :returns: List of generated document
-        paths.
+        relative to the source directory!** 
+    :param manifest: Manifest of generated files, or :const:`None`.
+    :param cache: :class:`~sphinkydocext.cache.ModuleCache` or :const:`None`.
+    :param introspection: Introspection backend, see :data:`INTROSPECTIONS`.
+    :param shard_threshold: Maximum number of members on a page, see 
+        :func:`module_shards`.
+    :param depends: :class:`~sphinkydocext.depends.DependencyGraph` or 
+        :const:`None`, see :func:`all_doc`.
+    :returns: List of generated document paths, including the member pages
+        of sharded modules.
     
     """
     
     module_files = []
-    
-    # We must try to import the module, so we can recurse to the submodules
-    try:
-        module, _name = import_by_name(module_name)
-    except ImportError:
-        log.warning("Unable to import '%s', docs for this module cannot "
-                    "be generated.", module_name)
+    submodule_names = []
+    
+    inputs = _module_inputs(tenv, depends, manifest, output_dir, 
+                            introspection, shard_threshold)
+    kept = inputs and _keep_module(depends, manifest, module_name, inputs)
+    if kept:
+        _name, pages, submodule_names = kept
+        module_files.extend(pages)
     else:
-        
-        # Try to generate documentation for this module 
+        # We must try to import the module, so we can recurse to the 
+        # submodules
+        span = timing.start('module', module_name)
         try:
-            module_files.append(\
-                module_doc(tenv, module_name, output_dir=output_dir, 
-                           source_dir=source_dir, overwrite=overwrite))
-        except GenerateDocError, er:
-            log.warning("Unable to generate module doc for '%s':  %s", 
-                        module_name, unicode(er))
-    
-        # Continue to found submodules
-        for submodule_name in get_submodules(module):
-            module_files.extend(\
-                recursive_module_doc(tenv, _name + "." + submodule_name, 
-                                     output_dir=output_dir, 
-                                     source_dir=source_dir,
-                                     overwrite=overwrite))
+            name, members = _module_members(module_name, cache, introspection)
+        except ImportError:
+            timing.stop(span)
+            log.warning("Unable to import '%s', docs for this module cannot "
+                        "be generated.", module_name)
+        else:
+            
+            # Try to generate documentation for this module 
+            pages = _module_doc(tenv, module_name, name, members, 
+                                output_dir=output_dir, source_dir=source_dir, 
+                                overwrite=overwrite, manifest=manifest, 
+                                shard_threshold=shard_threshold)
+            module_files.extend(pages)
+            if inputs:
+                depends.record(module_name, name, members, inputs, pages)
+            timing.stop(span)
+            submodule_names = [name + "." + submodule_name 
+                               for submodule_name in members['all_modules']]
+    
+    # Continue to found submodules
+    for submodule_name in submodule_names:
+        module_files.extend(\
+            recursive_module_doc(tenv, submodule_name, 
+                                 output_dir=output_dir, 
+                                 source_dir=source_dir,
+                                 overwrite=overwrite, 
+                                 manifest=manifest, cache=cache,
+                                 introspection=introspection,
+                                 shard_threshold=shard_threshold,
+                                 depends=depends))
     
     return module_files
 
 
+def _module_inputs(tenv, depends, manifest, output_dir, introspection, 
+                   shard_threshold):
+    """Hash of the templates and settings of module documents, see 
+    :meth:`~sphinkydocext.depends.DependencyGraph.inputs`.
+    
+    :returns: Hash, or :const:`None` if modules cannot be kept, as there is no
+        dependency graph or manifest.
+    
+    """
+    if depends is None or manifest is None:
+        return None
+    return depends.inputs(tenv, output_dir, introspection, shard_threshold)
+
+
+def _keep_module(depends, manifest, module_name, inputs):
+    """Keeps the documents of the module, if their dependencies have not 
+    changed since the previous build.
+    
+    :returns: Tuple of module name, document paths and full names of the 
+        submodules, or :const:`None` if the module must be generated.
+    
+    """
+    unchanged = depends.unchanged(module_name, inputs)
+    if unchanged is None:
+        return None
+    
+    for page in unchanged[1]:
+        if not manifest.keep(page):
+            return None
+    
+    depends.keep(module_name)
+    log.info("Module %s is unchanged, kept its documents." % module_name)
+    return unchanged
+
+
 def module_doc(tenv, module_name, output_dir="", source_dir="", 
-               overwrite=False):
+               overwrite=False, manifest=None, cache=None, 
+               introspection="import", shard_threshold=None):
     """Generates documentation for module or package.
     
     :param tenv: Jinja2 templating environment.
@@ -227,44 +445,353 @@ def module_doc(tenv, module_name, output_dir="", source_dir="",
     :param source_dir: Source directory.
     :param output_dir: Output directory of generated documents, 
         **must be relative to the source directory!**
+    :param manifest: Manifest of generated files, or :const:`None`.
+    :param cache: :class:`~sphinkydocext.cache.ModuleCache` or :const:`None`.
+    :param introspection: Introspection backend, see :data:`INTROSPECTIONS`.
+    :param shard_threshold: Maximum number of members on a page, see 
+        :func:`module_shards`, the member pages are written next to the 
+        module document.
     :returns: Generated document path.
      
     """
     
+    span = timing.start('module', module_name)
     try:
-        module, name = import_by_name(module_name)
-    except ImportError, e:
-        raise GenerateDocError("Failed to import '%s': %s" % (module_name, e))
+        try:
+            name, members = _module_members(module_name, cache, introspection)
+        except ImportError, e:
+            raise GenerateDocError("Failed to import '%s': %s" % 
+                                   (module_name, e))
+        
+        return _module_doc(tenv, module_name, name, members, 
+                           output_dir=output_dir, source_dir=source_dir, 
+                           overwrite=overwrite, manifest=manifest,
+                           shard_threshold=shard_threshold)[0]
+    finally:
+        timing.stop(span)
+
+
+def _module_members(module_name, cache=None, introspection="import"):
+    """Members of the module, retrieved from the cache if possible.
+    
+    :param module_name: Full name of the module.
+    :param cache: :class:`~sphinkydocext.cache.ModuleCache` or :const:`None`.
+    :param introspection: Introspection backend, see :data:`INTROSPECTIONS`.
+    :returns: Tuple of module name and members as returned by 
+        :func:`~sphinkydocext.utils.get_module_members`.
+    :raises ImportError: If the module cannot be imported, or parsed.
     
-    members = get_module_members(module)
-    template = tenv.get_template("sphinkydoc/module.rst")
+    """
+    if introspection not in INTROSPECTIONS:
+        raise GenerateDocError("Unknown introspection '%s'" % introspection)
+    
+    if cache is not None:
+        cached = cache.get_members(module_name, introspection)
+        if cached is not None:
+            return cached
+    
+    if introspection == "static":
+        name, members = timing.timed('introspection', None, 
+                                     get_static_module_members, module_name)
+    else:
+        module, name = timing.timed('import', None, import_by_name, 
+                                    module_name)
+        members = timing.timed('introspection', None, get_module_members, 
+                               module)
+    
+    if cache is not None:
+        cache.set_members(module_name, name, members, introspection)
+    
+    return name, members
+
+
+def _module_doc(tenv, module_name, name, members, output_dir="", source_dir="",
+                overwrite=False, manifest=None, shard_threshold=None):
+    """Generates documentation for module with known members.
+    
+    See :func:`module_doc` for the parameters.
+    
+    :returns: List of generated document paths, the module document first.
+    
+    """
+    filenames = []
+    for filename, template_name, tcontext in \
+        _module_contexts(module_name, name, members, output_dir, source_dir,
+                         shard_threshold):
+        template = tenv.get_template(template_name)
+        
+        # Write template, as "somemodule.submodule.rst"
+        if _write_doc(filename, template, tcontext, overwrite, 
+                      manifest) in WRITTEN:
+            log.info("Module generated %s file." % filename)
+        filenames.append(filename)
+        
+    return filenames
 
+
+def _module_contexts(module_name, name, members, output_dir, source_dir,
+                     shard_threshold=None):
+    """Paths, templates and template contexts of module document, and of its
+    member pages if it is sharded.
+    
+    :returns: List of tuples of document path, template name and template 
+        context, the module document first.
+    
+    """
+    page_members, shards = module_shards(name, members, shard_threshold)
+    
     tcontext = {'module': module_name, 
                 'output_dir' : output_dir, 
                 'fullname' : name }
-    tcontext.update(members)
-    filename = os.path.join(source_dir, output_dir, "%s.rst" % name)
+    tcontext.update(page_members)
+    tcontext['shards'] = shards
+    contexts = [(os.path.join(source_dir, output_dir, "%s.rst" % name),
+                 "sphinkydoc/module.rst", tcontext)]
+    
+    for shard in shards:
+        shard_context = {'module' : module_name, 
+                         'output_dir' : output_dir,
+                         'fullname' : name}
+        shard_context.update(shard)
+        contexts.append((os.path.join(source_dir, output_dir, 
+                                      "%s.rst" % shard['docname']),
+                         "sphinkydoc/shard.rst", shard_context))
+    return contexts
+
+
+def module_shards(name, members, threshold=None):
+    """Splits the members of large module to pages of their own.
+    
+    Module is sharded if it has more than ``threshold`` classes, functions,
+    data definitions and exceptions. Each class is then documented on a page
+    of its own, and the groups of :data:`SHARDED_GROUPS` having more than
+    ``threshold`` members on pages of at most ``threshold`` members. Module
+    page links to the member pages, and documents only the rest of the 
+    members, so that the size of every page is bounded.
+    
+    :param name: Full name of the module.
+    :param members: Members of the module, as returned by 
+        :func:`~sphinkydocext.utils.get_module_members`.
+    :param threshold: Maximum number of members on a page, :const:`None` or
+        zero does not shard.
+    :returns: Tuple of the members documented on the module page, and list of
+        member pages. Each page is dictionary of ``docname``, ``title`` and
+        the ``classes``, ``functions``, ``datas`` and ``exceptions`` on it.
     
-    # Write template, as "somemodule.submodule.rst"
-    if overwrite or not os.path.exists(filename):
-        file_ = open(filename, 'w+')
-        file_.write(template.render(tcontext))
-        file_.close()
-        log.info("Module generated %s file." % filename)
+    """
+    groups = ['classes'] + [group for group, _title in SHARDED_GROUPS]
+    if not threshold or \
+        sum(len(members.get(group, [])) for group in groups) <= threshold:
+        return members, []
+    
+    page_members = dict(members)
+    page = lambda docname, title, **kwargs: \
+        dict([('docname', docname), ('title', title)] + 
+             [(group, kwargs.get(group, [])) for group in groups])
+    
+    shards = [page("%s.%s" % (name, cls), cls, classes=[cls])
+              for cls in members.get('classes', [])]
+    page_members['classes'] = []
+    
+    for group, title in SHARDED_GROUPS:
+        items = members.get(group, [])
+        if len(items) <= threshold:
+            continue
         
-    return filename
+        # Dash is not allowed in class names, so these never collide
+        count = (len(items) + threshold - 1) // threshold
+        for i in range(count):
+            shards.append(page("%s.%s-%d" % (name, group, i + 1), 
+                               "%s (%d/%d)" % (title, i + 1, count),
+                               **{group : items[i * threshold:
+                                                (i + 1) * threshold]}))
+        page_members[group] = []
+    
+    # Summary table would list all the members, the member pages link them
+    sharded = set()
+    for shard in shards:
+        for group in groups:
+            sharded.update(shard[group])
+    page_members['members'] = [m for m in members.get('members', []) 
+                               if m not in sharded]
+    return page_members, shards
+
+
+def parallel_module_doc(tenv, module_names, jobs, output_dir="", 
+                        source_dir="", overwrite=False, manifest=None, 
+                        cache=None, introspection="import", 
+                        shard_threshold=None, depends=None):
+    """Recursively generates module documentation using pool of processes.
+    
+    Modules are introspected and rendered in the worker processes, one level of
+    submodules at a time, and the documents are written by the calling process.
+    Results are same as calling :func:`recursive_module_doc` for each module.
+    
+    :param tenv: Jinja2 templating environment, worker processes create their
+        own environment with the same template directories.
+    :param module_names: Root module names.
+    :param jobs: Number of worker processes.
+    
+    Rest of the parameters are as in :func:`recursive_module_doc`.
+    
+    :returns: List of generated document paths.
+    
+    """
+    if introspection not in INTROSPECTIONS:
+        raise GenerateDocError("Unknown introspection '%s'" % introspection)
+    
+    import multiprocessing
+    
+    pool = multiprocessing.Pool(jobs, _init_module_worker, 
+                                (getattr(tenv, 'template_dirs', None),
+                                 getattr(tenv, 'bytecode_cache_dir', None)))
+    inputs = _module_inputs(tenv, depends, manifest, output_dir, 
+                            introspection, shard_threshold)
+    results = {}
+    kept = {}
+    try:
+        level = list(module_names)
+        while level:
+            level = [m for m in level if m not in results and m not in kept]
+            next_level = []
+            
+            # Cache lookups and unchanged modules are cheap, so those are 
+            # done here
+            tasks = []
+            for module_name in level:
+                kept_module = inputs and \
+                    _keep_module(depends, manifest, module_name, inputs)
+                if kept_module:
+                    kept[module_name] = kept_module
+                    next_level.extend(kept_module[2])
+                    continue
+                
+                cached = None
+                if cache is not None:
+                    cached = cache.get_members(module_name, introspection)
+                tasks.append((module_name, output_dir, source_dir, 
+                              introspection, cached, shard_threshold))
+                
+            for (module_name, _o, _s, _i, cached, _t), (result, span) in \
+                zip(tasks, pool.map(_module_job, tasks)):
+                timing.add(span)
+                results[module_name] = result
+                if result is None:
+                    continue
+                
+                name, members, _renditions = result
+                if cache is not None and cached is None:
+                    cache.set_members(module_name, name, members, 
+                                      introspection)
+                next_level.extend(name + "." + submodule_name 
+                                  for submodule_name in members['all_modules'])
+            level = next_level
+    finally:
+        pool.close()
+        pool.join()
+    
+    # Write in same order as the recursive generation does
+    module_files = []
+    def write(module_name):
+        if module_name in kept:
+            _name, pages, submodule_names = kept[module_name]
+            module_files.extend(pages)
+            for submodule_name in submodule_names:
+                write(submodule_name)
+            return
+        
+        result = results.get(module_name)
+        if result is None:
+            log.warning("Unable to import '%s', docs for this module cannot "
+                        "be generated.", module_name)
+            return
+        
+        name, members, renditions = result
+        pages = []
+        for filename, rendition in renditions:
+            if _write_rendition(filename, rendition, overwrite, 
+                                manifest) in WRITTEN:
+                log.info("Module generated %s file." % filename)
+            pages.append(filename)
+        module_files.extend(pages)
+        if inputs:
+            depends.record(module_name, name, members, inputs, pages)
+        
+        for submodule_name in members['all_modules']:
+            write(name + "." + submodule_name)
+    
+    for module_name in module_names:
+        write(module_name)
+    
+    return module_files
+
+
+_worker_tenv = None
+
+def _init_module_worker(template_dirs, bytecode_cache_dir):
+    """Initializes the worker process of :func:`parallel_module_doc`."""
+    # pylint: disable-msg=W0603
+    global _worker_tenv
+    _worker_tenv = templating_environment(template_dirs, bytecode_cache_dir)
+
+
+def _module_job(task):
+    """Introspects and renders module document in worker process.
+    
+    :param task: Tuple of module name, output directory, source directory, 
+        introspection backend, cached members or :const:`None` and shard 
+        threshold.
+    :returns: Tuple of the result and the timing span of the job as plain 
+        data, see :meth:`~sphinkydocext.timing.Timings.add`. The result is a
+        tuple of module name, members, and list of tuples of document path and
+        the rendered document, or :const:`None` if the module cannot be 
+        introspected.
+    
+    """
+    timings = timing.activate()
+    span = timings.start('module', task[0])
+    try:
+        result = _render_module_job(task)
+    finally:
+        timings.stop(span)
+        timing.deactivate()
+    return result, span.to_dict(span.start)
+
+
+def _render_module_job(task):
+    """Introspects and renders module document, see :func:`_module_job`."""
+    module_name, output_dir, source_dir, introspection, cached, \
+        shard_threshold = task
+    
+    if cached is None:
+        try:
+            cached = _module_members(module_name, None, introspection)
+        except ImportError:
+            return None
+    
+    name, members = cached
+    renditions = []
+    for filename, template_name, tcontext in \
+        _module_contexts(module_name, name, members, output_dir, source_dir,
+                         shard_threshold):
+        template = _worker_tenv.get_template(template_name)
+        renditions.append((filename, timing.timed('render', None, 
+                                                  template.render, tcontext)))
+    return name, members, renditions
 
 
 def script_doc_py(tenv, script_path, optparser, output_dir="",
-                  source_dir="", overwrite=False):
+                  source_dir="", overwrite=False, manifest=None):
     """Generates documentation file for script using :mod:`optparser`.
     
     :param tenv: Jinja2 templating environment.
-    :param optparser: :obj:`optparse.OptionParser`
+    :param optparser: :obj:`optparse.OptionParser`, or its description
+        :class:`~sphinkydocext.scripts.OptionParserInfo`.
     :param script_path: Path to script.
     :param source_dir: Source directory.
     :param output_dir: Output directory of generated documents, 
         **must be relative to the source directory!**
+    :param manifest: Manifest of generated files, or :const:`None`.
     :returns: Generated document path.
      
     """
@@ -277,7 +804,7 @@ def script_doc_py(tenv, script_path, optparser, output_dir="",
                               "%s.rst.template" % script_name)
     
     if os.path.exists(filename_t):
-        template = tenv.from_string(open(filename_t).read())
+        template = file_template(tenv, filename_t)
     else:    
         template = tenv.get_template("sphinkydoc/script_python.rst")
         
@@ -287,48 +814,49 @@ def script_doc_py(tenv, script_path, optparser, output_dir="",
                 'optparser' : optparser}
 
     # Write template as "somescript.py"    
-    if overwrite or not os.path.exists(filename):
-        file_ = open(filename, 'w+')
-        file_.write(template.render(tcontext))
-        file_.close()
+    if _write_doc(filename, template, tcontext, overwrite, manifest) in WRITTEN:
         log.info("Script generated %s file." % filename)
         
     return filename
 
 
 def script_doc_help(tenv, script_path, output_dir=None, source_dir="", 
-                    overwrite=False):
+                    overwrite=False, manifest=None, help_result=None, 
+                    timeout=HELP_TIMEOUT):
     """Generates documentation file for script using ``--help``.
     
     :param tenv: Jinja2 templating environment.
     :param script_path: Path to script.
     :param source_dir: Source directory.
     :param output_dir: Output directory of generated documents.
+    :param manifest: Manifest of generated files, or :const:`None`.
+    :param help_result: Already captured 
+        :class:`~sphinkydocext.scripts.HelpResult`, by default the script is 
+        run here.
+    :param timeout: Time limit of running the script in seconds.
     :returns: Generated document path.
+    :raises GenerateDocError: If the script cannot be run.
      
     """
     output_dir = output_dir or os.path.abspath(".")
     
     script_name = os.path.basename(script_path)
-    help_text = ""
     
     # Call the script using "--help"
-    cmd = ["python", script_path, "--help"]
-    try:
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, 
-                             stderr=subprocess.PIPE)
-    except os.error:
-        return
-    else:
-        help_text, _stderr = p.communicate()
-        
-    help_text = help_text.replace("\r", "")
+    if help_result is None:
+        help_result = capture_help(script_path, timeout=timeout)
+    
+    if help_result.error is not None:
+        raise GenerateDocError("Unable to run '%s': %s" % 
+                               (script_path, help_result.error))
+    
+    help_text = help_result.output
     filename = os.path.join(source_dir, output_dir, "%s.rst" % script_name)
     filename_t = os.path.join(source_dir, output_dir, 
                               "%s.rst.template" % script_name)
     
     if os.path.exists(filename_t):
-        template = tenv.from_string(open(filename_t).read())
+        template = file_template(tenv, filename_t)
     else:    
         template = tenv.get_template("sphinkydoc/script.rst")
         
@@ -337,47 +865,67 @@ def script_doc_help(tenv, script_path, output_dir=None, source_dir="",
                 'help' : help_text}
 
     # Write template as "somescript.py"    
-    if overwrite or not os.path.exists(filename):
-        file_ = open(filename, 'w+')
-        file_.write(template.render(tcontext))
-        file_.close()
+    if _write_doc(filename, template, tcontext, overwrite, manifest) in WRITTEN:
         log.info("Script generated %s file." % filename)
         
     return filename
 
 
 def script_doc(tenv, script_path, output_dir=None, source_dir=None, 
-               overwrite=False):
+               overwrite=False, manifest=None, timeout=HELP_TIMEOUT, 
+               script_cache=None, memory_limit=WORKER_MEMORY_LIMIT):
     """Generates documentation file for script.
     
     :param tenv: Jinja2 templating environment.
     :param script_path: Path to script.
     :param source_dir: Source directory.
     :param output_dir: Output directory of generated documents.
+    :param manifest: Manifest of generated files, or :const:`None`.
+    :param timeout: Time limit of running the script.
+    :param script_cache: :class:`~sphinkydocext.cache.ScriptCache` or 
+        :const:`None`.
+    :param memory_limit: Address space limit of running the script for 
+        optparser in bytes, or :const:`None`.
     :returns: Generated document path.
      
     """
     
-    # First tries to get optparser for python scripts
-    if is_python_script(script_path):
-        optparser = script_get_optparser(script_path)
-        if optparser:
-            return script_doc_py(tenv, script_path, optparser, 
-                                 source_dir=source_dir, output_dir=output_dir, 
-                                 overwrite=overwrite)
+    span = timing.start('script', script_path)
+    try:
+        return _script_doc(tenv, script_path, output_dir, source_dir, 
+                           overwrite, manifest, timeout, script_cache,
+                           memory_limit)
+    finally:
+        timing.stop(span)
+
+
+def _script_doc(tenv, script_path, output_dir, source_dir, overwrite, 
+                manifest, timeout, script_cache, memory_limit):
+    """Generates documentation file for script, see :func:`script_doc`."""
+    # First tries to get optparser for python scripts, fallback to --help
+    source = gather_scripts([script_path], timeout=timeout, 
+                            cache=script_cache, 
+                            memory_limit=memory_limit)[script_path]
+    
+    if not isinstance(source, HelpResult):
+        return script_doc_py(tenv, script_path, source, 
+                             source_dir=source_dir, output_dir=output_dir, 
+                             overwrite=overwrite, manifest=manifest)
     
-    # Fallback to --help
     return script_doc_help(tenv, script_path, output_dir=output_dir, 
-                           source_dir=source_dir, overwrite=overwrite)
+                           source_dir=source_dir, overwrite=overwrite, 
+                           manifest=manifest, help_result=source)
 
 
 def caps_doc(tenv, caps_dir, ext='rst', caps_literals=None, output_dir=None, 
              dry_run=False, overwrite=False, 
-             allowed_exts=['rst', 'inc', 'txt', '']):
+             allowed_exts=['rst', 'inc', 'txt', ''], manifest=None):
     """Generate documentation from caps files in ``caps_dir``.
     
     Caps files are files such as INSTALL, COPYING, README, which contain 
-    documentation worthy content outside docs directory.
+    documentation worthy content outside docs directory. They are rendered 
+    straight to the output directory, and documents whose content has not 
+    changed are not rewritten.
     
     :param caps_dir: Directory where caps files reside.
     :param dst_dir: Destination directory where caps files are *copied*.
@@ -387,6 +935,9 @@ def caps_doc(tenv, caps_dir, ext='rst', caps_literals=None, output_dir=None,
     :param dry_run: Dry run only, no copying or other harmful changes.
     :param overwrite: Overwrite the existing file? Defaults to :const:`False`.
     :param allowed_ext: List of allowed extensions.
+    :param manifest: Manifest of generated files, or :const:`None`. With 
+        manifest the documents generated by previous builds are always 
+        rewritten.
     
     :returns: List of generated document paths. 
     
@@ -400,7 +951,7 @@ def caps_doc(tenv, caps_dir, ext='rst', caps_literals=None, output_dir=None,
     caps_matcher = multi_matcher(caps_literals)
     
     for filename in dir_contents:
-        if re.match(r"^[A-Z]{3,}(\.[A-Za-z]+)?$", filename):
+        if CAPS_FILENAME.match(filename):
             
             # Gather information about the file
             _root, _ext = os.path.splitext(filename)
@@ -416,15 +967,13 @@ def caps_doc(tenv, caps_dir, ext='rst', caps_literals=None, output_dir=None,
             filepath = os.path.join(caps_dir, filename)
             output_filepath = os.path.join(output_dir, output_filename)
             
-            if not dry_run:
-                if overwrite or not os.path.exists(output_filepath):
-                    shutil.copy(filepath, output_filepath)
-                    log.info("Caps %s copied to %s" % (filepath, output_filepath))
-                    
-            if caps_matcher(f_base):        
-                caps_literal(tenv, output_filepath)
-            else:
-                caps(tenv, output_filepath)
+            if not dry_run and (manifest is not None or overwrite or 
+                                not os.path.exists(output_filepath)):
+                render = caps_literal if caps_matcher(f_base) else caps
+                if render(tenv, filepath, output=output_filepath, 
+                          manifest=manifest, overwrite=overwrite) in WRITTEN:
+                    log.info("Caps %s rendered to %s" % 
+                             (filepath, output_filepath))
             
             caps_files.append(output_filepath)
     
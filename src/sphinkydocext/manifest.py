@@ -0,0 +1,458 @@
+"""Manifest of generated files.
+
+Manifest records a content hash of every file Sphinkydoc generates to the
+Sphinx source directory. This allows incremental builds: files whose content
+has not changed are left untouched, so their modification times are preserved
+and Sphinx does not re-read them, and files that are no longer generated are
+pruned.
+
+All generated files are written with :func:`write_chunks_if_changed`, which
+writes only the changed files, atomically, and reports whether the file was
+:data:`CREATED`, :data:`UPDATED` or :data:`UNCHANGED`.
+
+"""
+from sphinkydocext import log
+import hashlib
+import json
+import os
+import tempfile
+
+MANIFEST_FILENAME = '.sphinkydoc-manifest'
+"""Default filename of the manifest, relative to the manifest directory."""
+
+SYNC_MANIFEST_FILENAME = '.sphinkydoc-sync'
+"""Default filename of the :class:`SyncManifest`, relative to the destination
+directory."""
+
+CREATED = 'created'
+"""Status of written file that did not exist."""
+
+UPDATED = 'updated'
+"""Status of written file whose content changed."""
+
+UNCHANGED = 'unchanged'
+"""Status of file that was not written, as its content did not change."""
+
+WRITTEN = (CREATED, UPDATED)
+"""Statuses of written files."""
+
+
+def content_hash(content):
+    """Hash of the given content.
+
+    :param content: String or unicode string, unicode is hashed as UTF-8.
+    :returns: Hex digest.
+
+    """
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    return hashlib.md5(content).hexdigest()
+
+
+def file_hash(filepath, chunk_size=65536):
+    """Hash of the given file, or :const:`None` if the file does not exist.
+
+    :param filepath: Path to the file.
+    :returns: Hex digest.
+
+    """
+    try:
+        f = open(filepath, 'rb')
+    except IOError:
+        return None
+
+    h = hashlib.md5()
+    try:
+        chunk = f.read(chunk_size)
+        while chunk:
+            h.update(chunk)
+            chunk = f.read(chunk_size)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+
+def write_if_changed(filepath, content):
+    """Writes the content to the file, unless the file has the same content.
+
+    See :func:`write_chunks_if_changed`.
+
+    :param filepath: Path to the file.
+    :param content: Content of the file.
+    :returns: Status, :data:`CREATED`, :data:`UPDATED` or :data:`UNCHANGED`.
+
+    """
+    return write_chunks_if_changed(filepath, [content])[0]
+
+
+def write_chunks_if_changed(filepath, chunks):
+    """Writes the content streamed in chunks to the file, unless the file has 
+    the same content.
+
+    The chunks are compared to the existing file while they are produced, so
+    the content is never held in memory as a whole. Changed content is written
+    to a temporary file, which then replaces the file. Thus the file is never 
+    seen half written, and links at the path are replaced instead of writing
+    through them to the linked files, see 
+    :func:`~sphinkydocext.utils.stage_file`.
+
+    :param filepath: Path to the file.
+    :param chunks: Iterable of strings or unicode strings, unicode is written
+        as UTF-8.
+    :returns: Tuple of status, :data:`CREATED`, :data:`UPDATED` or 
+        :data:`UNCHANGED`, and hex digest of the content, see 
+        :func:`content_hash`.
+
+    """
+    h = hashlib.md5()
+    try:
+        existing = open(filepath, 'rb')
+    except IOError:
+        existing = None
+
+    matched = 0
+    out = temp_path = None
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            h.update(chunk)
+
+            if out is None:
+                if existing is not None and \
+                    existing.read(len(chunk)) == chunk:
+                    matched += len(chunk)
+                    continue
+                out, temp_path = _open_replacement(filepath, existing, matched)
+            out.write(chunk)
+
+        if out is None:
+            if existing is not None and existing.read(1) == '':
+                log.debug("Unchanged %s file." % filepath)
+                return UNCHANGED, h.hexdigest()
+            out, temp_path = _open_replacement(filepath, existing, matched)
+    except:
+        if out is not None:
+            out.close()
+            os.remove(temp_path)
+        raise
+    finally:
+        if existing is not None:
+            existing.close()
+
+    out.close()
+    _replace(temp_path, filepath)
+    return (UPDATED if existing is not None else CREATED), h.hexdigest()
+
+
+def _open_replacement(filepath, existing, matched):
+    """Temporary file replacing the file, with the already matched content of
+    the existing file copied.
+
+    :returns: Tuple of the opened file and its path.
+
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(filepath) or ".",
+                                     prefix="." + os.path.basename(filepath),
+                                     suffix=".tmp")
+    out = os.fdopen(fd, 'wb')
+    if matched:
+        existing.seek(0)
+        out.write(existing.read(matched))
+    return out, temp_path
+
+
+def _replace(temp_path, filepath):
+    """Renames the temporary file over the file, with the permissions of the 
+    replaced file or the default permissions."""
+    try:
+        mode = os.stat(filepath).st_mode & 0777
+    except os.error:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0666 & ~umask
+    os.chmod(temp_path, mode)
+
+    if os.name == 'nt' and os.path.lexists(filepath):
+        os.remove(filepath)
+    os.rename(temp_path, filepath)
+
+
+class Manifest(object):
+    """Content-hash manifest of files generated to a directory.
+
+    Files recorded by the previous build are *owned* by the manifest, and
+    those are overwritten whenever their content changes. Files that exist but
+    are not owned are treated as user written files, and are overwritten only
+    if explicitly asked.
+
+    """
+    def __init__(self, directory, filename=MANIFEST_FILENAME):
+        """Create manifest, and load the previous manifest if it exists.
+
+        :param directory: Directory of the generated files.
+        :param filename: Filename of the manifest, relative to the directory.
+
+        """
+        self.directory = os.path.abspath(directory)
+        self.filename = os.path.join(self.directory, filename)
+        self._previous = {}
+        self._current = {}
+        self._statuses = {}
+        self.load()
+
+    def _key(self, filepath):
+        """Manifest key of the file, posix path relative to the directory."""
+        path = os.path.relpath(os.path.abspath(filepath), self.directory)
+        return path.replace("\\", "/")
+
+    def load(self):
+        """Loads the previous manifest, if it exists."""
+        if not os.path.exists(self.filename):
+            return
+
+        try:
+            f = open(self.filename, 'r')
+            try:
+                self._previous = json.load(f).get('files', {})
+            finally:
+                f.close()
+        except (IOError, ValueError), e:
+            log.warning("Unable to load manifest %s: %s", self.filename, e)
+            self._previous = {}
+
+    def save(self):
+        """Saves the files recorded in this build."""
+        f = open(self.filename, 'w+')
+        try:
+            json.dump({'files' : self._current}, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+    def owns(self, filepath):
+        """Is the file generated by Sphinkydoc?"""
+        key = self._key(filepath)
+        return key in self._previous or key in self._current
+
+    def writable(self, filepath, overwrite=False):
+        """Can the file be written?
+
+        :param filepath: Path to the file.
+        :param overwrite: Overwrite the file even if it is not owned.
+
+        """
+        return overwrite or self.owns(filepath) or \
+            not os.path.exists(filepath)
+
+    def write(self, filepath, content, overwrite=False):
+        """Writes the file if the content has changed, and records it.
+
+        :param filepath: Path to the file.
+        :param content: Content of the file.
+        :param overwrite: Overwrite the file even if it is not owned.
+        :returns: Status, see :func:`write_chunks_if_changed`, or 
+            :const:`None` if the file is not writable.
+
+        """
+        return self.write_chunks(filepath, [content], overwrite)
+
+    def write_chunks(self, filepath, chunks, overwrite=False):
+        """Writes the file streamed in chunks if the content has changed, and
+        records it, see :func:`write_chunks_if_changed`.
+
+        :param filepath: Path to the file.
+        :param chunks: Iterable of the content chunks.
+        :param overwrite: Overwrite the file even if it is not owned.
+        :returns: Status, or :const:`None` if the file is not writable.
+
+        """
+        if not self.writable(filepath, overwrite):
+            return None
+
+        status, digest = write_chunks_if_changed(filepath, chunks)
+        key = self._key(filepath)
+        self._current[key] = digest
+        self._statuses[key] = status
+        return status
+
+    def summary(self):
+        """Numbers of files written in this build by their status.
+
+        :returns: Dictionary of statuses and numbers of files.
+
+        """
+        counts = dict.fromkeys([CREATED, UPDATED, UNCHANGED], 0)
+        for status in self._statuses.itervalues():
+            counts[status] += 1
+        return counts
+
+    def record(self, filepath):
+        """Records the existing file as generated.
+
+        :param filepath: Path to the file.
+
+        """
+        self._current[self._key(filepath)] = file_hash(filepath)
+
+    def keep(self, filepath):
+        """Records the file generated by the previous build as unchanged,
+        without writing it.
+
+        :param filepath: Path to the file.
+        :returns: :const:`True` if the file was generated by the previous
+            build and still exists.
+
+        """
+        key = self._key(filepath)
+        if key not in self._previous or not os.path.isfile(filepath):
+            return False
+
+        self._current[key] = self._previous[key]
+        self._statuses[key] = UNCHANGED
+        return True
+
+    def forget(self, filepath):
+        """Removes the file from the manifest, it is not pruned either."""
+        key = self._key(filepath)
+        self._previous.pop(key, None)
+        self._current.pop(key, None)
+        self._statuses.pop(key, None)
+
+    def prune(self):
+        """Removes files generated by the previous build but not by this one.
+
+        :returns: List of removed file paths.
+
+        """
+        removed = []
+        for key in sorted(set(self._previous) - set(self._current)):
+            filepath = os.path.join(self.directory, *key.split("/"))
+            if os.path.isfile(filepath):
+                os.remove(filepath)
+                log.info("Pruned stale %s file." % filepath)
+                removed.append(filepath)
+        return removed
+
+
+class SyncManifest(object):
+    """Manifest of files synchronized from source directory to destination
+    directory, see :func:`~sphinkydocext.utils.copy_tree`.
+
+    Each file is recorded with the modification time and size of the source
+    and the destination, and optionally with the content hash of the source.
+    A file is unchanged if its destination is as recorded, and its source is
+    either as recorded or has the recorded content hash.
+
+    """
+    def __init__(self, directory, filename=SYNC_MANIFEST_FILENAME):
+        """Create manifest, and load the previous manifest if it exists.
+
+        :param directory: Destination directory.
+        :param filename: Filename of the manifest, relative to the directory.
+
+        """
+        self.directory = os.path.abspath(directory)
+        self.filename = os.path.join(self.directory, filename)
+        self.previous = {}
+        self.current = {}
+        self._digests = {}
+        self.load()
+
+    def key(self, filepath):
+        """Manifest key of the destination file, posix path relative to the
+        directory."""
+        path = os.path.relpath(os.path.abspath(filepath), self.directory)
+        return path.replace("\\", "/")
+
+    def load(self):
+        """Loads the previous manifest, if it exists."""
+        if not os.path.exists(self.filename):
+            return
+
+        try:
+            f = open(self.filename, 'r')
+            try:
+                self.previous = json.load(f).get('files', {})
+            finally:
+                f.close()
+        except (IOError, ValueError), e:
+            log.warning("Unable to load manifest %s: %s", self.filename, e)
+            self.previous = {}
+
+    def save(self):
+        """Saves the files recorded in this synchronization."""
+        if not os.path.isdir(self.directory):
+            return
+
+        f = open(self.filename, 'w+')
+        try:
+            json.dump({'files' : self.current}, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+    def unchanged(self, src, dst, src_stamp, use_hash=False):
+        """Is the destination file up to date, and can be left untouched?
+
+        :param src: Path to the source file.
+        :param dst: Path to the destination file.
+        :param src_stamp: Modification time and size of the source.
+        :param use_hash: Compare the content hash of source, if its
+            modification time or size differ.
+
+        """
+        entry = self.previous.get(self.key(dst))
+        if entry is None or _stamp(dst) != entry['dst']:
+            return False
+
+        if list(src_stamp) == entry['src']:
+            return True
+
+        return use_hash and entry['hash'] is not None and \
+            src_stamp[1] == entry['src'][1] and \
+            self._file_hash(src) == entry['hash']
+
+    def _file_hash(self, filepath):
+        """Content hash of the file, computed once per synchronization."""
+        if filepath not in self._digests:
+            self._digests[filepath] = file_hash(filepath)
+        return self._digests[filepath]
+
+    def record(self, src, dst, src_stamp, use_hash=False):
+        """Records the synchronized file.
+
+        :param src: Path to the source file.
+        :param dst: Path to the destination file.
+        :param src_stamp: Modification time and size of the source.
+        :param use_hash: Record the content hash of the source.
+
+        """
+        key = self.key(dst)
+        digest = None
+        if use_hash:
+            previous = self.previous.get(key)
+            if previous is not None and previous['src'] == list(src_stamp):
+                digest = previous['hash']
+            if digest is None:
+                digest = self._file_hash(src)
+
+        self.current[key] = {'src' : list(src_stamp), 'dst' : _stamp(dst),
+                             'hash' : digest}
+
+    def vanished(self):
+        """Destination files of the previous synchronization, whose source
+        did not exist in this one.
+
+        :returns: List of file paths.
+
+        """
+        return [os.path.join(self.directory, *key.split("/"))
+                for key in sorted(set(self.previous) - set(self.current))]
+
+
+def _stamp(filepath):
+    """Modification time and size of file as list, or :const:`None`."""
+    try:
+        st = os.stat(filepath)
+    except os.error:
+        return None
+    return [st.st_mtime, st.st_size]
@@ -0,0 +1,545 @@
+"""Script documentation helpers.
+
+Scripts are documented by their :obj:`optparse.OptionParser`, which is turned
+to plain data :class:`OptionParserInfo`, or by their ``--help`` output if 
+parser cannot be found. Both can be cached by
+:class:`~sphinkydocext.cache.ScriptCache`, so unchanged scripts are not run.
+
+Parsers are resolved from the script sources without executing them if
+possible, see :func:`~sphinkydocext.static.get_static_optparser`. Otherwise 
+they are looked for by executing the scripts in pool of 
+:class:`OptparserWorker` processes, with time and memory limits.
+
+"""
+from sphinkydocext import log, timing, worker
+from sphinkydocext.static import get_static_optparser
+from sphinkydocext.utils import is_python_script
+import Queue
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HELP_TIMEOUT = 60
+"""Default time limit of capturing ``--help`` in seconds."""
+
+HELP_MAX_OUTPUT = 1024 * 1024
+"""Maximum length of captured ``--help`` output in bytes, rest is truncated."""
+
+KILL_GRACE_PERIOD = 1.0
+"""Seconds the timed out script has to exit after being terminated, before it
+is killed."""
+
+WORKER_MEMORY_LIMIT = 1024 * 1024 * 1024
+"""Default address space limit of :class:`OptparserWorker` in bytes."""
+
+WORKER_MAX_REQUESTS = 100
+"""Number of scripts :class:`OptparserWorker` executes before it is replaced
+with fresh process. Worker restores modules, paths and arguments after each
+script, see :mod:`sphinkydocext.worker`, this bounds the state it cannot
+restore, e.g. monkeypatches."""
+
+
+class OptionInfo(object):
+    """Plain data description of :obj:`optparse.Option`.
+    
+    Has the same attributes templates use from :obj:`optparse.Option`.
+    
+    """
+    
+    def __init__(self, short_opts=(), long_opts=(), metavar=None, dest=None,
+                 help=None, nargs=None):
+        # Pylint-disable: Redefining built-in help
+        #     pylint: disable-msg=W0622
+        self._short_opts = list(short_opts)
+        self._long_opts = list(long_opts)
+        self.metavar = metavar
+        self.dest = dest
+        self.help = help
+        self.nargs = nargs
+    
+    @classmethod
+    def from_option(cls, option):
+        """Creates the description of :obj:`optparse.Option`."""
+        return cls.from_dict(worker.option_to_dict(option))
+    
+    def to_dict(self):
+        return {'short_opts' : self._short_opts, 
+                'long_opts' : self._long_opts, 
+                'metavar' : self.metavar, 'dest' : self.dest, 
+                'help' : self.help, 'nargs' : self.nargs}
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['short_opts'], data['long_opts'], data['metavar'], 
+                   data['dest'], data['help'], data['nargs'])
+
+
+class OptionGroupInfo(object):
+    """Plain data description of :obj:`optparse.OptionGroup`."""
+    
+    def __init__(self, title, description=None, option_list=()):
+        self.title = title
+        self.description = description
+        self.option_list = list(option_list)
+    
+    def get_description(self):
+        return self.description or ""
+    
+    def to_dict(self):
+        return {'title' : self.title, 'description' : self.description,
+                'option_list' : [o.to_dict() for o in self.option_list]}
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['title'], data['description'], 
+                   [OptionInfo.from_dict(o) for o in data['option_list']])
+
+
+class OptionParserInfo(object):
+    """Plain data description of :obj:`optparse.OptionParser`.
+    
+    Has the same methods and attributes templates use from 
+    :obj:`optparse.OptionParser`, so it can be used in place of one.
+    
+    """
+    
+    def __init__(self, usage="", description="", option_list=(), 
+                 option_groups=()):
+        """Create description.
+        
+        :param usage: Formatted usage, as returned by 
+            :meth:`optparse.OptionParser.get_usage`.
+        :param description: Description, ``%prog`` expanded.
+        :param option_list: List of :class:`OptionInfo`, options not in groups.
+        :param option_groups: List of :class:`OptionGroupInfo`.
+        
+        """
+        self.usage = usage
+        self.description = description
+        self.option_list = list(option_list)
+        self.option_groups = list(option_groups)
+    
+    def get_usage(self):
+        return self.usage
+    
+    def get_description(self):
+        return self.description
+    
+    @classmethod
+    def from_optparser(cls, parser, prog=None):
+        """Creates the description of :obj:`optparse.OptionParser`.
+        
+        :param parser: :obj:`optparse.OptionParser`
+        :param prog: Program name ``%prog`` is expanded to, if the parser does 
+            not define one. Usually the script name.
+        
+        """
+        return cls.from_dict(worker.optparser_to_dict(parser, prog))
+    
+    def to_dict(self):
+        return {'usage' : self.usage, 'description' : self.description,
+                'option_list' : [o.to_dict() for o in self.option_list],
+                'option_groups' : [g.to_dict() for g in self.option_groups]}
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['usage'], data['description'],
+                   [OptionInfo.from_dict(o) for o in data['option_list']],
+                   [OptionGroupInfo.from_dict(g) 
+                    for g in data['option_groups']])
+
+
+class HelpResult(object):
+    """Result of capturing the ``--help`` output of a script."""
+
+    def __init__(self, script_path):
+        self.script_path = script_path
+        """Path to the script."""
+
+        self.output = ""
+        """Captured output, carriage returns removed."""
+
+        self.returncode = None
+        """Exit code of the script, :const:`None` if it could not be run."""
+
+        self.duration = 0.0
+        """Running time of the script in seconds."""
+
+        self.timed_out = False
+        """Was the script terminated because of timeout?"""
+
+        self.truncated = False
+        """Was the output truncated to :data:`HELP_MAX_OUTPUT`?"""
+
+        self.error = None
+        """Error message, if the script could not be run."""
+
+    def __repr__(self):
+        return "<HelpResult %s: exit %s in %.2fs>" % \
+            (self.script_path, self.returncode, self.duration)
+    
+    def to_dict(self):
+        return {'output' : self.output, 'returncode' : self.returncode,
+                'truncated' : self.truncated}
+    
+    @classmethod
+    def from_dict(cls, script_path, data):
+        result = cls(script_path)
+        result.output = data['output']
+        result.returncode = data['returncode']
+        result.truncated = data['truncated']
+        return result
+
+
+def capture_help(script_path, timeout=HELP_TIMEOUT,
+                 max_output=HELP_MAX_OUTPUT):
+    """Runs the script using ``--help`` and captures the output.
+
+    If the script does not exit in time it is terminated, and killed if it
+    does not exit during :data:`KILL_GRACE_PERIOD` either. Output captured
+    before that is still returned.
+
+    :param script_path: Path to the script.
+    :param timeout: Time limit in seconds, :const:`None` for no limit.
+    :param max_output: Maximum length of the output in bytes.
+    :returns: :class:`HelpResult`
+
+    """
+    result = HelpResult(script_path)
+    cmd = ["python", script_path, "--help"]
+
+    # Output goes to temporary file, so the script cannot block on full pipe
+    # while we are waiting for it
+    stdout = tempfile.TemporaryFile()
+    devnull = open(os.devnull, 'w')
+    start = time.time()
+    try:
+        try:
+            p = subprocess.Popen(cmd, stdout=stdout, stderr=devnull)
+        except os.error, e:
+            result.error = str(e)
+            return result
+
+        delay = 0.001
+        while p.poll() is None:
+            if timeout is not None and time.time() - start > timeout:
+                result.timed_out = True
+                _terminate(p)
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+        result.returncode = p.returncode
+        result.duration = time.time() - start
+
+        stdout.seek(0)
+        output = stdout.read(max_output + 1)
+        if len(output) > max_output:
+            output = output[:max_output]
+            result.truncated = True
+        result.output = output.replace("\r", "")
+    finally:
+        stdout.close()
+        devnull.close()
+
+    if result.timed_out:
+        log.warning("Script %s did not exit in %s seconds, it was killed.",
+                    script_path, timeout)
+    if result.truncated:
+        log.warning("Help of script %s was truncated to %d bytes.",
+                    script_path, max_output)
+    log.info("Help of script %s captured in %.2f seconds." %
+             (script_path, result.duration))
+    return result
+
+
+def _terminate(p):
+    """Terminates the process, and kills it if it does not exit."""
+    try:
+        p.terminate()
+        deadline = time.time() + KILL_GRACE_PERIOD
+        while p.poll() is None and time.time() < deadline:
+            time.sleep(0.01)
+        if p.poll() is None:
+            p.kill()
+        p.wait()
+    except os.error:
+        pass
+
+
+def capture_helps(script_paths, jobs=1, timeout=HELP_TIMEOUT,
+                  max_output=HELP_MAX_OUTPUT):
+    """Captures ``--help`` output of several scripts concurrently.
+
+    :param script_paths: Paths to the scripts.
+    :param jobs: Maximum number of scripts running at the same time.
+    :param timeout: Time limit of each script, see :func:`capture_help`.
+    :param max_output: Maximum length of the output of each script.
+    :returns: Dictionary of script paths and :class:`HelpResult` objects.
+
+    """
+    results = {}
+    queue = Queue.Queue()
+    for script_path in script_paths:
+        queue.put(script_path)
+    parent = timing.current()
+
+    def worker():
+        while True:
+            try:
+                script_path = queue.get_nowait()
+            except Queue.Empty:
+                return
+            span = timing.start('script', script_path, parent)
+            results[script_path] = capture_help(script_path, timeout,
+                                                max_output)
+            timing.stop(span)
+
+    threads = [threading.Thread(target=worker)
+               for _i in range(max(1, min(jobs, len(script_paths))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+class WorkerError(Exception):
+    """Worker did not answer in time, or exited."""
+
+
+class OptparserWorker(object):
+    """Worker process looking for :obj:`optparse.OptionParser` of scripts.
+    
+    The worker executes scripts like 
+    :func:`~sphinkydocext.utils.script_get_optparser` does, but in separate
+    process, see :mod:`sphinkydocext.worker`. One worker runs one script at
+    a time.
+    
+    """
+    
+    def __init__(self, memory_limit=WORKER_MEMORY_LIMIT):
+        """Starts the worker process.
+        
+        :param memory_limit: Address space limit in bytes, or :const:`None`.
+        :raises OSError: If the process cannot be started.
+        
+        """
+        worker_file = os.path.splitext(worker.__file__)[0] + ".py"
+        devnull = open(os.devnull, 'w')
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable or "python", worker_file],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull,
+                close_fds=(os.name == 'posix'))
+        finally:
+            devnull.close()
+        
+        self.requests = 0
+        self._responses = Queue.Queue()
+        reader = threading.Thread(target=self._read)
+        reader.daemon = True
+        reader.start()
+        
+        self._send({'sys_path' : sys.path, 'memory_limit' : memory_limit})
+    
+    def _read(self):
+        """Reads the responses, :const:`None` when the worker exits."""
+        for line in iter(self.process.stdout.readline, ''):
+            self._responses.put(line)
+        self._responses.put(None)
+    
+    def _send(self, message):
+        try:
+            self.process.stdin.write(json.dumps(message) + "\n")
+            self.process.stdin.flush()
+        except IOError, e:
+            raise WorkerError("Worker exited: %s" % e)
+    
+    def optparser(self, script_path, timeout=HELP_TIMEOUT):
+        """Looks for the optparser of the script.
+        
+        :param script_path: Path to the script.
+        :param timeout: Time limit in seconds, :const:`None` for no limit.
+        :returns: :class:`OptionParserInfo`, or :const:`None` if the script 
+            has no parser, or it cannot be executed.
+        :raises WorkerError: If the worker did not answer in time or exited,
+            the worker must not be used after that.
+        
+        """
+        self.requests += 1
+        self._send({'script' : os.path.abspath(script_path)})
+        try:
+            line = self._responses.get(timeout=timeout)
+        except Queue.Empty:
+            raise WorkerError("Script %s did not finish in %s seconds" % 
+                              (script_path, timeout))
+        
+        if line is None:
+            raise WorkerError("Worker exited while running script %s" % 
+                              script_path)
+        
+        response = json.loads(line)
+        if response['error']:
+            log.info("Script %s failed: %s" % 
+                     (script_path, response['error']))
+        
+        if response['parser'] is None:
+            return None
+        return OptionParserInfo.from_dict(response['parser'])
+    
+    def close(self):
+        """Stops the worker process."""
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        _terminate(self.process)
+
+
+def extract_optparsers(script_paths, jobs=1, timeout=HELP_TIMEOUT, 
+                       memory_limit=WORKER_MEMORY_LIMIT):
+    """Looks for optparsers of several scripts in pool of worker processes.
+    
+    Each worker is reused for several scripts, and replaced if it exceeds the
+    time limit or exits, e.g. because of memory limit.
+    
+    :param script_paths: Paths to the Python scripts.
+    :param jobs: Number of worker processes.
+    :param timeout: Time limit of each script, :const:`None` for no limit.
+    :param memory_limit: Address space limit of each worker in bytes, or 
+        :const:`None`.
+    :returns: Dictionary of script paths and :class:`OptionParserInfo` 
+        objects, or :const:`None` for scripts without parser.
+    
+    """
+    results = {}
+    queue = Queue.Queue()
+    for script_path in script_paths:
+        queue.put(script_path)
+    parent = timing.current()
+    
+    def work():
+        process = None
+        try:
+            while True:
+                try:
+                    script_path = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                
+                span = timing.start('script', script_path, parent)
+                if process is not None and \
+                    process.requests >= WORKER_MAX_REQUESTS:
+                    process.close()
+                    process = None
+                
+                try:
+                    if process is None:
+                        process = OptparserWorker(memory_limit)
+                    results[script_path] = process.optparser(script_path, 
+                                                             timeout)
+                except (OSError, WorkerError), e:
+                    log.warning("Unable to look for optparser of script "
+                                "%s: %s", script_path, e)
+                    results[script_path] = None
+                    if process is not None:
+                        process.close()
+                        process = None
+                timing.stop(span)
+        finally:
+            if process is not None:
+                process.close()
+    
+    log.info("Looking for optparsers of %d scripts, in worker processes." % 
+             len(script_paths))
+    threads = [threading.Thread(target=work)
+               for _i in range(max(1, min(jobs, len(script_paths))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    return results
+
+
+def gather_scripts(script_paths, jobs=1, timeout=HELP_TIMEOUT, cache=None,
+                   memory_limit=WORKER_MEMORY_LIMIT):
+    """Gathers the documentation sources of scripts.
+    
+    Python scripts are first looked for :obj:`optparse.OptionParser` from
+    their sources using :func:`~sphinkydocext.static.get_static_optparser`,
+    and then by executing them using :func:`extract_optparsers`. The rest of 
+    the scripts are run for ``--help`` concurrently using 
+    :func:`capture_helps`.
+    
+    :param script_paths: Paths to the scripts.
+    :param jobs: Maximum number of scripts running at the same time.
+    :param timeout: Time limit of each script run.
+    :param cache: :class:`~sphinkydocext.cache.ScriptCache` or :const:`None`.
+    :param memory_limit: Address space limit of scripts executed for 
+        optparser in bytes, or :const:`None`.
+    :returns: Dictionary of script paths, and :class:`OptionParserInfo` or 
+        :class:`HelpResult` objects.
+    
+    """
+    sources = {}
+    python_paths = []
+    help_paths = []
+    
+    for script_path in script_paths:
+        if script_path in sources or script_path in python_paths or \
+            script_path in help_paths:
+            continue
+        
+        if cache is not None:
+            cached = cache.get_script(script_path)
+            if cached is not None:
+                sources[script_path] = cached
+                continue
+        
+        if not is_python_script(script_path):
+            help_paths.append(script_path)
+            continue
+        
+        optparser = timing.timed('script', script_path, get_static_optparser, 
+                                 script_path)
+        if optparser is None:
+            python_paths.append(script_path)
+            continue
+        
+        info = OptionParserInfo.from_optparser(optparser, 
+                                               os.path.basename(script_path))
+        sources[script_path] = info
+        if cache is not None:
+            cache.set_script(script_path, info)
+    
+    if python_paths:
+        optparsers = extract_optparsers(python_paths, jobs=jobs, 
+                                        timeout=timeout, 
+                                        memory_limit=memory_limit)
+        for script_path in python_paths:
+            info = optparsers[script_path]
+            if info is None:
+                help_paths.append(script_path)
+                continue
+            
+            sources[script_path] = info
+            if cache is not None:
+                cache.set_script(script_path, info)
+    
+    for script_path, result in capture_helps(help_paths, jobs=jobs, 
+                                             timeout=timeout).iteritems():
+        sources[script_path] = result
+        
+        # Failed runs may succeed next time
+        if cache is not None and result.error is None and \
+            not result.timed_out:
+            cache.set_script(script_path, result)
+    
+    return sources
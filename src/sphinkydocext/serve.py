@@ -0,0 +1,276 @@
+"""Local preview server of the built documentation.
+
+Used by the ``--serve`` mode of :ref:`sphinkydoc.py`. Files are served from
+memory once read, and conditional requests are answered using ETags. HTML
+pages get a small script, which reloads the page when the documentation has
+been rebuilt, see :meth:`PreviewServer.notify_reload`.
+
+"""
+from sphinkydocext import log
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import hashlib
+import mimetypes
+import os
+import posixpath
+import threading
+import urllib
+
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+"""Maximum total size of the files kept in memory."""
+
+CACHE_MAX_FILE_BYTES = 4 * 1024 * 1024
+"""Files larger than this are not kept in memory."""
+
+RELOAD_PATH = "/__sphinkydoc__/reload"
+"""Path of the long-polling reload notifications."""
+
+RELOAD_TIMEOUT = 30
+"""Seconds the reload request is held, before it is answered without
+reload."""
+
+RELOAD_SCRIPT = """<script type="text/javascript">
+(function () {
+    var generation = %(generation)d;
+    function poll() {
+        var xhr = new XMLHttpRequest();
+        xhr.onreadystatechange = function () {
+            if (xhr.readyState != 4) return;
+            if (xhr.status == 200 && parseInt(xhr.responseText, 10) !=
+                generation) {
+                window.location.reload();
+            } else {
+                setTimeout(poll, xhr.status == 200 ? 0 : 2000);
+            }
+        };
+        xhr.open("GET", "%(path)s?generation=" + generation, true);
+        xhr.send(null);
+    }
+    poll();
+})();
+</script>
+"""
+"""Script added to the end of HTML pages, reloads the page after rebuild."""
+
+
+class FileCache(object):
+    """Contents of served files, validated by modification time and size."""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES,
+                 max_file_bytes=CACHE_MAX_FILE_BYTES):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self._entries = {}
+        self._size = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    def get(self, filepath):
+        """Content of the file and its ETag.
+
+        :returns: Tuple of content and ETag, or :const:`None` if the file does
+            not exist.
+
+        """
+        try:
+            st = os.stat(filepath)
+        except os.error:
+            return None
+        stamp = (st.st_mtime, st.st_size)
+
+        self._lock.acquire()
+        try:
+            self._clock += 1
+            entry = self._entries.get(filepath)
+            if entry is not None and entry[0] == stamp:
+                entry[3] = self._clock
+                return entry[1], entry[2]
+        finally:
+            self._lock.release()
+
+        try:
+            f = open(filepath, 'rb')
+            try:
+                content = f.read()
+            finally:
+                f.close()
+        except IOError:
+            return None
+
+        etag = '"%s"' % hashlib.md5(content).hexdigest()
+        if len(content) <= self.max_file_bytes:
+            self._store(filepath, [stamp, content, etag, self._clock])
+        return content, etag
+
+    def _store(self, filepath, entry):
+        self._lock.acquire()
+        try:
+            old = self._entries.pop(filepath, None)
+            if old is not None:
+                self._size -= len(old[1])
+
+            # Evict least recently used
+            while self._entries and \
+                self._size + len(entry[1]) > self.max_bytes:
+                oldest = min(self._entries,
+                             key=lambda k: self._entries[k][3])
+                self._size -= len(self._entries.pop(oldest)[1])
+
+            self._entries[filepath] = entry
+            self._size += len(entry[1])
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._size = 0
+        finally:
+            self._lock.release()
+
+
+class PreviewRequestHandler(BaseHTTPRequestHandler):
+    """Serves files of :attr:`PreviewServer.root`."""
+
+    def do_GET(self):
+        path, _sep, query = self.path.partition("?")
+        if path == RELOAD_PATH:
+            return self._reload(query)
+
+        filepath = self.server.translate_path(path)
+        if filepath is None:
+            return self.send_error(404, "File not found")
+
+        if os.path.isdir(filepath):
+            if not path.endswith("/"):
+                self.send_response(301)
+                self.send_header("Location", path + "/")
+                self.end_headers()
+                return
+            filepath = os.path.join(filepath, "index.html")
+
+        cached = self.server.cache.get(filepath)
+        if cached is None:
+            return self.send_error(404, "File not found")
+
+        content, etag = cached
+        ctype = mimetypes.guess_type(filepath)[0] or \
+            "application/octet-stream"
+
+        if ctype == "text/html":
+            content = self.server.inject_reload(content)
+            etag = '%s-%d"' % (etag[:-1], self.server.generation)
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _reload(self, query):
+        """Answers when the generation differs from the client's, or after
+        :data:`RELOAD_TIMEOUT`."""
+        try:
+            generation = int(dict(p.split("=", 1) for p in query.split("&")
+                                  if "=" in p).get("generation", -1))
+        except ValueError:
+            generation = -1
+
+        generation = self.server.wait_reload(generation, RELOAD_TIMEOUT)
+        body = str(generation)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Pylint-disable: Redefining built-in format
+        #     pylint: disable-msg=W0622
+        log.info("%s - %s" % (self.address_string(), format % args))
+
+
+class PreviewServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server of the built documentation."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, port=8000, host="127.0.0.1"):
+        """Create server.
+
+        :param root: Directory to serve, e.g. the HTML output directory.
+        :param port: Port to listen.
+        :param host: Address to listen, defaults to local connections only.
+
+        """
+        HTTPServer.__init__(self, (host, port), PreviewRequestHandler)
+        self.root = os.path.abspath(root)
+        self.cache = FileCache()
+        self.generation = 0
+        self._reloaded = threading.Condition()
+
+    def translate_path(self, path):
+        """File path of the URL path, or :const:`None` if it is outside the
+        root."""
+        path = posixpath.normpath(urllib.unquote(path))
+        parts = [p for p in path.split("/") if p and p not in (".", "..")]
+        filepath = os.path.join(self.root, *parts)
+        if not os.path.abspath(filepath).startswith(self.root):
+            return None
+        return filepath
+
+    def inject_reload(self, content):
+        """Adds the reload script to the end of HTML page."""
+        script = RELOAD_SCRIPT % {'generation' : self.generation,
+                                  'path' : RELOAD_PATH}
+        index = content.rfind("</body>")
+        if index == -1:
+            return content + script
+        return content[:index] + script + content[index:]
+
+    def notify_reload(self):
+        """Tells the open pages to reload, e.g. after rebuild."""
+        self.cache.clear()
+        self._reloaded.acquire()
+        try:
+            self.generation += 1
+            self._reloaded.notifyAll()
+        finally:
+            self._reloaded.release()
+
+    def wait_reload(self, generation, timeout):
+        """Waits until the generation differs from the given one.
+
+        :returns: Current generation.
+
+        """
+        self._reloaded.acquire()
+        try:
+            if self.generation == generation:
+                self._reloaded.wait(timeout)
+            return self.generation
+        finally:
+            self._reloaded.release()
+
+    def start(self):
+        """Starts serving in background thread."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%d/" % (host, port)
@@ -0,0 +1,815 @@
+"""Static introspection of Python sources.
+
+Introspects modules by parsing their source with :mod:`ast`, instead of
+importing them. This is much cheaper than importing, does not run import time
+side effects, and works even if dependencies of the module are not installed.
+
+The results are of same form as :func:`~sphinkydocext.utils.get_module_members`
+returns. Because nothing is executed, some things are only approximated:
+
+* Names imported from other modules are classified by looking them up from the
+  sources of those modules, if that fails the name itself is used as a hint.
+* Only literal ``__all__`` definitions are understood, others are treated as if
+  the module does not have ``__all__``.
+* Module of the object, its ``__module__``, decides whether the member is
+  defined in the module. Values are assumed to be plain, e.g. numbers or
+  strings, having no ``__module__``, unless they are created by calling a
+  class, or one of :data:`INSTANCE_FACTORIES`.
+* Names bound in the ``try`` clause win over the fallbacks bound in its
+  ``except`` clauses. Other conditional bindings are all visited, and names of
+  star imports are not known.
+
+Scripts are introspected for :obj:`optparse.OptionParser` the same way, see
+:func:`get_static_optparser`.
+
+"""
+from sphinkydocext import log
+from sphinkydocext.utils import file_stamp, find_module_file
+from pkgutil import iter_modules
+import __builtin__
+import ast
+import optparse
+import os
+
+# Pylint-disable settings ----------------
+# Todo messages:
+#     pylint: disable-msg=W0511
+
+BUILTIN_EXCEPTIONS = frozenset(name for name, obj in vars(__builtin__).items()
+                               if isinstance(obj, type) and
+                               issubclass(obj, Exception))
+"""Names of builtin exception classes."""
+
+MAX_DEPTH = 8
+"""Maximum depth of following imports when classifying names."""
+
+MODULE_ATTRIBUTES = ['__builtins__', '__doc__', '__file__', '__name__',
+                     '__package__']
+"""Attributes every imported module has, packages have also ``__path__``."""
+
+INSTANCE_FACTORIES = {'logging.getLogger' : 'logging'}
+"""Functions returning instances of classes, mapped to the modules of the
+classes."""
+
+_parsed = {}
+
+
+class StaticModule(object):
+    """Parsed module source, with names bound in the module."""
+
+    def __init__(self, name, filename, is_package=False):
+        """Parse the module.
+
+        :param name: Full name of the module.
+        :param filename: Path to the source file.
+        :param is_package: Is the module a package?
+        :raises SyntaxError: If the source cannot be parsed.
+
+        """
+        self.name = name
+        self.filename = filename
+        self.is_package = is_package
+
+        self.all = None
+        """Names in literal ``__all__``, or :const:`None`."""
+
+        self.definitions = {}
+        """Names defined in the module, mapped to the defining node."""
+
+        self.imports = {}
+        """Imported names, mapped to tuple of module name and attribute name.
+        Attribute name is :const:`None` for imported modules."""
+
+        f = open(filename, 'rU')
+        try:
+            source = f.read()
+        finally:
+            f.close()
+
+        self._visit(ast.parse(source, filename).body)
+
+    @property
+    def package(self):
+        """Name of the package this module is in."""
+        if self.is_package:
+            return self.name
+        return self.name.rpartition(".")[0]
+
+    def _visit(self, body):
+        """Collects the bound names from module level statements."""
+        for node in body:
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef)):
+                self._bind(node.name, node)
+            elif isinstance(node, ast.Assign):
+                for target in node.targets:
+                    self._assign(target, node.value)
+            elif isinstance(node, ast.AugAssign):
+                self._assign(node.target, node.value, augmented=True)
+            elif isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.asname:
+                        self._import(alias.asname, alias.name, None)
+                    else:
+                        top = alias.name.split(".")[0]
+                        self._import(top, top, None)
+            elif isinstance(node, ast.ImportFrom):
+                module = self._absolute(node.module or "", node.level)
+                for alias in node.names:
+                    if alias.name == "*":
+                        continue
+                    self._import(alias.asname or alias.name, module,
+                                 alias.name)
+            elif isinstance(node, ast.Expr):
+                self._all_call(node.value)
+            elif isinstance(node, ast.If) and _is_main_guard(node.test):
+                continue # Not run on import
+            else:
+                # Conditional definitions, e.g. try: import; except: ..., the
+                # fallbacks of except clauses are visited first
+                for field in ('handlers', 'body', 'orelse', 'finalbody'):
+                    sub = getattr(node, field, None)
+                    if isinstance(sub, list):
+                        self._visit(sub)
+
+    def _bind(self, name, node):
+        self.definitions[name] = node
+        self.imports.pop(name, None)
+
+    def _import(self, name, module, attr):
+        self.imports[name] = (module, attr)
+        self.definitions.pop(name, None)
+
+    def _assign(self, target, value, augmented=False):
+        if isinstance(target, ast.Name):
+            if target.id == "__all__":
+                self._all_assign(value, augmented)
+                self._bind(target.id, value)
+            elif not augmented or target.id not in self.definitions:
+                self._bind(target.id, value)
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            for elt in target.elts:
+                self._assign(elt, None)
+
+    def _all_assign(self, value, augmented):
+        names = _literal_names(value)
+        if names is None:
+            log.info("Module %s has non-literal __all__, it cannot be "
+                     "introspected statically" % self.name)
+            self.all = None
+        elif augmented and self.all is not None:
+            self.all.extend(names)
+        else:
+            self.all = names
+
+    def _all_call(self, value):
+        """Handles ``__all__.extend([...])`` and ``__all__.append(...)``."""
+        if not (isinstance(value, ast.Call) and
+                isinstance(value.func, ast.Attribute) and
+                isinstance(value.func.value, ast.Name) and
+                value.func.value.id == "__all__" and self.all is not None):
+            return
+
+        if value.func.attr == "extend" and len(value.args) == 1:
+            names = _literal_names(value.args[0])
+        elif value.func.attr == "append" and len(value.args) == 1:
+            names = _literal_names(ast.List(elts=value.args, ctx=ast.Load()))
+        else:
+            names = None
+
+        if names is None:
+            self.all = None
+        else:
+            self.all.extend(names)
+
+    def _absolute(self, module, level):
+        """Absolute module name of relative import."""
+        if not level:
+            return module
+
+        parts = self.package.split(".")
+        if level > 1:
+            parts = parts[:-(level - 1)]
+
+        if module:
+            parts.append(module)
+        return ".".join(parts)
+
+    def kind(self, name, depth=0):
+        """Classifies the name bound in the module.
+
+        :returns: One of ``'class'``, ``'exception'``, ``'function'``,
+            ``'data'``, ``'module'``, or :const:`None` if name is not bound.
+
+        """
+        if name in self.definitions:
+            node = self.definitions[name]
+            if isinstance(node, ast.ClassDef):
+                if self._is_exception(node, depth):
+                    return 'exception'
+                return 'class'
+            elif isinstance(node, (ast.FunctionDef, ast.Lambda)):
+                return 'function'
+            elif isinstance(node, ast.Name) and node.id != name and \
+                depth < MAX_DEPTH:
+                # Aliases, e.g. "OtherName = SomeClass"
+                return self.kind(node.id, depth + 1) or 'data'
+            return 'data'
+
+        if name in self.imports:
+            module, attr = self.imports[name]
+            if attr is None:
+                return 'module'
+            return _imported_kind(self, module, attr, depth + 1)
+
+        return None
+
+    def origin(self, name, depth=0):
+        """Module of the object bound to the name, i.e. its ``__module__``.
+
+        :returns: Full name of the module, or :const:`None` for plain values
+            and names that are not bound.
+
+        """
+        if depth > MAX_DEPTH:
+            return None
+
+        if name in self.definitions:
+            node = self.definitions[name]
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.Lambda)):
+                return self.name
+            elif isinstance(node, ast.Name) and node.id != name:
+                if node.id in self.definitions or node.id in self.imports:
+                    return self.origin(node.id, depth + 1)
+                return _builtin_origin(node.id)
+            elif isinstance(node, ast.Call):
+                return self._call_origin(node.func, depth + 1)
+            elif isinstance(node, ast.Attribute) and \
+                isinstance(node.value, ast.Name) and \
+                node.value.id in self.imports and \
+                self.imports[node.value.id][1] is None:
+                # Aliases, e.g. "default_timer = time.time"
+                return _imported_origin(self, self.imports[node.value.id][0],
+                                        node.attr, depth + 1)
+            return None
+
+        if name in self.imports:
+            module, attr = self.imports[name]
+            if attr is None:
+                return None
+            return _imported_origin(self, module, attr, depth + 1)
+
+        return None
+
+    def _call_origin(self, func, depth):
+        """Module of the object returned by calling the function or
+        class."""
+        if isinstance(func, ast.Name):
+            if func.id in self.definitions or func.id in self.imports:
+                if self.kind(func.id, depth) in ('class', 'exception'):
+                    return self.origin(func.id, depth)
+                if func.id in self.imports:
+                    module, attr = self.imports[func.id]
+                    return INSTANCE_FACTORIES.get("%s.%s" % (module, attr))
+                return None
+            # Builtin classes create plain values, except type()
+            if func.id == 'type':
+                return _builtin_origin(func.id)
+            return None
+
+        if isinstance(func, ast.Attribute) and \
+            isinstance(func.value, ast.Name) and \
+            func.value.id in self.imports and \
+            self.imports[func.value.id][1] is None:
+            module = self.imports[func.value.id][0]
+            if _imported_kind(self, module, func.attr,
+                              depth) in ('class', 'exception'):
+                return _imported_origin(self, module, func.attr, depth)
+            return INSTANCE_FACTORIES.get("%s.%s" % (module, func.attr))
+
+        return None
+
+    def _is_exception(self, node, depth):
+        for base in node.bases:
+            if isinstance(base, ast.Name):
+                if base.id in BUILTIN_EXCEPTIONS:
+                    return True
+                if depth < MAX_DEPTH and \
+                    self.kind(base.id, depth + 1) == 'exception':
+                    return True
+            elif isinstance(base, ast.Attribute) and \
+                isinstance(base.value, ast.Name):
+                # E.g. "errors.SomeError", where errors is imported module
+                if base.value.id in self.imports and depth < MAX_DEPTH:
+                    module, attr = self.imports[base.value.id]
+                    if attr is not None:
+                        module = module + "." + attr
+                    if _imported_kind(self, module, base.attr,
+                                      depth + 1) == 'exception':
+                        return True
+                elif base.attr in BUILTIN_EXCEPTIONS:
+                    return True
+        return False
+
+
+def _is_main_guard(test):
+    """Is the test ``__name__ == '__main__'``?"""
+    return isinstance(test, ast.Compare) and len(test.ops) == 1 and \
+        isinstance(test.ops[0], ast.Eq) and \
+        isinstance(test.left, ast.Name) and test.left.id == '__name__' and \
+        isinstance(test.comparators[0], ast.Str) and \
+        test.comparators[0].s == '__main__'
+
+
+def _literal_names(node):
+    """List of strings from literal list or tuple node, or :const:`None`."""
+    if not isinstance(node, (ast.List, ast.Tuple)):
+        return None
+
+    try:
+        names = list(ast.literal_eval(node))
+    except ValueError:
+        return None
+
+    if not all(isinstance(n, basestring) for n in names):
+        return None
+    return names
+
+
+def _candidates(importer, module):
+    """Full names the module imported by the importer may have."""
+    candidates = [module]
+
+    # Implicit relative imports, e.g. "import submodule" inside package
+    if importer.package and module != importer.package and \
+        not module.startswith(importer.package + "."):
+        candidates.insert(0, importer.package + "." + module)
+    return candidates
+
+
+def _imported_kind(importer, module, attr, depth):
+    """Classifies the name imported from other module."""
+    if depth < MAX_DEPTH:
+        for candidate in _candidates(importer, module):
+            static_module = parse_module(candidate)
+            if static_module is None:
+                continue
+
+            # Package importing its own submodules, "from . import sub"
+            if static_module is not importer:
+                kind = static_module.kind(attr, depth)
+                if kind is not None:
+                    return kind
+
+            if find_module_file(candidate + "." + attr) is not None:
+                return 'module'
+
+    return _guess_kind(attr)
+
+
+def _imported_origin(importer, module, attr, depth):
+    """Module of the object imported from other module, see
+    :meth:`StaticModule.origin`."""
+    if depth < MAX_DEPTH:
+        for candidate in _candidates(importer, module):
+            static_module = parse_module(candidate)
+            if static_module is None:
+                continue
+
+            if static_module is not importer and \
+                static_module.kind(attr, depth) is not None:
+                return static_module.origin(attr, depth)
+
+            if find_module_file(candidate + "." + attr) is not None:
+                return None
+
+    if _guess_kind(attr) == 'data':
+        return None
+    return module
+
+
+def _builtin_origin(name):
+    """Module of the builtin class or function, :const:`None` for other
+    builtins."""
+    obj = getattr(__builtin__, name, None)
+    if isinstance(obj, type) or callable(obj):
+        return '__builtin__'
+    return None
+
+
+def _guess_kind(name):
+    """Guesses the kind of name that could not be looked up from sources."""
+    if name.endswith(("Error", "Exception", "Warning")):
+        return 'exception'
+    if name.isupper():
+        return 'data'
+    if name[:1].isupper():
+        return 'class'
+    return 'function'
+
+
+def parse_module(module_name):
+    """Parses the module source, without importing it.
+
+    Parsed modules are memoized as long as the source file does not change.
+
+    :param module_name: Full name of the module.
+    :returns: :class:`StaticModule`, or :const:`None` if the source is not
+        found or cannot be parsed.
+
+    """
+    found = find_module_file(module_name)
+    if found is None:
+        return None
+
+    filename, is_package = found
+    if not filename.endswith(('.py', '.pyw')):
+        return None # E.g. extension modules
+
+    stamp = file_stamp(filename)
+
+    key = (module_name, filename)
+    memo = _parsed.get(key)
+    if memo is not None and memo[0] == stamp:
+        return memo[1]
+
+    try:
+        static_module = StaticModule(module_name, filename, is_package)
+    except (SyntaxError, IOError), e:
+        log.info("Module %s cannot be parsed: %s" % (module_name, e))
+        static_module = None
+
+    _parsed[key] = (stamp, static_module)
+    return static_module
+
+
+def get_static_module_members(module_name, use_all=True):
+    """Return module members, by parsing the module source.
+
+    :param module_name: Full name of the module.
+    :param use_all: Use `__all__` of module, if true.
+    :returns: Tuple of module name, and members in same form as
+        :func:`~sphinkydocext.utils.get_module_members` returns.
+    :raises ImportError: If the module source is not found, or cannot be
+        parsed.
+
+    """
+    static_module = parse_module(module_name)
+    if static_module is None:
+        raise ImportError("Unable to parse %s " % module_name)
+
+    has_all = use_all and static_module.all is not None
+    if has_all:
+        public = set(static_module.all)
+        custom_all = lambda n: n in public
+    else:
+        if use_all:
+            log.info("Module %s is missing __all__, falling back to "
+                     "public members" % module_name)
+        custom_all = lambda n: not n.startswith("_")
+
+    all_submodules = []
+    if static_module.is_package:
+        package_dir = os.path.dirname(static_module.filename)
+        for _imp, modname, _isp in iter_modules([package_dir]):
+            if custom_all(modname):
+                all_submodules.append(modname)
+
+    all_classes = []
+    all_exceptions = []
+    all_functions = []
+    all_datas = []
+    all_members = []
+
+    names = set(static_module.definitions)
+    names.update(static_module.imports)
+    implicit = set(MODULE_ATTRIBUTES)
+    if static_module.is_package:
+        implicit.add('__path__')
+    implicit.difference_update(names)
+    names.update(implicit)
+
+    kind_lists = {
+        'class' : all_classes,
+        'exception' : all_exceptions,
+        'function' : all_functions,
+        'data' : all_datas,
+    }
+
+    exported = {}
+    for name in sorted(names):
+        if name in implicit:
+            kind, origin = 'data', None
+        else:
+            kind = static_module.kind(name)
+            origin = static_module.origin(name)
+
+        # Filter out the members that are not defined in this module, except
+        # those that are listed in __all__ if any.
+        if origin is not None:
+            if not (has_all and custom_all(name)) and origin != module_name:
+                continue
+            if origin != module_name:
+                exported[name] = origin
+
+        if kind not in kind_lists:
+            continue # Modules are not added as members either!
+
+        kind_lists[kind].append(name)
+        all_members.append(name)
+
+    classes = [x for x in all_classes if custom_all(x)]
+    exceptions = [x for x in all_exceptions if custom_all(x)]
+    functions = [x for x in all_functions if custom_all(x)]
+    datas = [x for x in all_datas if custom_all(x)]
+    members = [x for x in all_members if custom_all(x)]
+    exported_from = sorted(set(exported[x] for x in members if x in exported))
+
+    return module_name, \
+           {'all_modules': all_submodules, 'modules' : all_submodules,
+            'all_exceptions' : all_exceptions, 'exceptions' : exceptions,
+            'all_classes' : all_classes, 'classes' : classes,
+            'all_functions' : all_functions, 'functions' : functions,
+            'all_datas' : all_datas, 'datas' : datas,
+            'all_members' : all_members, 'members' : members,
+            'exported_from' : exported_from}
+
+
+# Optparse --------------------------------
+
+OPTPARSE_APPLIED = frozenset(['add_option', 'add_options', 'add_option_group',
+                              'remove_option', 'set_usage', 'set_description',
+                              'set_defaults', 'set_default'])
+"""Methods of parser and group, which are applied when called with literal
+arguments in module level."""
+
+OPTPARSE_READONLY = frozenset(['parse_args', 'print_help', 'print_usage',
+                               'print_version', 'error', 'exit', 'format_help',
+                               'format_option_help', 'get_usage', 'get_version',
+                               'get_prog_name', 'get_description',
+                               'get_default_values', 'has_option',
+                               'get_option', 'check_values',
+                               'enable_interspersed_args',
+                               'disable_interspersed_args'])
+"""Methods of parser and group, which do not change the documented options and
+can be called anywhere."""
+
+OPTPARSE_PLACEHOLDERS = {
+    'default' : None,
+    'const' : None,
+    'choices' : (),
+    'callback' : lambda *args, **kwargs: None,
+    'callback_args' : None,
+    'callback_kwargs' : None,
+    'version' : "%prog",
+    'defaults' : None,
+}
+"""Values of keyword arguments that are not literal, but do not affect the
+documentation either."""
+
+OPTPARSE_TYPES = {'int' : 'int', 'long' : 'long', 'float' : 'float',
+                  'complex' : 'complex', 'str' : 'string'}
+"""Builtin types given as ``type`` of option, and their optparse names."""
+
+
+class _Unresolved(Exception):
+    """Parser cannot be resolved statically."""
+
+
+class _OptparseResolver(object):
+    """Resolves module level parser of script by applying the literal calls
+    to real :obj:`optparse.OptionParser`."""
+
+    def __init__(self, tree):
+        self.modules = set()
+        """Names of :mod:`optparse` module in the script."""
+
+        self.imported = {}
+        """Names imported from :mod:`optparse`, mapped to the objects."""
+
+        self.constants = {'__doc__' : ast.get_docstring(tree, clean=False),
+                          'True' : True, 'False' : False, 'None' : None}
+        """Module level names with literal values."""
+
+        self.tracked = {}
+        """Names of the parser and groups, mapped to the objects."""
+
+        self.parser = None
+
+        self.others = []
+        """Other module level statements."""
+
+        for node in tree.body:
+            self._statement(node)
+
+        # E.g. functions defined before the parser may still use it
+        for node in self.others:
+            self._check_uses(node)
+
+    def _statement(self, node):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name == "optparse":
+                    self.modules.add(alias.asname or alias.name)
+            return
+
+        if isinstance(node, ast.ImportFrom):
+            if node.module == "optparse" and not node.level:
+                for alias in node.names:
+                    if alias.name == "*":
+                        names = optparse.__all__
+                    else:
+                        names = [alias.name]
+                    for name in names:
+                        self.imported[alias.asname or name] = \
+                            getattr(optparse, name, None)
+            return
+
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and \
+            isinstance(node.targets[0], ast.Name) and \
+            node.targets[0].id not in self.tracked:
+            name = node.targets[0].id
+            if isinstance(node.value, ast.Call) and self._creates(node.value):
+                self._assign(name, node.value)
+                return
+            if not self._uses(node.value):
+                try:
+                    self.constants[name] = self._evaluate(node.value)
+                except _Unresolved:
+                    self.constants.pop(name, None)
+                return
+
+        if isinstance(node, ast.Expr) and isinstance(node.value, ast.Call) and \
+            self._applied(node.value):
+            self._apply(node.value)
+            return
+
+        self.others.append(node)
+
+    def _creates(self, call):
+        """Does the call create or return parser, group or option?"""
+        if self._applied(call):
+            return True
+        try:
+            return self._reference(call.func) in (optparse.OptionParser,
+                                                  optparse.OptionGroup)
+        except _Unresolved:
+            return False
+
+    def _assign(self, name, call):
+        if self._applied(call):
+            result = self._apply(call)
+        else:
+            cls = self._reference(call.func)
+            if cls is optparse.OptionParser and self.parser is not None:
+                raise _Unresolved("Script has several parsers")
+
+            args, kwargs = self._arguments(call)
+            try:
+                result = cls(*args, **kwargs)
+            except (optparse.OptParseError, TypeError, ValueError), e:
+                raise _Unresolved(e)
+
+            if cls is optparse.OptionParser:
+                self.parser = result
+
+        if isinstance(result, (optparse.OptionParser, optparse.OptionGroup)):
+            self.tracked[name] = result
+
+    def _applied(self, call):
+        """Is the call applied method of parser or group?"""
+        func = call.func
+        return isinstance(func, ast.Attribute) and \
+            isinstance(func.value, ast.Name) and \
+            func.value.id in self.tracked and func.attr in OPTPARSE_APPLIED
+
+    def _apply(self, call):
+        method = getattr(self.tracked[call.func.value.id], call.func.attr)
+        args, kwargs = self._arguments(call)
+        try:
+            return method(*args, **kwargs)
+        except (optparse.OptParseError, TypeError, ValueError), e:
+            raise _Unresolved(e)
+
+    def _arguments(self, call):
+        if call.starargs or call.kwargs:
+            raise _Unresolved("Variable arguments")
+
+        args = [self._evaluate(arg) for arg in call.args]
+        kwargs = {}
+        for keyword in call.keywords:
+            try:
+                kwargs[keyword.arg] = self._evaluate(keyword.value)
+            except _Unresolved:
+                value = keyword.value
+                if keyword.arg == 'type' and isinstance(value, ast.Name) and \
+                    value.id in OPTPARSE_TYPES:
+                    kwargs['type'] = OPTPARSE_TYPES[value.id]
+                elif keyword.arg in OPTPARSE_PLACEHOLDERS:
+                    kwargs[keyword.arg] = OPTPARSE_PLACEHOLDERS[keyword.arg]
+                else:
+                    raise
+        return args, kwargs
+
+    def _reference(self, node):
+        """Object of :mod:`optparse` the node refers to."""
+        if isinstance(node, ast.Name) and node.id in self.imported:
+            return self.imported[node.id]
+        if isinstance(node, ast.Attribute) and \
+            isinstance(node.value, ast.Name) and node.value.id in self.modules:
+            return getattr(optparse, node.attr, None)
+        raise _Unresolved("Not optparse reference")
+
+    def _evaluate(self, node):
+        """Value of literal expression."""
+        if isinstance(node, (ast.Str, ast.Num)):
+            return ast.literal_eval(node)
+        if isinstance(node, ast.Name):
+            if node.id in self.tracked:
+                return self.tracked[node.id]
+            if node.id in self.constants:
+                return self.constants[node.id]
+            return self._reference(node)
+        if isinstance(node, ast.Attribute):
+            return self._reference(node)
+        if isinstance(node, ast.Tuple):
+            return tuple(self._evaluate(elt) for elt in node.elts)
+        if isinstance(node, ast.List):
+            return [self._evaluate(elt) for elt in node.elts]
+        if isinstance(node, ast.Dict):
+            return dict(zip([self._evaluate(k) for k in node.keys],
+                            [self._evaluate(v) for v in node.values]))
+        if isinstance(node, ast.BinOp) and \
+            isinstance(node.op, (ast.Add, ast.Mod)):
+            left = self._evaluate(node.left)
+            right = self._evaluate(node.right)
+            try:
+                if isinstance(node.op, ast.Add):
+                    return left + right
+                return left % right
+            except (TypeError, ValueError), e:
+                raise _Unresolved(e)
+        if isinstance(node, ast.Call) and \
+            self._reference(node.func) in (optparse.make_option,
+                                           optparse.Option):
+            args, kwargs = self._arguments(node)
+            try:
+                return optparse.make_option(*args, **kwargs)
+            except (optparse.OptParseError, TypeError, ValueError), e:
+                raise _Unresolved(e)
+        raise _Unresolved("Not literal")
+
+    def _uses(self, node):
+        """Does the expression refer to parser or groups?"""
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and child.id in self.tracked:
+                return True
+        return False
+
+    def _check_uses(self, node):
+        """Raises :exc:`_Unresolved` if parser or groups are used other than
+        through :data:`OPTPARSE_READONLY` methods, e.g. conditionally or by
+        passing them to functions."""
+        readonly = set()
+        for child in ast.walk(node):
+            if isinstance(child, ast.Call) and \
+                isinstance(child.func, ast.Attribute) and \
+                isinstance(child.func.value, ast.Name) and \
+                child.func.attr in OPTPARSE_READONLY:
+                readonly.add(id(child.func.value))
+
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and child.id in self.tracked and \
+                id(child) not in readonly:
+                raise _Unresolved("Unknown use of %s at line %s" %
+                                  (child.id, getattr(child, 'lineno', '?')))
+
+
+def get_static_optparser(script_path):
+    """Gets module level :obj:`~optparse.OptionParser` of script, without
+    executing the script.
+
+    The parser is resolved by applying the module level ``OptionParser``,
+    ``OptionGroup``, ``add_option`` etc. calls of the script to real parser,
+    if their arguments are literals, or module level names with literal
+    values. The parser cannot be resolved if the script has several parsers,
+    or uses them in other ways, e.g. conditionally or by passing them to
+    functions.
+
+    :param script_path: Path to the Python script.
+    :returns: :obj:`optparse.OptionParser`, or :const:`None` if the script has
+        no parser or it cannot be resolved.
+
+    """
+    try:
+        f = open(script_path, 'rU')
+        try:
+            source = f.read()
+        finally:
+            f.close()
+        resolver = _OptparseResolver(ast.parse(source, script_path))
+    except (SyntaxError, IOError, _Unresolved), e:
+        log.info("Optparser of script %s cannot be resolved statically: %s" %
+                 (script_path, e))
+        return None
+
+    return resolver.parser
@@ -3,6 +3,8 @@ from sphinkydocext import log
 
 def indent(num, text):
     """Indents the string by given number."""
+    if not isinstance(text, basestring):
+        text = unicode(text)
     s = text.split('\n')
     s = [(num * ' ') + line for line in s]
     s = "\n".join(s)
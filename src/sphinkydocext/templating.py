@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 """Sphinkydoc extension templating"""
-from jinja2 import FileSystemLoader
+from jinja2 import FileSystemLoader, FileSystemBytecodeCache
 from jinja2.sandbox import SandboxedEnvironment
+from sphinkydocext.manifest import write_chunks_if_changed
+import jinja2
 import os
 
 # Pylint-disable settings ----------------
@@ -10,34 +12,75 @@ import os
 
 # TODO: DEPENDENCY: Python 2.5 - iter_modules
 
-def _caps(tenv, filepath, template_file, context=None):
-    """Turns file to reStructuredText literal file."""
+class CapsFile(object):
+    """Contents of caps file in templates, read lazily.
+    
+    Iterating gives the lines of the file, so that templates can stream large
+    files, and converting to string gives the whole contents.
+    
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+    
+    def __iter__(self):
+        f = open(self.filepath, 'rb')
+        try:
+            for line in f:
+                yield line.decode('utf-8', 'replace')
+        finally:
+            f.close()
+    
+    def __unicode__(self):
+        return u"".join(self)
+    
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+
+def _caps(tenv, filepath, template_file, context=None, output=None, 
+          manifest=None, overwrite=False):
+    """Turns file to reStructuredText literal file.
+    
+    The caps file is read once, and the rendition is streamed to the output,
+    which is written only if its content changes.
+    
+    :param output: Output path, defaults to ``filepath`` which is overwritten.
+    :param manifest: Manifest of generated files, or :const:`None`.
+    :param overwrite: Passed to the manifest, overwrite the output even if it is
+        not generated by Sphinkydoc.
+    :returns: :const:`True` if the output was written.
+    
+    """
     context = context or {}
     caps_name = os.path.basename(os.path.splitext(filepath)[0])
     
     context.update({
         'caps_name' : caps_name, 
-        'caps' :  open(filepath, 'r').read(),
+        'caps' : CapsFile(filepath),
     })
     
     t = tenv.get_template(template_file)
-    tc = t.render(context)
+    chunks = t.generate(context)
     
-    f = open(filepath, 'w+')
-    f.write(tc)
-    f.close()
+    output = output or filepath
+    if manifest is not None:
+        return manifest.write_chunks(output, chunks, overwrite=overwrite)
+    
+    return write_chunks_if_changed(output, chunks)[0]
 
         
-def caps(tenv, filepath):
+def caps(tenv, filepath, **kwargs):
     """Preprocesses caps files by "sphinkydoc/caps.rst" jinja2 template.
     
     :path filepath: Path to the caps file.
     
+    Rest of the keyword arguments are as in :func:`_caps`.
+    
     """
-    _caps(tenv, filepath, "sphinkydoc/caps.rst")
+    return _caps(tenv, filepath, "sphinkydoc/caps.rst", **kwargs)
 
 
-def caps_literal(tenv, filepath, header=None):
+def caps_literal(tenv, filepath, header=None, **kwargs):
     """Preprocesses caps files by "sphinkydoc/caps_literal.rst" jinja2 
     template.
     
@@ -48,12 +91,30 @@ def caps_literal(tenv, filepath, header=None):
     :param header: Header for the created reStructuredText file, defaults to
         filename without extension.
     
+    Rest of the keyword arguments are as in :func:`_caps`.
+    
     """
     
     if header is None:
         header = os.path.basename(os.path.splitext(filepath)[0])
     
-    _caps(tenv, filepath, "sphinkydoc/caps_literal.rst", {'header' : header})
+    return _caps(tenv, filepath, "sphinkydoc/caps_literal.rst", 
+                 {'header' : header}, **kwargs)
+
+def file_template(tenv, filepath):
+    """Loads template from file outside of the template directories.
+    
+    Unlike :meth:`~jinja2.Environment.from_string`, this uses the bytecode
+    cache of the environment.
+    
+    :param tenv: Templating environment.
+    :param filepath: Path to the template file.
+    :returns: :obj:`jinja2.Template`
+    
+    """
+    loader = FileSystemLoader(os.path.dirname(os.path.abspath(filepath)))
+    return loader.load(tenv, os.path.basename(filepath))
+
 
 class TemplatePython(object):
     """Jinja2 Template python additions.
@@ -109,23 +170,108 @@ class TemplatePython(object):
             self._pythons.append((file_, __template))
 
 
-def templating_environment(template_dirs=None):
+TEMPLATES_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), 
+                                             'templates'))
+"""Directory of the templates provided by Sphinkydoc."""
+
+_environments = {}
+
+
+def templating_environment(template_dirs=None, bytecode_cache_dir=None):
     """Jinja2 templating environment.
     
+    Environments are shared process-wide, one per list of template 
+    directories. Changed templates are reloaded by Jinja2, and the environment
+    is recreated if any of the ``__template.py`` files has changed. 
+    
+    :param template_dirs: Additional template directories.
+    :param bytecode_cache_dir: Directory of persistent bytecode cache of the 
+        compiled templates, defaults to :const:`None` and templates are
+        compiled in each process. Cached templates are recompiled when their
+        source changes, and the cache is kept separately for each Jinja2
+        version.
     :returns: :obj:`jinja2.environment.Environment`, which is monkey patched to
-        include :class:`TemplatePython` object in variable ``__tp``.
+        include :class:`TemplatePython` object in variable ``__tp``, and the
+        given ``template_dirs`` and ``bytecode_cache_dir`` in variables of 
+        same name.
     
     """
     
-    template_dirs_ = [os.path.realpath(
-                        os.path.join(os.path.dirname(__file__), 'templates')
-                     )]
+    template_dirs_ = [TEMPLATES_DIR]
     
     if template_dirs is not None:
         template_dirs_.extend(template_dirs)
-        
+    
+    key = (tuple(template_dirs_), bytecode_cache_dir)
+    stamp = _template_pythons_stamp(template_dirs_)
+    
+    cached = _environments.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    
+    tenv = _create_environment(template_dirs_, bytecode_cache_dir)
+    tenv.template_dirs = template_dirs
+    tenv.bytecode_cache_dir = bytecode_cache_dir
+    _environments[key] = (stamp, tenv)
+    return tenv
+
+
+def template_stamp(tenv):
+    """Modification times and sizes of the files in template directories of
+    the environment.
+    
+    :param tenv: Environment returned by :func:`templating_environment`.
+    :returns: Sorted list of tuples of path, modification time and size.
+    
+    """
+    stamp = []
+    for tdir in [TEMPLATES_DIR] + list(getattr(tenv, 'template_dirs', None) 
+                                       or []):
+        for dirpath, _dirnames, filenames in os.walk(tdir):
+            for filename in filenames:
+                if filename.endswith(('.pyc', '.pyo')):
+                    continue
+                filepath = os.path.join(dirpath, filename)
+                st = os.stat(filepath)
+                stamp.append((filepath, st.st_mtime, st.st_size))
+    return sorted(stamp)
+
+
+def invalidate_templating_environments():
+    """Removes all shared templating environments, next call to 
+    :func:`templating_environment` creates a new environment.
+    
+    """
+    _environments.clear()
+
+
+def _template_pythons_stamp(template_dirs):
+    """Modification times of ``__template.py`` files in template dirs."""
+    stamp = []
+    for tdir in template_dirs:
+        try:
+            stamp.append(os.stat(os.path.join(tdir, "__template.py")).st_mtime)
+        except os.error:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def _create_environment(template_dirs_, bytecode_cache_dir=None):
+    """Creates new templating environment, see 
+    :func:`templating_environment`.
+    
+    """
+    bytecode_cache = None
+    if bytecode_cache_dir:
+        directory = os.path.join(bytecode_cache_dir, 
+                                 "jinja2-%s" % jinja2.__version__)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        bytecode_cache = FileSystemBytecodeCache(directory)
+    
     template_loader = FileSystemLoader(template_dirs_)
-    tenv = SandboxedEnvironment(loader=template_loader)
+    tenv = SandboxedEnvironment(loader=template_loader, 
+                                bytecode_cache=bytecode_cache)
     
     tenv.__tp = TemplatePython(tenv) 
     
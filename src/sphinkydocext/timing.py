@@ -0,0 +1,322 @@
+"""Timing spans of documentation generation.
+
+Spans are started and stopped around the stages of the generation, and
+around the work of each module and script: import, introspection, render and
+write. Spans nest, a span started while another one is running in the same
+thread is its child.
+
+Timing is active while :func:`activate` has set the current
+:class:`Timings`, otherwise :func:`start` and :func:`stop` do nothing. The
+extension activates timing for each build, and reports the finished stages
+to Sphinx event ``sphinkydoc-span``, see :confval:`sphinkydoc_profile`.
+
+"""
+from sphinkydocext import log
+from timeit import default_timer
+import csv
+import json
+import threading
+
+SLOWEST_COUNT = 20
+"""Number of the slowest modules and scripts in the report."""
+
+
+class Span(object):
+    """Timed span of work."""
+
+    def __init__(self, name, target=None, parent=None):
+        """Create span, it is started immediately.
+
+        :param name: Name of the work, e.g. ``"render"``.
+        :param target: Module name or script path the work is done for, or
+            :const:`None`.
+        :param parent: Parent span, or :const:`None`.
+
+        """
+        self.name = name
+        self.target = target
+        self.parent = parent
+        self.children = []
+        self.start = default_timer()
+        self.end = None
+
+    @property
+    def seconds(self):
+        """Duration of the span, so far if it is still running."""
+        end = self.end if self.end is not None else default_timer()
+        return end - self.start
+
+    @property
+    def depth(self):
+        """Number of the ancestors."""
+        depth = 0
+        parent = self.parent
+        while parent is not None:
+            depth += 1
+            parent = parent.parent
+        return depth
+
+    def walk(self):
+        """Iterates this span and all of its descendants, depth first."""
+        yield self
+        for child in self.children:
+            for span in child.walk():
+                yield span
+
+    def to_dict(self, origin=0):
+        """Plain data description of the span and its descendants.
+
+        :param origin: Time the start offsets are relative to.
+
+        """
+        return {'name' : self.name, 'target' : self.target,
+                'start' : self.start - origin, 'seconds' : self.seconds,
+                'children' : [c.to_dict(origin) for c in self.children]}
+
+
+class Timings(object):
+    """Spans of one build."""
+
+    def __init__(self):
+        self.origin = default_timer()
+        self.roots = []
+        self.listeners = []
+        """Callables called with each finished root span."""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self):
+        """Innermost running span of this thread, or :const:`None`."""
+        stack = self._stack()
+        return stack and stack[-1] or None
+
+    def start(self, name, target=None, parent=None):
+        """Starts a span.
+
+        :param name: Name of the work.
+        :param target: Module name or script path, or :const:`None`.
+        :param parent: Parent span, defaults to the current span of this
+            thread. Threads doing work for a span of another thread give it
+            explicitly.
+        :returns: :class:`Span`
+
+        """
+        stack = self._stack()
+        if parent is None and stack:
+            parent = stack[-1]
+
+        span = Span(name, target, parent)
+        self._lock.acquire()
+        try:
+            if parent is None:
+                self.roots.append(span)
+            else:
+                parent.children.append(span)
+        finally:
+            self._lock.release()
+
+        stack.append(span)
+        return span
+
+    def stop(self, span):
+        """Stops the span, and the spans left running inside it."""
+        span.end = default_timer()
+
+        stack = self._stack()
+        while span in stack:
+            top = stack.pop()
+            if top.end is None:
+                top.end = span.end
+
+        if span.parent is None:
+            for listener in self.listeners:
+                listener(span)
+
+    def add(self, data, parent=None):
+        """Adds finished span recorded elsewhere, e.g. in worker process.
+
+        The span is placed to end now, as the clocks of the processes are not
+        comparable.
+
+        :param data: Span as plain data, see :meth:`Span.to_dict`, with the
+            start offsets relative to the start of the span.
+        :param parent: Parent span, defaults to the current span of this
+            thread.
+        :returns: :class:`Span`
+
+        """
+        if parent is None:
+            parent = self.current()
+
+        def build(data, parent, base):
+            span = Span(data['name'], data['target'], parent)
+            span.start = base + data['start']
+            span.end = span.start + data['seconds']
+            span.children = [build(c, span, base) for c in data['children']]
+            return span
+
+        span = build(data, parent, default_timer() - data['seconds'])
+        self._lock.acquire()
+        try:
+            if parent is None:
+                self.roots.append(span)
+            else:
+                parent.children.append(span)
+        finally:
+            self._lock.release()
+        return span
+
+    def spans(self):
+        """Iterates all spans, depth first."""
+        for root in list(self.roots):
+            for span in root.walk():
+                yield span
+
+    def slowest(self, name, count=SLOWEST_COUNT):
+        """Targets taking the most time in spans of the given name.
+
+        :param name: Name of the spans, e.g. ``"module"`` or ``"script"``.
+        :param count: Maximum number of targets.
+        :returns: List of tuples of target and total seconds, the slowest
+            first.
+
+        """
+        totals = {}
+        for span in self.spans():
+            if span.name != name or span.target is None or \
+                self._nested(span):
+                continue
+            totals[span.target] = totals.get(span.target, 0) + span.seconds
+        return sorted(totals.iteritems(), key=lambda t: -t[1])[:count]
+
+    def _nested(self, span):
+        """Is the span inside another span of the same name and target?"""
+        parent = span.parent
+        while parent is not None:
+            if parent.name == span.name and parent.target == span.target:
+                return True
+            parent = parent.parent
+        return False
+
+    def report(self):
+        """Plain data report of the spans, and the slowest modules and
+        scripts."""
+        slowest = lambda name: [{'target' : t, 'seconds' : s}
+                                for t, s in self.slowest(name)]
+        return {'spans' : [r.to_dict(self.origin) for r in self.roots],
+                'slowest_modules' : slowest('module'),
+                'slowest_scripts' : slowest('script')}
+
+    def write(self, filename):
+        """Writes the report as CSV if the filename ends with ``.csv``,
+        otherwise as JSON."""
+        if filename.lower().endswith('.csv'):
+            self.write_csv(filename)
+        else:
+            self.write_json(filename)
+        log.info("Timing report written to %s." % filename)
+
+    def write_json(self, filename):
+        """Writes the report, see :meth:`report`, as JSON."""
+        f = open(filename, 'w+')
+        try:
+            json.dump(self.report(), f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+    def write_csv(self, filename):
+        """Writes a row for each span, and then for the slowest modules and
+        scripts."""
+        f = open(filename, 'wb')
+        try:
+            writer = csv.writer(f)
+            writer.writerow(['kind', 'name', 'target', 'depth', 'start',
+                             'seconds'])
+            for span in self.spans():
+                writer.writerow(['span', span.name, span.target or "",
+                                 span.depth, "%.6f" % (span.start - self.origin),
+                                 "%.6f" % span.seconds])
+            for name in ('module', 'script'):
+                for target, seconds in self.slowest(name):
+                    writer.writerow(['slowest', name, target, "", "",
+                                     "%.6f" % seconds])
+        finally:
+            f.close()
+
+
+_active = None
+
+
+def activate(timings=None):
+    """Sets the current timings, a new :class:`Timings` by default.
+
+    :returns: The current :class:`Timings`.
+
+    """
+    global _active
+    _active = timings or Timings()
+    return _active
+
+
+def deactivate():
+    """Stops timing, spans are no longer recorded."""
+    global _active
+    _active = None
+
+
+def active():
+    """Current :class:`Timings`, or :const:`None` if timing is not active."""
+    return _active
+
+
+def start(name, target=None, parent=None):
+    """Starts a span in the current timings, see :meth:`Timings.start`.
+
+    :returns: :class:`Span`, or :const:`None` if timing is not active.
+
+    """
+    if _active is None:
+        return None
+    return _active.start(name, target, parent)
+
+
+def stop(span):
+    """Stops the span started by :func:`start`."""
+    if span is not None and _active is not None:
+        _active.stop(span)
+
+
+def add(data, parent=None):
+    """Adds finished span to the current timings, see :meth:`Timings.add`."""
+    if _active is None:
+        return None
+    return _active.add(data, parent)
+
+
+def timed(name, target, func, *args, **kwargs):
+    """Calls the function inside a span.
+
+    :param name: Name of the span.
+    :param target: Target of the span, or :const:`None`.
+    :param func: Function called with the rest of the arguments.
+    :returns: Return value of the function.
+
+    """
+    span = start(name, target)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        stop(span)
+
+
+def current():
+    """Innermost running span of this thread, or :const:`None`."""
+    if _active is None:
+        return None
+    return _active.current()
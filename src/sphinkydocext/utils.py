@@ -1,14 +1,26 @@
 """Utils for sphinkydoc"""
 from distutils.dir_util import mkpath
 from pkgutil import iter_modules
+import imp
 import optparse
 import inspect
 import logging
 import posixpath
 import os
 import re
+import stat
 import sys
 from sphinkydocext import log
+from sphinkydocext.manifest import SyncManifest
+
+STAGINGS = ('copy', 'hardlink', 'symlink', 'kernel')
+"""How files are staged to the Sphinx source directory, see 
+:func:`stage_file`."""
+
+FICLONE = 0x40049409
+"""Linux ioctl cloning the file contents, i.e. reflink."""
+
+_PATTERN_TYPE = type(re.compile(''))
 
 
 def truncate_path(path, directory=None, extension=None):
@@ -67,21 +79,62 @@ def multi_matcher(patterns):
     If pattern contains a string, it is treated as direct comparsion with 
     equivalence. In case the pattern has match function, it is used to matching.
     
+    The patterns are compiled once: strings are looked up from a set, and the
+    regular expressions are combined to single alternation per flags, so the 
+    cost of matching does not grow with the number of patterns. Regular 
+    expressions with groups or verbose flag, and other matcher objects, are 
+    matched one by one.
+    
     :param patterns: Sequence of either string or matcher objects.
     
     """
+    exact = set()
+    combined = {}
+    matchers = []
+    for pat in patterns:
+        if not hasattr(pat, 'match'):
+            exact.add(pat)
+        elif isinstance(pat, _PATTERN_TYPE) and not pat.groups and \
+            not pat.flags & re.VERBOSE:
+            combined.setdefault(pat.flags, []).append(pat.pattern)
+        else:
+            matchers.append(pat.match)
+    
+    for flags, pats in combined.iteritems():
+        regex = "|".join("(?:%s)" % p for p in pats)
+        matchers.insert(0, re.compile(regex, flags).match)
+    
     def matcher(item):
-        for pat in patterns:
-            if hasattr(pat, 'match'):
-                if pat.match(item):
-                    return True
-            else:
-                if pat == item:
-                    return True
+        if item in exact:
+            return True
+        for match in matchers:
+            if match(item):
+                return True
         return False
     return matcher
 
 
+def categorize(items, category_matchers, category_order):
+    """Categorizes the items, each to the first matching category.
+    
+    :param items: Sequence of items, e.g. document names.
+    :param category_matchers: Dictionary of category names and matchers, see
+        :func:`multi_matcher`.
+    :param category_order: Sequence of category names in order of precedence.
+    :returns: Dictionary of category names and lists of the items, in the 
+        order of the given items. Categories without items are left out.
+    
+    """
+    matchers = [(cat, category_matchers[cat]) for cat in category_order]
+    categorized = {}
+    for item in items:
+        for cat, matcher in matchers:
+            if matcher(item):
+                categorized.setdefault(cat, []).append(item)
+                break
+    return categorized
+
+
 def path_to_posix(filepath):
     """Converts path to posix path."""
     return filepath.replace("\\", "/")
@@ -101,7 +154,8 @@ def quote_split(text):
 
 
 def copy_tree(src, dst, preserve_mode=1, preserve_times=1, preserve_symlinks=0, 
-    update=0, verbose=0, skip_dirs=None, log=None, dry_run=0):
+    update=0, verbose=0, skip_dirs=None, log=None, dry_run=0, manifest=None, 
+    use_hash=False, staging='copy', skip_files=None):
     """Copy an entire directory tree 'src' to a new location 'dst'.
     
     Modified copy_tree, taken from distutils.dir_util.
@@ -124,14 +178,22 @@ def copy_tree(src, dst, preserve_mode=1, preserve_times=1, preserve_symlinks=0,
     
     'update' and 'verbose' are the same as for 'copy_file'.
     
-    """
-    from distutils.file_util import copy_file
+    If 'manifest' :class:`~sphinkydocext.manifest.SyncManifest` is given, 
+    files that are unchanged since the recorded copy are not copied again, see
+    :func:`sync_tree`. 'use_hash' compares also content hashes of the files.
     
+    Files are copied using :func:`stage_file` with 'staging' strategy.
+    
+    'skip_files' are absolute paths of the files under 'src' that are not
+    copied, e.g. written there by the build.
+    
+    """
     if log is None:
         #logging.basicConfig()
         log = logging.getLogger("sphinkydoc")
     
     skip_dirs = skip_dirs or []
+    skip_files = skip_files or []
     
     if not dry_run and not os.path.isdir(src):
         log.error("cannot copy tree '%s': not a directory", src)
@@ -165,15 +227,208 @@ def copy_tree(src, dst, preserve_mode=1, preserve_times=1, preserve_symlinks=0,
             outputs.extend(
                 copy_tree(src_name, dst_name, preserve_mode, 
                     preserve_times, preserve_symlinks, update, 
-                    dry_run=dry_run))
+                    dry_run=dry_run, manifest=manifest, use_hash=use_hash,
+                    staging=staging, skip_files=skip_files))
+        elif os.path.abspath(src_name) in skip_files:
+            continue
+        elif manifest is not None:
+            st = os.stat(src_name)
+            src_stamp = (st.st_mtime, st.st_size)
+            if not manifest.unchanged(src_name, dst_name, src_stamp, use_hash):
+                stage_file(src_name, dst_name, staging, preserve_mode, 
+                    preserve_times, update, dry_run=dry_run)
+            if not dry_run:
+                manifest.record(src_name, dst_name, src_stamp, use_hash)
+            outputs.append(dst_name)
         else:
-            copy_file(src_name, dst_name, preserve_mode, 
+            stage_file(src_name, dst_name, staging, preserve_mode, 
                 preserve_times, update, dry_run=dry_run)
             outputs.append(dst_name)
     
     return outputs
 
 
+def stage_file(src, dst, staging='copy', preserve_mode=1, preserve_times=1, 
+               update=0, dry_run=0, writable=False):
+    """Stages file 'src' to 'dst' using the given strategy.
+    
+    Strategies are:
+    
+    ``copy``
+        Copies the contents using :func:`distutils.file_util.copy_file`.
+    ``hardlink``
+        Hard links 'dst' to 'src', nothing is copied.
+    ``symlink``
+        Symbolic link 'dst' pointing to 'src'.
+    ``kernel``
+        Clones the file with :data:`FICLONE` (reflink) on filesystems 
+        supporting it, else copies as ``copy``.
+    
+    If the strategy is not possible, e.g. hard links across filesystems, the 
+    next one is tried: links fall back to ``kernel``, and ``kernel`` falls 
+    back to ``copy``.
+    
+    Existing links at 'dst' are removed before copying, so that the contents
+    are never written through the link to 'src'.
+    
+    :param src: Source file.
+    :param dst: Destination file.
+    :param staging: Strategy, see :data:`STAGINGS`.
+    :param preserve_mode: Copy the permission bits.
+    :param preserve_times: Copy the access and modification times.
+    :param update: Stage only if 'dst' does not exist or is older than 'src'.
+    :param dry_run: Dry run only, nothing is staged.
+    :param writable: The staged file is modified afterwards, so it is never 
+        linked to 'src'.
+    :returns: The strategy actually used, or :const:`None` if nothing was 
+        staged.
+    :raises ValueError: If the strategy is unknown.
+    
+    """
+    from distutils.file_util import copy_file
+    from distutils.dep_util import newer
+    
+    if staging not in STAGINGS:
+        raise ValueError("Unknown staging '%s'" % staging)
+    
+    if writable and staging in ('hardlink', 'symlink'):
+        staging = 'kernel'
+    
+    if dry_run or (update and not newer(src, dst)):
+        return None
+    
+    if _linked(src, dst, staging):
+        return staging
+    
+    if os.path.lexists(dst) and (os.path.islink(dst) or 
+                                 os.lstat(dst).st_nlink > 1):
+        os.remove(dst)
+    
+    if staging == 'hardlink':
+        if _link(getattr(os, 'link', None), src, dst):
+            return staging
+        staging = 'kernel'
+    elif staging == 'symlink':
+        if _link(getattr(os, 'symlink', None), os.path.abspath(src),
+                 dst):
+            return staging
+        staging = 'kernel'
+    
+    if staging == 'kernel':
+        if _kernel_copy(src, dst):
+            st = os.stat(src)
+            if preserve_times:
+                os.utime(dst, (st.st_atime, st.st_mtime))
+            if preserve_mode:
+                os.chmod(dst, stat.S_IMODE(st.st_mode))
+            return staging
+        log.debug("Kernel copy of %s is not supported, copying.", src)
+    
+    copy_file(src, dst, preserve_mode, preserve_times)
+    return 'copy'
+
+
+def _linked(src, dst, staging):
+    """Is 'dst' already linked to 'src' by the given strategy?"""
+    try:
+        if staging == 'hardlink':
+            # Python 2 on Windows has no os.path.samefile
+            return hasattr(os.path, 'samefile') and \
+                not os.path.islink(dst) and os.path.samefile(src, dst)
+        if staging == 'symlink':
+            return os.path.islink(dst) and \
+                os.readlink(dst) == os.path.abspath(src)
+    except os.error:
+        pass
+    return False
+
+
+def _link(link, src, dst):
+    """Creates the link, or returns :const:`False` if it is not possible."""
+    if link is None:
+        return False
+    
+    if os.path.exists(dst):
+        os.remove(dst)
+    
+    try:
+        link(src, dst)
+    except (os.error, NotImplementedError), e:
+        log.debug("Unable to link %s to %s: %s", dst, src, e)
+        return False
+    return True
+
+
+def _kernel_copy(src, dst):
+    """Clones the contents of 'src' to 'dst' in the kernel.
+    
+    :returns: :const:`False` if not supported, 'dst' is then left in 
+        undefined state.
+    
+    """
+    fsrc = open(src, 'rb')
+    try:
+        fdst = open(dst, 'wb')
+        try:
+            size = os.fstat(fsrc.fileno()).st_size
+            return size == 0 or _clone(fsrc.fileno(), fdst.fileno())
+        finally:
+            fdst.close()
+    finally:
+        fsrc.close()
+
+
+def _clone(src_fd, dst_fd):
+    """Clones the contents of file using :data:`FICLONE`."""
+    try:
+        import fcntl
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except (ImportError, IOError, OSError):
+        return False
+    return True
+
+
+def sync_tree(src, dst, skip_dirs=None, use_hash=False, dry_run=0, 
+              staging='copy', skip_files=None):
+    """Synchronizes directory tree 'src' to 'dst' incrementally.
+    
+    Like :func:`copy_tree`, but the copied files are recorded to 
+    :class:`~sphinkydocext.manifest.SyncManifest` in 'dst'. Files unchanged 
+    since the previous synchronization are not copied, so their modification
+    times are preserved, and files that no longer exist in 'src' are removed
+    from 'dst'.
+    
+    :param src: Source directory.
+    :param dst: Destination directory.
+    :param skip_dirs: Directory names in 'src' that are not copied.
+    :param use_hash: Compare content hashes of files whose modification time
+        has changed, e.g. after checkout.
+    :param dry_run: Dry run only, nothing is copied or removed.
+    :param staging: How the files are copied, see :func:`stage_file`.
+    :param skip_files: Absolute paths of the files in 'src' that are not
+        copied.
+    :returns: List of all files under 'src', with the names changed to be 
+        under 'dst', same as :func:`copy_tree` returns.
+    
+    """
+    manifest = SyncManifest(dst)
+    outputs = copy_tree(src, dst, skip_dirs=skip_dirs, dry_run=dry_run, 
+                        manifest=manifest, use_hash=use_hash, staging=staging,
+                        skip_files=skip_files)
+    
+    if dry_run:
+        return outputs
+    
+    for filepath in manifest.vanished():
+        if os.path.isfile(filepath):
+            os.remove(filepath)
+            log.info("Removed %s, it no longer exists in %s." % 
+                     (filepath, src))
+    
+    manifest.save()
+    return outputs
+
+
 def is_python_script(script_path):
     """Determine if given script path is python script.
     
@@ -257,6 +512,9 @@ def get_module_members(module, use_all=True, custom_all=None):
     
     :param use_all: Use `__all__` of module, if true.
     :param custom_all: Overrides any all settings with own all filter function.
+    :returns: Dictionary of the lists of member names by their kind, and 
+        ``exported_from``, names of the modules defining the members exported
+        but not defined by this module.
     
     """
     
@@ -271,6 +529,7 @@ def get_module_members(module, use_all=True, custom_all=None):
     all_functions = []
     all_datas = []
     all_members = []
+    exported = {}
     
     for name in dir(module):
         obj = getattr(module, name)
@@ -281,6 +540,8 @@ def get_module_members(module, use_all=True, custom_all=None):
             if not (has_all and custom_all(module, name)) and \
                 obj.__module__ != module.__name__:
                 continue
+            if obj.__module__ not in (None, module.__name__):
+                exported[name] = obj.__module__
         
         if inspect.isclass(obj):
             if issubclass(obj, Exception):
@@ -301,13 +562,82 @@ def get_module_members(module, use_all=True, custom_all=None):
     functions = [x for x in all_functions if custom_all(module, x)]
     datas = [x for x in all_datas if custom_all(module, x)]
     members = [x for x in all_members if custom_all(module, x)]
+    exported_from = sorted(set(exported[x] for x in members if x in exported))
             
     return {'all_modules': all_submodules, 'modules' : modules,
             'all_exceptions' : all_exceptions, 'exceptions' : exceptions,
             'all_classes' : all_classes, 'classes' : classes,
             'all_functions' : all_functions, 'functions' : functions,
             'all_datas' : all_datas, 'datas' : datas,
-            'all_members' : all_members, 'members' : members,}
+            'all_members' : all_members, 'members' : members,
+            'exported_from' : exported_from}
+
+
+def file_stamp(filepath):
+    """Cheap stamp of file, list of path, modification time and size.
+    
+    Stamp is a list, so that it compares equal also after JSON round trip.
+    
+    :returns: List, or :const:`None` if the file does not exist.
+    
+    """
+    try:
+        st = os.stat(filepath)
+    except os.error:
+        return None
+    return [filepath, st.st_mtime, st.st_size]
+
+
+def package_listing(directory):
+    """Sorted names of the modules in the package directory."""
+    return sorted(name for _imp, name, _isp in iter_modules([directory]))
+
+
+def find_module_file(name):
+    """Finds the source file of module without importing it.
+    
+    Already imported modules are looked from :data:`sys.modules`, others are
+    looked up from :data:`sys.path` one package at a time.
+    
+    :param name: Full name of the module.
+    :returns: Tuple of source file path and boolean telling whether the module
+        is a package, or :const:`None` if the source file was not found.
+    
+    """
+    module = sys.modules.get(name)
+    if module is not None and getattr(module, '__file__', None):
+        filename = module.__file__
+        if filename.endswith(('.pyc', '.pyo')) and \
+            os.path.exists(filename[:-1]):
+            filename = filename[:-1]
+        return filename, hasattr(module, '__path__')
+    
+    path = None
+    is_package = False
+    filename = None
+    for part in name.split("."):
+        try:
+            file_, filename, (_suffix, _mode, type_) = \
+                imp.find_module(part, path)
+        except ImportError:
+            return None
+        
+        if file_ is not None:
+            file_.close()
+        
+        is_package = type_ == imp.PKG_DIRECTORY
+        if is_package:
+            path = [filename]
+            filename = os.path.join(filename, "__init__.py")
+        elif type_ != imp.PY_SOURCE:
+            return None
+        else:
+            path = []
+    
+    if filename is None or not os.path.isfile(filename):
+        return None
+    
+    return filename, is_package
 
 
 def import_by_name(name):
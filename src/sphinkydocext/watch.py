@@ -0,0 +1,286 @@
+"""Watching the inputs of documentation for changes.
+
+Used by the ``--watch`` mode of :ref:`sphinkydoc.py`, which keeps the process
+running and rebuilds incrementally whenever the module sources, scripts, caps
+files, additional docs or templates change.
+
+Changes are noticed with inotify if `pyinotify <http://pypi.python.org/pypi/
+pyinotify>`_ is installed, otherwise the watched files are polled.
+
+"""
+from sphinkydocext import log
+from sphinkydocext.utils import find_module_file
+import os
+import sys
+import time
+
+POLL_INTERVAL = 0.5
+"""Seconds between polling the watched files."""
+
+SETTLE_DELAY = 0.2
+"""Seconds to wait for more changes after the first one, so that e.g. saving
+several files at once causes only one rebuild."""
+
+SKIP_DIRS = ['html', '_temp', 'CVS']
+"""Directory names that are not watched, in addition to hidden directories."""
+
+IGNORED_SUFFIXES = ('.pyc', '.pyo', '~', '.swp', '.swx', '.tmp')
+"""Changed files with these suffixes are ignored, e.g. editor backups."""
+
+
+class PollingWatcher(object):
+    """Watches files and directories by polling their modification times."""
+
+    def __init__(self, roots, skip_dirs=None, interval=POLL_INTERVAL,
+                 skip_files=None):
+        """Create watcher.
+
+        :param roots: List of tuples of path, boolean and optional pattern,
+            paths to the files or directories to watch and whether the 
+            directories are watched recursively. Non-recursively watched 
+            directories are watched for files directly in them. If compiled 
+            regular expression pattern is given, only the filenames it matches
+            are watched.
+        :param skip_dirs: Directory names that are not watched, defaults to
+            :data:`SKIP_DIRS`.
+        :param interval: Seconds between polls.
+        :param skip_files: Paths of the files that are not watched, e.g.
+            written by the build.
+
+        """
+        self.roots = []
+        for root in roots:
+            path, recursive, pattern = (tuple(root) + (None,))[:3]
+            self.roots.append((os.path.abspath(path), recursive, pattern))
+        self.skip_dirs = set(SKIP_DIRS if skip_dirs is None else skip_dirs)
+        self.skip_files = set(os.path.abspath(p) for p in skip_files or [])
+        self.interval = interval
+        self._snapshot = self.snapshot()
+
+    def watched(self, path):
+        """Is the path watched?"""
+        if path.endswith(IGNORED_SUFFIXES) or path in self.skip_files:
+            return False
+
+        for root, recursive, pattern in self.roots:
+            if path == root:
+                return True
+
+            if not path.startswith(root.rstrip(os.sep) + os.sep):
+                continue
+
+            parts = os.path.relpath(path, root).split(os.sep)
+            if not recursive and len(parts) > 1:
+                continue
+            if self._skipped(parts[:-1]):
+                continue
+            if pattern is not None and not pattern.match(parts[-1]):
+                continue
+            return True
+        return False
+
+    def _skipped(self, dirnames):
+        for dirname in dirnames:
+            if dirname in self.skip_dirs or dirname.startswith('.'):
+                return True
+        return False
+
+    def snapshot(self):
+        """Modification times and sizes of the watched files.
+
+        :returns: Dictionary of file paths, and tuples of modification time
+            and size.
+
+        """
+        stamps = {}
+        for root, recursive, pattern in self.roots:
+            if os.path.isfile(root):
+                self._stamp(stamps, root)
+                continue
+
+            for dirpath, dirnames, filenames in os.walk(root):
+                if recursive:
+                    dirnames[:] = [d for d in dirnames
+                                   if not self._skipped([d])]
+                else:
+                    dirnames[:] = []
+
+                for filename in filenames:
+                    if pattern is not None and not pattern.match(filename):
+                        continue
+                    filepath = os.path.join(dirpath, filename)
+                    if not filepath.endswith(IGNORED_SUFFIXES):
+                        self._stamp(stamps, filepath)
+        return stamps
+
+    def _stamp(self, stamps, filepath):
+        if filepath in self.skip_files:
+            return
+        try:
+            st = os.stat(filepath)
+        except os.error:
+            return
+        stamps[filepath] = (st.st_mtime, st.st_size)
+
+    def poll(self):
+        """Changed, added and removed files since the previous poll.
+
+        :returns: Set of file paths.
+
+        """
+        previous = self._snapshot
+        self._snapshot = current = self.snapshot()
+
+        changed = set()
+        for filepath, stamp in current.iteritems():
+            if previous.get(filepath) != stamp:
+                changed.add(filepath)
+        changed.update(set(previous) - set(current))
+        return changed
+
+    def wait(self, timeout=None):
+        """Waits until some of the watched files change.
+
+        :param timeout: Maximum time to wait in seconds, :const:`None` waits
+            forever.
+        :returns: Sorted list of changed file paths, empty list if nothing
+            changed in time.
+
+        """
+        deadline = timeout is not None and time.time() + timeout
+        while True:
+            changed = self.poll()
+            if changed:
+                time.sleep(SETTLE_DELAY)
+                changed.update(self.poll())
+                return sorted(changed)
+
+            if deadline and time.time() > deadline:
+                return []
+            time.sleep(self.interval)
+
+    def close(self):
+        """Stops watching."""
+
+
+class InotifyWatcher(PollingWatcher):
+    """Watches files and directories using inotify, see :mod:`pyinotify`."""
+
+    def __init__(self, roots, skip_dirs=None, interval=POLL_INTERVAL,
+                 skip_files=None):
+        import pyinotify
+
+        PollingWatcher.__init__(self, roots, skip_dirs, interval, skip_files)
+        self._changed = set()
+
+        watcher = self
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                if watcher.watched(event.pathname):
+                    watcher._changed.add(event.pathname)
+
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE | \
+            pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM | \
+            pyinotify.IN_MOVED_TO | pyinotify.IN_ATTRIB
+
+        self._manager = pyinotify.WatchManager()
+        self._notifier = pyinotify.Notifier(self._manager, Handler(),
+                                            timeout=int(interval * 1000))
+
+        exclude = lambda path: self._skipped([os.path.basename(path)])
+        for root, recursive, _pattern in self.roots:
+            if os.path.isfile(root):
+                # Editors often replace the file, watch its directory instead
+                self._manager.add_watch(os.path.dirname(root), mask)
+            else:
+                self._manager.add_watch(root, mask, rec=recursive,
+                                        auto_add=recursive,
+                                        exclude_filter=exclude)
+
+    def snapshot(self):
+        return {}
+
+    def poll(self):
+        if self._notifier.check_events():
+            self._notifier.read_events()
+            self._notifier.process_events()
+        changed, self._changed = self._changed, set()
+        return changed
+
+    def close(self):
+        self._notifier.stop()
+
+
+def create_watcher(roots, skip_dirs=None, interval=POLL_INTERVAL,
+                   skip_files=None):
+    """Creates :class:`InotifyWatcher` if :mod:`pyinotify` is available,
+    otherwise :class:`PollingWatcher`.
+
+    :param roots: Paths to watch, see :class:`PollingWatcher`.
+    :param skip_dirs: Directory names that are not watched.
+    :param interval: Seconds between polls.
+    :param skip_files: Paths of the files that are not watched.
+
+    """
+    try:
+        import pyinotify #@UnusedImport pylint: disable-msg=W0612
+    except ImportError:
+        log.info("Module pyinotify is not installed, polling for changes.")
+        return PollingWatcher(roots, skip_dirs, interval, skip_files)
+
+    try:
+        return InotifyWatcher(roots, skip_dirs, interval, skip_files)
+    except (OSError, pyinotify.WatchManagerError), e:
+        log.warning("Unable to use inotify, polling for changes: %s", e)
+        return PollingWatcher(roots, skip_dirs, interval, skip_files)
+
+
+def module_roots(module_names):
+    """Watched paths of the module sources.
+
+    :param module_names: Root module names.
+    :returns: List of tuples of path and boolean, the package directories are
+        watched recursively.
+
+    """
+    roots = []
+    for module_name in module_names:
+        found = find_module_file(module_name)
+        if found is None:
+            log.warning("Source of module %s is not found, it is not watched.",
+                        module_name)
+            continue
+
+        filename, is_package = found
+        if is_package:
+            roots.append((os.path.dirname(filename), True))
+        else:
+            roots.append((filename, False))
+    return roots
+
+
+def purge_modules(module_names):
+    """Removes the modules and their submodules from :data:`sys.modules`, so
+    they are imported again with the changed sources.
+
+    :param module_names: Root module names.
+    :returns: List of removed module names.
+
+    """
+    purged = []
+    for name in sys.modules.keys():
+        for module_name in module_names:
+            if name == module_name or name.startswith(module_name + "."):
+                del sys.modules[name]
+                purged.append(name)
+                break
+    
+    # Sphinx caches the analyzed sources of modules, e.g. attribute docs
+    try:
+        from sphinx.pycode import ModuleAnalyzer
+        ModuleAnalyzer.cache.clear()
+    except (ImportError, AttributeError):
+        pass
+    
+    return purged
@@ -0,0 +1,197 @@
+"""Worker process finding :obj:`optparse.OptionParser` of scripts.
+
+Scripts are executed in worker processes started by
+:class:`~sphinkydocext.scripts.OptparserWorker`, so whatever the scripts
+import, allocate or mutate does not stay in the Sphinx process.
+
+.. note:: This module is loaded by file path in the worker process, and thus
+    must not import anything from Sphinkydoc.
+
+The worker speaks JSON lines. First line from the parent is::
+
+    {"sys_path": [...], "memory_limit": bytes or null}
+
+and each following line is a request ``{"script": path}``, which is answered
+with ``{"parser": description or null, "error": message or null}``.
+
+Worker runs many scripts, so after each script it restores the state scripts
+commonly change, see :func:`snapshot`: the modules the script imported are
+removed from :data:`sys.modules`, and :data:`sys.path`, :data:`sys.argv`,
+:data:`os.environ` and the working directory are put back. Attributes the
+script changes in modules imported before it, e.g. monkeypatches of the
+standard library, are not undone. The worker is replaced after
+:data:`~sphinkydocext.scripts.WORKER_MAX_REQUESTS` scripts to bound those.
+
+"""
+import json
+import optparse
+import os
+import sys
+
+
+def option_to_dict(option):
+    """Plain data description of :obj:`optparse.Option`."""
+    help = option.help # Pylint-disable: pylint: disable-msg=W0622
+    if help == optparse.SUPPRESS_HELP:
+        help = None
+    return {'short_opts' : list(option._short_opts),
+            'long_opts' : list(option._long_opts),
+            'metavar' : option.metavar, 'dest' : option.dest,
+            'help' : help, 'nargs' : option.nargs}
+
+
+def optparser_to_dict(parser, prog=None):
+    """Plain data description of :obj:`optparse.OptionParser`.
+
+    :param parser: :obj:`optparse.OptionParser`
+    :param prog: Program name ``%prog`` is expanded to, if the parser does
+        not define one. Usually the script name.
+    :returns: Dictionary, see
+        :meth:`sphinkydocext.scripts.OptionParserInfo.from_dict`.
+
+    """
+    if parser.prog is None and prog is not None:
+        parser.prog = prog
+
+    description = ""
+    if parser.description:
+        description = parser.get_description()
+
+    return {'usage' : parser.get_usage(), 'description' : description,
+            'option_list' : [option_to_dict(o) for o in parser.option_list],
+            'option_groups' : [{'title' : g.title,
+                                'description' : g.description,
+                                'option_list' : [option_to_dict(o)
+                                                 for o in g.option_list]}
+                               for g in parser.option_groups]}
+
+
+def find_optparser(script_path):
+    """Gets first :obj:`~optparse.OptionParser` from script, if possible.
+
+    Same as :func:`sphinkydocext.utils.script_get_optparser`, but restores
+    :data:`sys.argv` after the script.
+
+    :param script_path: Path to the script.
+    :returns: :const:`None`, or :obj:`optparse.OptionParser`
+
+    """
+    globs = {}
+    argv = sys.argv[:]
+    sys.argv[:] = [script_path]
+    try:
+        try:
+            execfile(script_path, globs)
+        except MemoryError:
+            raise
+        except:
+            return
+    finally:
+        sys.argv[:] = argv
+
+    for _n, val in globs.iteritems():
+        if isinstance(val, optparse.OptionParser):
+            return val
+
+
+def snapshot():
+    """State of the interpreter restored after each script, see
+    :func:`restore`."""
+    return {'modules' : dict(sys.modules), 'path' : sys.path[:],
+            'argv' : sys.argv[:], 'environ' : dict(os.environ),
+            'cwd' : os.getcwd()}
+
+
+def restore(state):
+    """Restores the state returned by :func:`snapshot`."""
+    for name in sys.modules.keys():
+        if name not in state['modules']:
+            del sys.modules[name]
+    sys.modules.update(state['modules'])
+    sys.path[:] = state['path']
+    sys.argv[:] = state['argv']
+
+    if os.environ != state['environ']:
+        os.environ.clear()
+        os.environ.update(state['environ'])
+
+    try:
+        os.chdir(state['cwd'])
+    except os.error:
+        pass
+
+
+def error_message(e):
+    """Message of the exception as unicode, non-UTF-8 bytes of the message
+    are replaced, so that the message can be written as JSON."""
+    try:
+        return unicode(e)
+    except UnicodeError:
+        return str(e).decode('utf-8', 'replace')
+
+
+def set_memory_limit(limit):
+    """Limits the address space of the process, if supported."""
+    try:
+        import resource
+    except ImportError:
+        return
+
+    try:
+        _soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    except (ValueError, resource.error):
+        pass
+
+
+def main():
+    """Serves requests from standard input until it is closed."""
+    # Scripts may print or read, keep the protocol channels to ourselves
+    requests = os.fdopen(os.dup(0), 'r')
+    responses = os.fdopen(os.dup(1), 'w')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    sys.stdin = os.fdopen(0, 'r')
+    sys.stdout = sys.stderr
+
+    init = json.loads(requests.readline() or "{}")
+    if init.get('sys_path'):
+        sys.path[:] = init['sys_path']
+    if init.get('memory_limit'):
+        set_memory_limit(init['memory_limit'])
+
+    state = snapshot()
+    for line in iter(requests.readline, ''):
+        script_path = json.loads(line)['script']
+        response = {'parser' : None, 'error' : None}
+
+        # Ignore the Exception catch, error is reported to the parent
+        # pylint: disable-msg=W0703
+        try:
+            try:
+                parser = find_optparser(script_path)
+                if parser is not None:
+                    prog = os.path.basename(script_path)
+                    response['parser'] = optparser_to_dict(parser, prog)
+            except MemoryError:
+                response['error'] = "Memory limit exceeded"
+            except Exception, e:
+                response['error'] = error_message(e)
+        finally:
+            restore(state)
+        # pylint: enable-msg=W0703
+
+        try:
+            output = json.dumps(response)
+        except UnicodeDecodeError:
+            # Parser of a script in legacy encoding, any bytes are Latin-1
+            output = json.dumps(response, encoding='latin-1')
+        responses.write(output + "\n")
+        responses.flush()
+
+
+if __name__ == '__main__':
+    main()
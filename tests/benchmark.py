@@ -0,0 +1,595 @@
+"""Benchmark of Sphinkydoc documentation generation.
+
+Generates a synthetic project of given shape, and times each stage of the
+documentation generation separately: importing :mod:`sphinkydocext` and
+running ``sphinkydoc.py --help`` in fresh interpreters, templating environment
+construction,
+:func:`~sphinkydocext.generate.caps_doc`,
+:func:`~sphinkydocext.utils.copy_tree`,
+:func:`~sphinkydocext.generate.all_doc`,
+:func:`~sphinkydocext.generate.recursive_module_doc`,
+:func:`~sphinkydocext.generate.script_doc`,
+:func:`~sphinkydocext.generate.index_doc` and the Sphinx build.
+Modules are imported, parsed and templates compiled again for each stage, as
+in a fresh build. The benchmark fails, if the stages do not produce the files
+of the requested shape.
+
+Results are written as JSON, which can be compared to the results of another
+run::
+
+    PYTHONPATH=src python tests/benchmark.py --packages 50 -o before.json
+    PYTHONPATH=src python tests/benchmark.py --packages 50 -o after.json \\
+        --compare before.json
+
+That importing the package and ``--help`` stay light is checked by
+:mod:`test_imports`.
+
+"""
+from StringIO import StringIO
+from timeit import default_timer
+import json
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+CAPS_NAMES = ['README', 'INSTALL', 'CHANGES', 'AUTHORS', 'COPYING', 'NEWS',
+              'TODO', 'THANKS', 'HACKING']
+"""Names of the generated caps files, further files are named ``EXTRAA``,
+``EXTRAB`` and so on."""
+
+CONF_PY = """
+extensions = ['sphinx.ext.autodoc', 'sphinx.ext.autosummary', 'sphinkydocext']
+source_suffix = '.rst'
+master_doc = 'index'
+project = 'Benchmark'
+"""
+"""Sphinx configuration of the benchmarked build."""
+
+STAGES = ['import', 'cli_help', 'templating_environment', 'caps_doc',
+          'copy_tree', 'all_doc', 'recursive_module_doc', 'script_doc',
+          'index_doc', 'sphinx']
+"""Timed stages, in order they are run."""
+
+PROBE = """
+from timeit import default_timer
+start = default_timer()
+import sys
+stdout, sys.stdout = sys.stdout, open(%(devnull)r, 'w')
+try:
+    %(code)s
+except SystemExit:
+    pass
+seconds = default_timer() - start
+sys.stdout = stdout
+import json
+print json.dumps({'seconds' : seconds, 'modules' : sorted(sys.modules)})
+"""
+"""Runs code in fresh interpreter, and prints the seconds it took and the
+loaded modules as JSON."""
+
+parser = optparse.OptionParser(
+    usage="%prog [options]",
+    description="Times the stages of documentation generation of a "
+                "synthetic project, and prints the results as JSON.")
+
+shape = optparse.OptionGroup(parser, "Project shape")
+shape.add_option("--packages", type="int", default=10, metavar="N",
+                 help="number of top level packages [default: %default]")
+shape.add_option("--depth", type="int", default=2, metavar="D",
+                 help="depth of subpackages in each package "
+                      "[default: %default]")
+shape.add_option("--modules", type="int", default=2, metavar="N",
+                 help="number of modules in each package [default: %default]")
+shape.add_option("--members", type="int", default=10, metavar="M",
+                 help="number of members in each module [default: %default]")
+shape.add_option("--scripts", type="int", default=5, metavar="K",
+                 help="number of optparse scripts [default: %default]")
+shape.add_option("--caps", type="int", default=5, metavar="C",
+                 help="number of caps files [default: %default]")
+shape.add_option("--caps-lines", type="int", default=1000, metavar="N",
+                 help="number of lines in the CHANGES caps file "
+                      "[default: %default]")
+shape.add_option("--docs", type="int", default=20, metavar="N",
+                 help="number of additional docs files [default: %default]")
+parser.add_option_group(shape)
+
+parser.add_option("-r", "--repeat", type="int", default=3,
+                  help="number of times each stage is run, the fastest run "
+                       "is reported [default: %default]")
+parser.add_option("-j", "--jobs", type="int", default=1,
+                  help="number of processes generating the module documents "
+                       "[default: %default]")
+parser.add_option("--no-sphinx", dest="sphinx", action="store_false",
+                  default=True, help="don't time the Sphinx build")
+parser.add_option("-o", "--output", metavar="FILE",
+                  help="write the results to file instead of standard output")
+parser.add_option("-c", "--compare", metavar="FILE",
+                  help="compare the results to previous results in file")
+parser.add_option("-k", "--keep", action="store_true", default=False,
+                  help="don't remove the generated project, its path is "
+                       "printed")
+
+
+def _letters(index):
+    """Uppercase letters for the index, ``A``, ``B``, ..., ``BA``."""
+    letters = ""
+    while True:
+        letters = chr(ord('A') + index % 26) + letters
+        index //= 26
+        if not index:
+            return letters
+
+
+def _write(filepath, content):
+    directory = os.path.dirname(filepath)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    f = open(filepath, 'w+')
+    f.write(content)
+    f.close()
+
+
+def module_source(name, members, submodules=()):
+    """Source of a synthetic module with given number of members.
+
+    :param submodules: Names of the submodules of package, added to
+        ``__all__`` so that :func:`~sphinkydocext.generate.recursive_module_doc`
+        follows them.
+
+    """
+    lines = ['"""Synthetic module %s.\n\nGenerated by the benchmark."""' %
+             name, '']
+    names = []
+    for i in range(members):
+        kind = i % 3
+        if kind == 0:
+            names.append('function%d' % i)
+            lines.extend(['def function%d(first, second=None):' % i,
+                          '    """Function %d.' % i, '',
+                          '    :param first: First argument.',
+                          '    :param second: Second argument.',
+                          '    :returns: Something.', '', '    """',
+                          '    return first', ''])
+        elif kind == 1:
+            names.append('Class%d' % i)
+            lines.extend(['class Class%d(object):' % i,
+                          '    """Class %d."""' % i, '',
+                          '    attribute = None',
+                          '    """Attribute of the class."""', '',
+                          '    def method(self, argument):',
+                          '        """Method of the class."""',
+                          '        return argument', ''])
+        else:
+            names.append('CONSTANT%d' % i)
+            lines.extend(['CONSTANT%d = %d' % (i, i),
+                          '"""Constant %d."""' % i, ''])
+    lines.append('__all__ = %r' % (names + list(submodules)))
+    return "\n".join(lines) + "\n"
+
+
+def script_source(index):
+    """Source of a synthetic optparse script.
+
+    Every other script adds its options in a loop, so that the parser cannot
+    be resolved statically and the script is run, see
+    :func:`~sphinkydocext.scripts.gather_scripts`.
+
+    """
+    lines = ['"""Synthetic script %d."""' % index,
+             'import optparse', '',
+             'parser = optparse.OptionParser(usage="%prog [options] files",',
+             '    description="Synthetic script number %d.")' % index,
+             'parser.add_option("-v", "--verbose", action="store_true",',
+             '                  help="verbose output")',
+             'parser.add_option("-o", "--output", metavar="FILE",',
+             '                  help="output file")',
+             'group = optparse.OptionGroup(parser, "Advanced options")',
+             'group.add_option("--level", type="int", default=1,',
+             '                 help="level of something")',
+             'parser.add_option_group(group)']
+    if index % 2:
+        lines.extend(['for name in ("alpha", "beta", "gamma"):',
+                      '    parser.add_option("--" + name, help=name)'])
+    lines.extend(['', 'if __name__ == "__main__":',
+                  '    options, args = parser.parse_args()', ''])
+    return "\n".join(lines)
+
+
+def generate_project(root, packages=10, depth=2, modules=2, members=10,
+                     scripts=5, caps=5, caps_lines=1000, docs=20):
+    """Generates synthetic project.
+
+    :param root: Directory of the project, created if it does not exist.
+    :param packages: Number of top level packages, named ``benchpkgN``.
+    :param depth: Depth of subpackages, each package has one subpackage
+        ``sub`` until the depth.
+    :param modules: Number of modules in each package.
+    :param members: Number of members in each module.
+    :param scripts: Number of optparse scripts.
+    :param caps: Number of caps files.
+    :param caps_lines: Number of lines in the CHANGES caps file.
+    :param docs: Number of additional docs files.
+    :returns: Dictionary of the generated paths: ``src_dir`` containing the
+        packages, ``packages`` names, ``scripts`` paths, ``caps_dir`` and
+        ``docs_dir``.
+
+    """
+    src_dir = os.path.join(root, 'src')
+    package_names = []
+    for p in range(packages):
+        package_names.append('benchpkg%d' % p)
+        package_dir = os.path.join(src_dir, 'benchpkg%d' % p)
+        for level in range(depth + 1):
+            name = ".".join(['benchpkg%d' % p] + ['sub'] * level)
+            submodules = ['module%d' % m for m in range(modules)]
+            if level < depth:
+                submodules.append('sub')
+            _write(os.path.join(package_dir, '__init__.py'),
+                   module_source(name, members, submodules))
+            for m in range(modules):
+                _write(os.path.join(package_dir, 'module%d.py' % m),
+                       module_source("%s.module%d" % (name, m), members))
+            package_dir = os.path.join(package_dir, 'sub')
+
+    script_paths = []
+    for k in range(scripts):
+        script_path = os.path.join(root, 'scripts', 'benchscript%d.py' % k)
+        _write(script_path, script_source(k))
+        script_paths.append(script_path)
+
+    caps_dir = os.path.join(root, 'caps')
+    for c in range(caps):
+        if c < len(CAPS_NAMES):
+            name = CAPS_NAMES[c]
+        else:
+            name = 'EXTRA' + _letters(c - len(CAPS_NAMES))
+        lines = caps_lines if name == 'CHANGES' else 10
+        _write(os.path.join(caps_dir, name),
+               "".join("Line %d of %s caps file.\n" % (i, name)
+                       for i in range(lines)))
+
+    docs_dir = os.path.join(root, 'docs')
+    for d in range(docs):
+        docname = 'topic%d' % (d // 10) + '/' + ('index' if d % 10 == 0 else
+                                               'doc%d' % d)
+        _write(os.path.join(docs_dir, *docname.split('/')) + '.rst',
+               "Document %d\n===========\n\nText of the document.\n" % d)
+
+    return {'src_dir' : src_dir, 'packages' : package_names,
+            'scripts' : script_paths, 'caps_dir' : caps_dir,
+            'docs_dir' : docs_dir}
+
+
+def expected_files(shape):
+    """Number of files the generation stages must produce for the shape.
+
+    :param shape: Keyword arguments of :func:`generate_project`.
+    :returns: Dictionary of stage names and file counts.
+
+    """
+    module_count = shape['packages'] * (shape['depth'] + 1) * \
+        (shape['modules'] + 1)
+    return {'recursive_module_doc' : module_count,
+            'script_doc' : shape['scripts'],
+            'all_doc' : module_count + shape['scripts'],
+            'caps_doc' : shape['caps'],
+            'copy_tree' : shape['docs']}
+
+
+def check_files(stages, shape):
+    """Differences of the produced file counts to the shape.
+
+    :param stages: Stages of the results, see :func:`benchmark`.
+    :param shape: Keyword arguments of :func:`generate_project`.
+    :returns: List of error messages, empty if the counts match.
+
+    """
+    errors = []
+    for stage, expected in sorted(expected_files(shape).iteritems()):
+        if stage in stages and stages[stage]['files'] != expected:
+            errors.append("Stage %s produced %d files, expected %d." %
+                          (stage, stages[stage]['files'], expected))
+    return errors
+
+
+def _count_files(directory):
+    count = 0
+    for _dirpath, _dirnames, filenames in os.walk(directory):
+        count += len(filenames)
+    return count
+
+
+def probe(code):
+    """Runs code in fresh interpreter, see :data:`PROBE`.
+
+    :returns: Tuple of seconds and list of loaded module names.
+
+    """
+    process = subprocess.Popen([sys.executable, '-c',
+                                PROBE % {'code' : code,
+                                         'devnull' : os.devnull}],
+                               stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode:
+        raise RuntimeError("Probe failed: %s" % code)
+    result = json.loads(output)
+    return result['seconds'], result['modules']
+
+
+def import_probes():
+    """Codes of the import stages.
+
+    :returns: Dictionary of stage names and code, ``cli_help`` is missing if
+        ``sphinkydoc.py`` is not found next to the package.
+
+    """
+    import sphinkydocext
+
+    probes = {'import' : "import sphinkydocext"}
+    script = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(sphinkydocext.__file__))), 'sphinkydoc.py')
+    if os.path.isfile(script):
+        probes['cli_help'] = ("sys.argv = [%r, '--help']; "
+                              "execfile(sys.argv[0], {'__name__' : '__main__'})"
+                              % script)
+    return probes
+
+
+def run_stages(project, work_dir, jobs=1, sphinx=True):
+    """Runs each stage once in a fresh source directory.
+
+    :param project: Generated project, see :func:`generate_project`.
+    :param work_dir: Directory, where the source directory is created.
+    :param jobs: Number of processes generating the module documents.
+    :param sphinx: Run also the Sphinx build.
+    :returns: Dictionary of stage names and tuples of seconds and number of
+        files the stage produced, the import stages report the number of
+        loaded modules.
+
+    """
+    from sphinkydocext import generate, static, templating, utils, watch
+    from sphinkydocext import COPYING, ALL, ALL_ROOT, ALL_SUBINDEX
+
+    results = {}
+    for stage, code in import_probes().iteritems():
+        seconds, modules = probe(code)
+        results[stage] = (seconds, len(modules))
+
+    source_dir = tempfile.mkdtemp(prefix='source', dir=work_dir)
+    scratch_dir = tempfile.mkdtemp(prefix='scratch', dir=work_dir)
+    for directory in (source_dir, scratch_dir):
+        os.makedirs(os.path.join(directory, 'api'))
+        os.makedirs(os.path.join(directory, 'scripts'))
+
+    def cold():
+        """Forgets the imported and parsed modules and the compiled
+        templates, so that each stage starts as in a fresh build."""
+        watch.purge_modules(project['packages'])
+        static._parsed.clear()
+        templating.invalidate_templating_environments()
+        return templating.templating_environment()
+
+    def timed(stage, func, *args, **kwargs):
+        start = default_timer()
+        value = func(*args, **kwargs)
+        seconds = default_timer() - start
+        files = value if isinstance(value, int) else len(value or [])
+        results[stage] = (seconds, files)
+        return value
+
+    cold()
+    templating.invalidate_templating_environments()
+    tenv = timed('templating_environment',
+                 lambda: [templating.templating_environment()])[0]
+
+    caps_files = timed('caps_doc', generate.caps_doc, tenv,
+                       project['caps_dir'], output_dir=source_dir)
+    docs_files = timed('copy_tree', utils.copy_tree, project['docs_dir'],
+                       source_dir)
+
+    def _all_doc():
+        module_files, script_files = generate.all_doc(
+            tenv, project['packages'], project['scripts'],
+            module_output_dir='api/', script_output_dir='scripts/',
+            source_dir=source_dir, jobs=jobs)
+        return module_files + script_files
+    tenv = cold()
+    generated = timed('all_doc', _all_doc)
+
+    def _recursive_module_doc():
+        module_files = []
+        for package in project['packages']:
+            module_files.extend(generate.recursive_module_doc(
+                tenv, package, output_dir='api/', source_dir=scratch_dir))
+        return module_files
+    tenv = cold()
+    timed('recursive_module_doc', _recursive_module_doc)
+
+    def _script_doc():
+        return [generate.script_doc(tenv, script_path, output_dir='scripts/',
+                                    source_dir=scratch_dir)
+                for script_path in project['scripts']]
+    tenv = cold()
+    timed('script_doc', _script_doc)
+
+    # Categorized as by builder_inited with the default configuration
+    truncate_path_rst = lambda p: utils.truncate_path(
+        p, directory=source_dir, extension='rst')
+    generated_files = set(utils.path_to_posix(truncate_path_rst(p))
+                          for p in generated)
+    caps_names = map(utils.path_to_posix,
+                     filter(lambda p: not p.endswith('.rst'),
+                            map(truncate_path_rst, caps_files)))
+    docs_names = [p for p in map(utils.path_to_posix,
+                                 filter(lambda p: not p.endswith('.rst'),
+                                        map(truncate_path_rst, docs_files)))
+                  if p not in generated_files]
+    category_matchers_caps = {
+        'included': utils.multi_matcher(['README']),
+        'about': utils.multi_matcher(['AUTHORS', 'THANKS', COPYING,
+                                      'LICENSE']),
+        'topic': utils.multi_matcher([ALL]),
+    }
+    category_matchers = {
+        'included': utils.multi_matcher([]),
+        'about': utils.multi_matcher([]),
+        'topic': utils.multi_matcher([ALL_ROOT, ALL_SUBINDEX]),
+    }
+
+    def _index_doc():
+        categorized = {}
+        for _files, _matchers in ((caps_names, category_matchers_caps),
+                                  (docs_names, category_matchers)):
+            for cat, items in utils.categorize(
+                    _files, _matchers, ('included', 'about', 'topic')
+                    ).iteritems():
+                categorized.setdefault("%s_files" % cat, []).extend(items)
+        for inc in categorized.get('included_files', []):
+            generate.included_doc(tenv, inc, source_dir)
+
+        tcontext = {
+            'caps_files' : caps_names,
+            'docs_files' : docs_names,
+            'modules_dir' : 'api/',
+            'scripts_dir' : 'scripts/',
+            'scripts' : project['scripts'],
+            'modules' : project['packages'],
+        }
+        tcontext.update(categorized)
+        return [generate.index_doc(tenv, tcontext, output_dir=source_dir)]
+    tenv = cold()
+    timed('index_doc', _index_doc)
+
+    if sphinx:
+        from sphinx.application import Sphinx
+
+        _write(os.path.join(source_dir, 'conf.py'), CONF_PY)
+        output_dir = os.path.join(work_dir, 'html')
+
+        def _sphinx():
+            app = Sphinx(source_dir, source_dir, output_dir,
+                         os.path.join(output_dir, '.doctrees'), 'html', {},
+                         StringIO(), StringIO(), True)
+            app.build()
+            return _count_files(output_dir)
+        timed('sphinx', _sphinx)
+        shutil.rmtree(output_dir)
+
+    shutil.rmtree(source_dir)
+    shutil.rmtree(scratch_dir)
+    return results
+
+
+def project_shape(options):
+    """Keyword arguments of :func:`generate_project` from the options."""
+    return dict((name, getattr(options, name)) for name in
+                ('packages', 'depth', 'modules', 'members', 'scripts',
+                 'caps', 'caps_lines', 'docs'))
+
+
+def benchmark(options):
+    """Generates the project and runs the stages repeatedly.
+
+    :param options: Parsed options of :data:`parser`.
+    :returns: Results as dictionary, written as JSON.
+
+    """
+    shape_ = project_shape(options)
+
+    root = tempfile.mkdtemp(prefix='sphinkydoc-benchmark-')
+    try:
+        project = generate_project(os.path.join(root, 'project'), **shape_)
+        sys.path.insert(0, project['src_dir'])
+
+        runs = {}
+        for _i in range(options.repeat):
+            for stage, result in run_stages(project, root, options.jobs,
+                                            options.sphinx).iteritems():
+                runs.setdefault(stage, []).append(result)
+    finally:
+        if options.keep:
+            print >> sys.stderr, "Generated project kept in %s" % root
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    stages = {}
+    for stage, results in runs.iteritems():
+        stages[stage] = {'seconds' : min(s for s, _f in results),
+                         'runs' : [s for s, _f in results],
+                         'files' : results[-1][1]}
+
+    try:
+        import sphinx
+        sphinx_version = sphinx.__version__
+    except ImportError:
+        sphinx_version = None
+
+    return {'shape' : shape_, 'repeat' : options.repeat,
+            'jobs' : options.jobs, 'python' : platform.python_version(),
+            'sphinx' : sphinx_version, 'stages' : stages,
+            'total' : sum(s['seconds'] for s in stages.itervalues())}
+
+
+def compare(results, previous):
+    """Formats comparison of the results to previous results.
+
+    :returns: Table of stages, with previous and current seconds and their
+        ratio, as string.
+
+    """
+    rows = ["%-24s %10s %10s %8s" % ("stage", "previous", "current", "ratio")]
+    seconds = lambda r, stage: r.get('stages', {}).get(stage, {}).get('seconds')
+    stages = [s for s in STAGES if s in results['stages']]
+
+    # Total of the stages timed in both
+    common = [s for s in stages if seconds(previous, s) is not None]
+    totals = (sum(seconds(previous, s) for s in common),
+              sum(seconds(results, s) for s in common))
+
+    for stage in stages + ['total']:
+        if stage == 'total':
+            before, current = totals
+        else:
+            before, current = seconds(previous, stage), seconds(results, stage)
+
+        if before:
+            rows.append("%-24s %10.3f %10.3f %7.2fx" %
+                        (stage, before, current, current / before))
+        else:
+            rows.append("%-24s %10s %10.3f %8s" % (stage, "-", current, "-"))
+
+    if previous.get('shape') != results['shape']:
+        rows.append("Warning: the project shapes differ.")
+    return "\n".join(rows)
+
+
+def main():
+    options, _args = parser.parse_args()
+
+    results = benchmark(options)
+    errors = check_files(results['stages'], results['shape'])
+    if errors:
+        print >> sys.stderr, "\n".join(errors)
+        sys.exit(1)
+    output = json.dumps(results, indent=1, sort_keys=True)
+
+    if options.output:
+        _write(os.path.abspath(options.output), output + "\n")
+    else:
+        print output
+
+    if options.compare:
+        f = open(options.compare, 'r')
+        try:
+            previous = json.load(f)
+        finally:
+            f.close()
+        print >> sys.stderr, compare(results, previous)
+
+
+if __name__ == '__main__':
+    main()
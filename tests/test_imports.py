@@ -0,0 +1,94 @@
+"""Tests that importing :mod:`sphinkydocext` and running ``sphinkydoc.py
+--help`` stay light, and that the package names are still reachable.
+
+Each check runs in a fresh interpreter, as the test process itself may have
+loaded anything already::
+
+    PYTHONPATH=src python -m unittest discover -s tests
+
+"""
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'src')
+"""Directory of the package and ``sphinkydoc.py``."""
+
+HEAVY_MODULES = ['sphinx', 'docutils', 'jinja2', 'multiprocessing']
+"""Modules that importing :mod:`sphinkydocext` or ``sphinkydoc.py --help``
+must not load, they are imported when documentation is generated."""
+
+PROBE = """
+import sys
+stdout, sys.stdout = sys.stdout, open(%(devnull)r, 'w')
+try:
+    exec %(code)r
+except SystemExit:
+    pass
+sys.stdout = stdout
+import json
+print json.dumps(sorted(sys.modules))
+"""
+"""Runs code in fresh interpreter, and prints the loaded modules as JSON."""
+
+
+def loaded_modules(code):
+    """Names of the modules loaded by the code in fresh interpreter."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [SRC_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    process = subprocess.Popen([sys.executable, '-c',
+                                PROBE % {'code' : code,
+                                         'devnull' : os.devnull}],
+                               stdout=subprocess.PIPE, env=env)
+    output = process.communicate()[0]
+    if process.returncode:
+        raise AssertionError("Probe failed: %s" % code)
+    return json.loads(output)
+
+
+class ImportTest(unittest.TestCase):
+
+    def assertLight(self, code):
+        modules = loaded_modules(code)
+        loaded = [m for m in HEAVY_MODULES if m in modules]
+        self.assertEqual(loaded, [], "%s loads %s" % (code, ", ".join(loaded)))
+
+    def test_import_package(self):
+        self.assertLight("import sphinkydocext")
+
+    def test_cli_help(self):
+        script = os.path.join(SRC_DIR, 'sphinkydoc.py')
+        self.assertLight("sys.argv = [%r, '--help']; "
+                         "execfile(sys.argv[0], {'__name__' : '__main__'})"
+                         % script)
+
+    def test_submodule_attributes(self):
+        modules = loaded_modules(
+            "import sphinkydocext\n"
+            "assert sphinkydocext.utils.__name__ == 'sphinkydocext.utils'\n"
+            "assert hasattr(sphinkydocext, 'generate')\n"
+            "assert hasattr(sphinkydocext, 'templating')\n"
+            "assert not hasattr(sphinkydocext, 'no_such_name')")
+        self.assertTrue('sphinkydocext.generate' in modules)
+
+    def test_reexports(self):
+        loaded_modules(
+            "from sphinkydocext import caps_doc, templating_environment, "
+            "copy_tree, multi_matcher, sync_tree, categorize, "
+            "path_to_posix, truncate_path, directory_slash_suffix, "
+            "Manifest, ModuleCache, ScriptCache, HELP_TIMEOUT, "
+            "WORKER_MEMORY_LIMIT\n"
+            "from sphinkydocext.generate import caps_doc as generate_doc\n"
+            "assert caps_doc is generate_doc")
+
+    def test_import_all(self):
+        modules = loaded_modules("from sphinkydocext import *")
+        self.assertTrue('sphinkydocext.depends' in modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
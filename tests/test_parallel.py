@@ -0,0 +1,162 @@
+"""Tests that building with parallel Sphinx processes gives the same pages as
+a serial build, see ``parallel_read_safe`` and ``parallel_write_safe`` of
+:func:`sphinkydocext.setup`.
+
+The example package, the caps files of the repository and ``sphinkydoc.py``
+are documented by the extension, so the pages use the module, script and
+usage directives and the generated toctrees. Sphinx writes in parallel since
+1.2 and reads since 1.3, with older versions the reading test is skipped::
+
+    PYTHONPATH=src python -m unittest discover -s tests
+
+"""
+from StringIO import StringIO
+import filecmp
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TESTS_DIR)
+
+CONF_PY = """
+extensions = ['sphinx.ext.autodoc', 'sphinx.ext.autosummary', 'sphinkydocext']
+source_suffix = '.rst'
+master_doc = 'index'
+project = 'Parallel'
+
+import os
+
+def record_process(app, filename):
+    f = open(os.path.join(app.confdir, filename), 'a')
+    try:
+        print >> f, os.getpid()
+    finally:
+        f.close()
+
+def setup(app):
+    app.connect('source-read', 
+                lambda app, docname, source: record_process(app, 'readers.txt'))
+    app.connect('html-page-context', 
+                lambda app, *args: record_process(app, 'writers.txt'))
+"""
+"""Sphinx configuration of the builds, records the process ids reading the
+documents to ``readers.txt`` and writing the pages to ``writers.txt``."""
+
+JOBS = 4
+"""Number of Sphinx processes of the parallel build."""
+
+
+def extension_build(work_dir, parallel=1):
+    """Builds the example project with the extension generating the
+    documents.
+
+    :param work_dir: Directory, where the source and output directories are
+        created.
+    :param parallel: Number of Sphinx processes.
+    :returns: Tuple of output directory, and sets of process ids that read
+        the documents and wrote the pages.
+
+    """
+    from sphinx.application import Sphinx
+
+    source_dir = tempfile.mkdtemp(prefix='source', dir=work_dir)
+    output_dir = tempfile.mkdtemp(prefix='html', dir=work_dir)
+    f = open(os.path.join(source_dir, 'conf.py'), 'w+')
+    try:
+        f.write(CONF_PY)
+    finally:
+        f.close()
+
+    confoverrides = {
+        'sphinkydoc_modules' : ['examplepackage'],
+        'sphinkydoc_scripts' : [os.path.join(ROOT_DIR, 'src',
+                                             'sphinkydoc.py')],
+        'sphinkydoc_caps_dir' : ROOT_DIR,
+        'sphinkydoc_modules_dir' : 'api/',
+        'sphinkydoc_scripts_dir' : 'scripts/',
+        'sphinkydoc_index' : True,
+    }
+    app = Sphinx(source_dir, source_dir, output_dir,
+                 os.path.join(output_dir, '.doctrees'), 'html',
+                 confoverrides, StringIO(), StringIO(), True,
+                 parallel=parallel)
+    app.build()
+
+    processes = []
+    for filename in ('readers.txt', 'writers.txt'):
+        f = open(os.path.join(source_dir, filename))
+        try:
+            processes.append(set(int(line) for line in f))
+        finally:
+            f.close()
+    return (output_dir,) + tuple(processes)
+
+
+def html_pages(directory):
+    """Paths of the HTML pages relative to the directory."""
+    return set(os.path.relpath(os.path.join(dirpath, f), directory)
+               for dirpath, _dirnames, filenames in os.walk(directory)
+               for f in filenames if f.endswith('.html'))
+
+
+class ParallelBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        if TESTS_DIR not in sys.path:
+            sys.path.insert(0, TESTS_DIR)
+        self.work_dir = tempfile.mkdtemp(prefix='sphinkydoc-parallel-')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def assertSamePages(self, serial_dir, parallel_dir):
+        serial, parallel = html_pages(serial_dir), html_pages(parallel_dir)
+        self.assertTrue(serial)
+        self.assertEqual(serial, parallel)
+        differ = [p for p in sorted(serial)
+                  if not filecmp.cmp(os.path.join(serial_dir, p),
+                                     os.path.join(parallel_dir, p), False)]
+        self.assertEqual(differ, [])
+
+    def test_setup_metadata(self):
+        from sphinx.application import Sphinx
+        import sphinkydocext
+
+        # Sphinx 1.2 ignores the metadata, so the extension is set up directly
+        source_dir = tempfile.mkdtemp(prefix='source', dir=self.work_dir)
+        open(os.path.join(source_dir, 'conf.py'), 'w').close()
+        app = Sphinx(source_dir, source_dir, 
+                     os.path.join(self.work_dir, 'html'),
+                     os.path.join(self.work_dir, 'doctrees'), 'html', {},
+                     StringIO(), StringIO(), True)
+        metadata = sphinkydocext.setup(app)
+        self.assertEqual(metadata['version'], sphinkydocext.__version__)
+        self.assertTrue(metadata['parallel_read_safe'])
+        self.assertTrue(metadata['parallel_write_safe'])
+
+    def test_write_parallel(self):
+        serial_dir, _readers, _writers = extension_build(self.work_dir)
+        parallel_dir, _readers, writers = extension_build(self.work_dir, JOBS)
+
+        # Pages were written by the forked processes
+        self.assertTrue(writers - set([os.getpid()]))
+        self.assertSamePages(serial_dir, parallel_dir)
+
+    def test_read_parallel(self):
+        import sphinx
+        if sphinx.version_info[:2] < (1, 3):
+            self.skipTest("Sphinx %s reads serially" % sphinx.__version__)
+
+        serial_dir, _readers, _writers = extension_build(self.work_dir)
+        parallel_dir, readers, _writers = extension_build(self.work_dir, JOBS)
+
+        # Documents were read by the forked processes
+        self.assertTrue(readers - set([os.getpid()]))
+        self.assertSamePages(serial_dir, parallel_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
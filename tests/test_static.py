@@ -0,0 +1,55 @@
+"""Tests that static introspection gives the same members as importing, see
+:func:`sphinkydocext.static.get_static_module_members`::
+
+    PYTHONPATH=src python -m unittest discover -s tests
+
+"""
+import os
+import pkgutil
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+if TESTS_DIR not in sys.path:
+    sys.path.insert(0, TESTS_DIR)
+
+
+def package_modules(package_name):
+    """Full names of the package and its submodules, recursively."""
+    package = __import__(package_name, fromlist=['__name__'])
+    names = [package_name]
+    for _imp, name, _isp in pkgutil.walk_packages(package.__path__,
+                                                  package_name + "."):
+        names.append(name)
+    return names
+
+
+class StaticMembersTest(unittest.TestCase):
+
+    def assertSameMembers(self, module_name):
+        from sphinkydocext.static import get_static_module_members
+        from sphinkydocext.utils import get_module_members
+
+        module = __import__(module_name, fromlist=['__name__'])
+        static_name, static_members = get_static_module_members(module_name)
+        self.assertEqual(static_name, module_name)
+        self.assertEqual(static_members, get_module_members(module))
+
+    def test_examplepackage(self):
+        names = package_modules('examplepackage')
+        self.assertTrue('examplepackage.subpackage.somemodule' in names)
+        for module_name in names:
+            self.assertSameMembers(module_name)
+
+    def test_imported_data(self):
+        # Imported constants and patterns are members, logger is not
+        self.assertSameMembers('sphinkydocext.generate')
+        self.assertSameMembers('sphinkydocext.directives.sphinkydoc')
+
+    def test_package_logger(self):
+        self.assertSameMembers('sphinkydocext')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""Tests that the worker process of
+:class:`~sphinkydocext.scripts.OptparserWorker` answers, and stays alive,
+when the scripts produce text that is not UTF-8::
+
+    PYTHONPATH=src python -m unittest discover -s tests
+
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+PARSER_SCRIPT = """
+import optparse
+parser = optparse.OptionParser(usage="%%prog [options]")
+parser.add_option("-v", "--verbose", help=%r, action="store_true")
+"""
+"""Script with optparser, formatted with the help of the option."""
+
+FAILING_SCRIPT = """
+import optparse
+
+class FailingParser(optparse.OptionParser):
+    def get_usage(self):
+        raise ValueError("Unable to read \\xe4\\xf6 from file")
+
+parser = FailingParser()
+"""
+"""Script with optparser, whose usage raises an exception with Latin-1 bytes
+in the message."""
+
+
+class WorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        from sphinkydocext.scripts import OptparserWorker
+        self.script_dir = tempfile.mkdtemp(prefix='sphinkydoc-worker-')
+        self.worker = OptparserWorker(None)
+
+    def tearDown(self):
+        self.worker.close()
+        shutil.rmtree(self.script_dir, ignore_errors=True)
+
+    def script(self, name, source):
+        script_path = os.path.join(self.script_dir, name)
+        f = open(script_path, 'w')
+        try:
+            f.write(source)
+        finally:
+            f.close()
+        return script_path
+
+    def assertParser(self, help_text):
+        info = self.worker.optparser(
+            self.script('ok.py', PARSER_SCRIPT % help_text), timeout=10)
+        self.assertEqual(info.option_list[-1].help, help_text)
+
+    def test_non_utf8_error(self):
+        failing = self.script('failing.py', FAILING_SCRIPT)
+        self.assertEqual(self.worker.optparser(failing, timeout=10), None)
+
+        # Worker still answers
+        self.assertParser(u"Verbose output")
+
+    def test_non_utf8_parser(self):
+        info = self.worker.optparser(
+            self.script('latin1.py', PARSER_SCRIPT % "Sch\xf6n"), timeout=10)
+        self.assertEqual(info.option_list[-1].help, u"Sch\xf6n")
+
+        self.assertParser(u"Verbose output")
+
+
+if __name__ == '__main__':
+    unittest.main()